@@ -0,0 +1,55 @@
+import gzip
+import os
+import pickle
+import struct
+
+# Checkpoint of a simulation run (see SimulationCore.get_state). Resuming from a checkpoint continues the run exactly
+# as if it had not been interrupted, and many runs with different parameters can be started from the same checkpoint.
+# Layout: header (magic, version) followed by the gzip compressed pickle of the state.
+# The version is increased whenever the state changes so that older checkpoints can no longer be resumed from.
+CHECKPOINT_MAGIC = b'ECRCKPT\0'
+CHECKPOINT_VERSION = 2
+HEADER = struct.Struct('<8sI')
+
+
+# Save state of simulation to file. The file is written next to its destination and then moved into place, so an
+# interrupted save leaves an earlier checkpoint intact.
+def save(sim, f_n):
+    tmp_fn = f_n + '.tmp'
+    with open(tmp_fn, 'wb') as f:
+        f.write(HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION))
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0) as gz:
+            pickle.dump(sim.get_state(), gz, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_fn, f_n)
+
+
+# Load simulation state from file. Pass it to SimulationCore.set_state to resume.
+def load(f_n):
+    with open(f_n, 'rb') as f:
+        magic, version = HEADER.unpack(f.read(HEADER.size))
+        assert magic == CHECKPOINT_MAGIC, 'File [{}] is not a simulation checkpoint!'.format(f_n)
+        assert version == CHECKPOINT_VERSION, 'Checkpoint [{}] has version [{}] but version [{}] is needed!'.format(f_n, version, CHECKPOINT_VERSION)
+        with gzip.GzipFile(fileobj=f, mode='rb') as gz:
+            return pickle.load(gz)
+
+
+# Observer saving a checkpoint of the simulation every interval time steps. f_n may contain {ts} to keep a file for
+# every checkpoint rather than replacing the last one. Time steps skipped by fast-forwarding are not saved.
+class Checkpointer:
+    def __init__(self, sim, interval, f_n):
+        assert interval > 0, 'Checkpoint interval must be positive!'
+        self.sim = sim
+        self.interval = interval
+        self.f_n = f_n
+        self.last_ts = sim.ts
+        self.num_saved = 0
+
+    def install(self):
+        self.sim.add_observer(self.on_sim_step)
+
+    def on_sim_step(self, sim):
+        if sim.done or sim.ts - self.last_ts < self.interval:
+            return
+        save(sim, self.f_n.format(ts=sim.ts))
+        self.last_ts = sim.ts
+        self.num_saved += 1
@@ -22,6 +22,18 @@ TEXT_SIZE_DETAILED = 20
 # Size of each node's rectangle.
 NODE_RECT_SIZE = 40
 
+# Size of the grid cells the network view is split into. Only cells in view are drawn.
+RENDER_CELL_SIZE = 500
+
+# Zoom (world units per screen pixel) limits and factor per mouse wheel step. The most zoomed out view shows the whole
+# world width or height. Node labels are drawn up to ZOOM_LABELS_MAX. Beyond ZOOM_DETAIL_MAX nodes are drawn as one dot
+# per CLUSTER_SIZE square of the world and links are not drawn.
+ZOOM_MIN = 0.5
+ZOOM_CHANGE_RATE = 1.25
+ZOOM_LABELS_MAX = 1.5
+ZOOM_DETAIL_MAX = 2.0
+CLUSTER_SIZE = 100
+
 # Indicates no special key pressed (ex: shift, ctr).
 MODIFIER_NO = 16
 
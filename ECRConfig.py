@@ -0,0 +1,26 @@
+import Constants as C
+
+
+# ECR algorithm parameters for a single simulation run. See associated paper for full details on what they represent.
+# Any parameter not given is taken from the ECR_* values in Constants, so runs with different parameters can exist
+# side by side (for example in parameter sweeps) without changing the module globals.
+class ECRConfig:
+    # Names of parameters. Each has a matching ECR_<name> default in Constants.
+    PARAMS = ('d_c', 'd_p', 'alpha', 'gamma', 'RD_Timeout', 'RD_Resend', 'RU_MinInterval')
+
+    def __init__(self, **params):
+        for p in self.PARAMS:
+            setattr(self, p, params.pop(p) if p in params else getattr(C, 'ECR_' + p))
+        assert not params, 'Unknown ECR parameters: {}'.format(sorted(params))
+
+    # Returns parameters as a dictionary.
+    def as_dict(self):
+        return {p: getattr(self, p) for p in self.PARAMS}
+
+    # String representation.
+    def __repr__(self):
+        return 'ECRConfig({})'.format(', '.join('{}={}'.format(p, v) for p, v in self.as_dict().items()))
+
+
+# Configuration used by nodes that are not part of a simulation with its own configuration.
+DEFAULT = ECRConfig()
@@ -0,0 +1,134 @@
+import math
+
+
+# Returns percentile p (0-100) of sorted values using linear interpolation between closest ranks.
+def percentile(values_sorted, p):
+    k = (len(values_sorted) - 1) * p / 100
+    lo = math.floor(k)
+    hi = min(lo + 1, len(values_sorted) - 1)
+    return values_sorted[lo] + (values_sorted[hi] - values_sorted[lo]) * (k - lo)
+
+
+# Online aggregator of network energy. Called once per time step with the battery of every node (by id).
+# Each step is written to the energy log as it happens as: mean, min, percentiles and number of dead nodes.
+# Only the running values needed for summaries are kept, unless history is set:
+#   - history='memory' keeps the battery of every node at every step in a NumPy array.
+#   - any other string is used as the path of a memory-mapped file holding the same array (float64, steps x nodes).
+# The history array is preallocated and grown by doubling its number of steps when full (requires numpy).
+class EnergyStats:
+    # Percentiles written to the energy log.
+    PERCENTILES = (10, 50, 90)
+
+    # Number of steps the history array is preallocated for.
+    HISTORY_INITIAL_STEPS = 1024
+
+    def __init__(self, num_nodes, log, history=None):
+        self.num_nodes = num_nodes
+        self.log = log
+
+        # Values of the last step.
+        self.ts = -1
+        self.mean = self.min = 0.0
+        self.dead = 0
+
+        # Number of steps added. Time step at which the first node that was alive at the first step died.
+        self.num_steps = 0
+        self.dead_at_start = None
+        self.first_death_ts = None
+
+        self.history_file = None if history in (None, 'memory') else history
+        self.history = None
+        if history is not None:
+            self.history = self.allocate_history(self.HISTORY_INITIAL_STEPS)
+
+        self.log.write("Energy History:", is_full=False, is_energy=True)
+
+    # Create history array with space for the given number of steps. Existing rows are kept.
+    def allocate_history(self, steps):
+        # Only import numpy when history is needed.
+        import numpy as np
+
+        if self.history_file is None:
+            history = np.zeros((steps, self.num_nodes))
+            if self.history is not None:
+                history[:self.num_steps] = self.history[:self.num_steps]
+            return history
+
+        if self.history is not None:
+            self.history.flush()
+            del self.history
+        mode = 'r+' if self.num_steps else 'w+'
+        if mode == 'r+':
+            with open(self.history_file, 'r+b') as f:
+                f.truncate(steps * self.num_nodes * 8)
+        return np.memmap(self.history_file, dtype=np.float64, mode=mode, shape=(steps, self.num_nodes))
+
+    # Add battery of every node at time step ts.
+    def add(self, ts, batteries):
+        self.ts = ts
+        self.mean = sum(batteries) / self.num_nodes
+        self.dead = sum(1 for b in batteries if b <= 0.0)
+        if self.dead_at_start is None:
+            self.dead_at_start = self.dead
+        elif self.first_death_ts is None and self.dead > self.dead_at_start:
+            self.first_death_ts = ts
+
+        if self.history is not None:
+            if self.num_steps == len(self.history):
+                self.history = self.allocate_history(2 * len(self.history))
+            self.history[self.num_steps] = batteries
+        self.num_steps += 1
+
+        # Sorting is only needed for the log.
+        if self.log.is_enabled(channel='energy'):
+            batteries_sorted = sorted(batteries)
+            self.min = batteries_sorted[0]
+            pcts = ' '.join('p{} [{:.5f}]'.format(p, percentile(batteries_sorted, p)) for p in self.PERCENTILES)
+            self.log.write("ts: [{:05d}] mean [{:.5f}] min [{:.5f}] {} dead [{}]", ts, self.mean, self.min, pcts, self.dead, is_full=False, is_energy=True)
+        else:
+            self.min = min(batteries)
+
+    # Returns state for checkpoints: the running values and a copy of the history so far (None if it is not kept).
+    def get_state(self):
+        return {
+            'num_nodes': self.num_nodes,
+            'ts': self.ts,
+            'mean': self.mean,
+            'min': self.min,
+            'dead': self.dead,
+            'num_steps': self.num_steps,
+            'dead_at_start': self.dead_at_start,
+            'first_death_ts': self.first_death_ts,
+            'history': None if self.history is None else self.get_history().copy(),
+        }
+
+    # Restore state returned by get_state. If history is kept, the state must hold the history as well.
+    def set_state(self, state):
+        assert state['num_nodes'] == self.num_nodes, 'Energy state is for a different number of nodes!'
+        self.ts, self.mean, self.min, self.dead = state['ts'], state['mean'], state['min'], state['dead']
+        self.dead_at_start, self.first_death_ts = state['dead_at_start'], state['first_death_ts']
+        if self.history is not None:
+            history = state['history']
+            assert history is not None, 'Energy state does not hold the history!'
+            self.num_steps = 0
+            self.history = self.allocate_history(max(self.HISTORY_INITIAL_STEPS, len(history)))
+            self.history[:len(history)] = history
+        self.num_steps = state['num_steps']
+
+    # Returns history array of the steps added so far. None if history is not kept or the history file is closed.
+    def get_history(self):
+        return None if self.history is None else self.history[:self.num_steps]
+
+    # Time step at which the first node died, not counting nodes that were dead from the start. None if none died.
+    def lifetime(self):
+        return self.first_death_ts
+
+    # Flush history file and trim it to the steps added so far.
+    # The file can then be loaded with numpy.fromfile(path).reshape(-1, num_nodes).
+    def close(self):
+        if self.history_file is None or self.history is None:
+            return
+        self.history.flush()
+        self.history = None
+        with open(self.history_file, 'r+b') as f:
+            f.truncate(self.num_steps * self.num_nodes * 8)
@@ -1,4 +1,8 @@
+import csv
 import math
+import os
+import pickle
+from array import array
 
 import NetworkNode as NN
 
@@ -8,24 +12,146 @@ def clamp(n, bound_lower, bound_upper):
 	return max(bound_lower, min(n, bound_upper))
 
 
-# Get unique "link name" between any two nodes.
-def get_link_name(node1, node2):
-	return min(node1, node2) + '_' + max(node1, node2)
+# Number of bits used for each node id in a packed link or route key.
+KEY_BITS = 32
+KEY_MASK = (1 << KEY_BITS) - 1
 
 
-# Separate "link name" to get names of node.
-def get_links(link_name):
-	return link_name.split('_')
+# Get unique "link key" between any two nodes (by id). Packed into a single int.
+def get_link_key(node1, node2):
+	return (min(node1, node2) << KEY_BITS) | max(node1, node2)
 
 
-# Get unique "route name" between any two nodes.
-def get_route_name(src, dst):
-	return src + '_' + dst
+# Separate "link key" to get ids of nodes.
+def get_links(link_key):
+	return link_key >> KEY_BITS, link_key & KEY_MASK
 
 
-# Separate "route name" to get names of source and destination node.
-def get_route_nodes(route_name):
-	return route_name.split('_')
+# Get unique "route key" between any two nodes (by id). Packed into a single int.
+def get_route_key(src, dst):
+	return (src << KEY_BITS) | dst
+
+
+# Separate "route key" to get ids of source and destination node.
+def get_route_nodes(route_key):
+	return route_key >> KEY_BITS, route_key & KEY_MASK
+
+
+# Run-length encoding of packets sent through (or received from) each neighbor along a route.
+# A burst through a neighbor continues while the next packet comes at most one time step after the end of the burst.
+# The end of a burst is one time step after its last packet. Packets must be added in time order.
+class Bursts:
+	def __init__(self):
+		# List of [start, end, count, neighbor] in order of burst start. Maps neighbor to index of its latest burst.
+		self.bursts = []
+		self.latest = {}
+
+	def add(self, ts, neighbor):
+		i = self.latest.get(neighbor)
+		if i is not None:
+			burst = self.bursts[i]
+			if ts <= burst[1] + 1:
+				burst[1] = ts + 1
+				burst[2] += 1
+				return
+		self.latest[neighbor] = len(self.bursts)
+		self.bursts.append([ts, ts + 1, 1, neighbor])
+
+	def __iter__(self):
+		return iter(self.bursts)
+
+	def __len__(self):
+		return len(self.bursts)
+
+
+# Map from keys to the time step they were last set at, which forgets keys once they are older than a horizon. Lookups
+# of forgotten keys return the default, so callers that ignore times older than the horizon are unaffected.
+# Keys are kept in a ring of two buckets, each covering horizon time steps. Once time moves past the older bucket its
+# keys are dropped (unless set again since), so the size is bounded by the keys set within the last 2 * horizon time
+# steps. Get and set are O(1), with dropping amortized over the sets. Time steps passed to set must not decrease.
+# The horizon is passed with every set so it follows the parameters in use; a new horizon rebuilds the buckets.
+# A horizon of 0 is treated as 1, so keys set in the current time step are still found.
+class TimeCache:
+	def __init__(self):
+		self.width = 1
+		self.slice = 0
+		self.times = {}
+		self.buckets = (set(), set())
+
+	def get(self, key, default=None):
+		return self.times.get(key, default)
+
+	def set(self, key, ts, horizon):
+		width = max(horizon, 1)
+		if width != self.width:
+			self.set_width(width)
+		s = ts // self.width
+		if s != self.slice:
+			self.advance(s)
+		self.times[key] = ts
+		self.buckets[s % 2].add(key)
+
+	# Move time to slice s, dropping keys set before slice s - 1.
+	def advance(self, s):
+		if s >= self.slice + 2:
+			self.times.clear()
+			self.buckets[0].clear()
+			self.buckets[1].clear()
+		else:
+			bucket = self.buckets[s % 2]
+			for key in bucket:
+				if self.times[key] // self.width < s - 1:
+					del self.times[key]
+			bucket.clear()
+		self.slice = s
+
+	# Change width of the time slices and put the keys back into buckets.
+	def set_width(self, width):
+		self.width = width
+		self.slice = max(self.times.values(), default=0) // width
+		for bucket in self.buckets:
+			bucket.clear()
+		for key, t in list(self.times.items()):
+			if t // width < self.slice - 1:
+				del self.times[key]
+			else:
+				self.buckets[(t // width) % 2].add(key)
+
+	# Returns keys set at time step ts, which must not be older than the last set.
+	def keys_set_at(self, ts):
+		return [key for key in self.buckets[(ts // self.width) % 2] if self.times[key] == ts]
+
+	def __len__(self):
+		return len(self.times)
+
+
+# Uniform grid over points for finding the items near a location. Cells are cell_size wide and keyed by their column
+# and row. Only cells that hold items are stored.
+class SpatialGrid:
+	def __init__(self, cell_size):
+		self.cell_size = cell_size
+		self.cells = {}
+
+	# Returns key of the cell holding a point.
+	def get_cell(self, x, y):
+		return int(x // self.cell_size), int(y // self.cell_size)
+
+	# Add item at a point.
+	def add(self, item, x, y):
+		self.cells.setdefault(self.get_cell(x, y), []).append(item)
+
+	# Generate keys of all cells overlapping the rectangle, whether they hold items or not.
+	def gen_cell_range(self, x_min, y_min, x_max, y_max):
+		cx_min, cy_min = self.get_cell(x_min, y_min)
+		cx_max, cy_max = self.get_cell(x_max, y_max)
+		for cx in range(cx_min, cx_max + 1):
+			for cy in range(cy_min, cy_max + 1):
+				yield cx, cy
+
+	# Generate items of the cells overlapping the rectangle. Items may lie outside of the rectangle by up to a cell.
+	def gen_items(self, x_min, y_min, x_max, y_max):
+		for cell in self.gen_cell_range(x_min, y_min, x_max, y_max):
+			yield from self.cells.get(cell, ())
 
 
 # Distance between points.
@@ -33,58 +159,278 @@ def distance(p1, p2):
 	return math.sqrt(((p1[0] - p2[0]) ** 2) + ((p1[1] - p2[1]) ** 2))
 
 
+# Squared distance between points. Orders points the same as distance without taking square roots.
+def distance_sq(p1, p2):
+	return ((p1[0] - p2[0]) ** 2) + ((p1[1] - p2[1]) ** 2)
+
+
+# Pairs of ids (i < j) of all points closer than r, sorted. points are (x, y) indexed by id.
+# Points are put in a grid of cell size r so only points in neighboring cells are compared.
+def proximity_links(points, r):
+	grid = SpatialGrid(r)
+	for i, (x, y) in enumerate(points):
+		grid.add(i, x, y)
+
+	links = []
+	r_sq = r * r
+	for i, p in enumerate(points):
+		x, y = p
+		for j in grid.gen_items(x - r, y - r, x + r, y + r):
+			if j > i and distance_sq(points[j], p) < r_sq:
+				links.append((i, j))
+	return sorted(links)
+
+
 # Average two points.
 def average(p1, p2):
 	return (p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2
 
 
-# Generate valid lines in a file.
+# Generate valid lines in a file as (line number, line). Blank lines and comments are skipped.
+# The file is streamed rather than read into memory at once.
 def gen_file_lines(f_n):
 	with open(f_n, 'r') as f:
-		for ln in f.readlines():
+		for ln_num, ln in enumerate(f, 1):
 			ln = ln.strip()
 			if not ln or ln.startswith('#'):
 				continue
-			yield ln
+			yield ln_num, ln
 
 
-# Load nodes from file.
-# Returns dictionary from node name to object of NetworkNode.
-def load_nodes(f_n):
-	nodes_dict = {}
+# Maximum number of format errors listed when a file fails to load.
+MAX_REPORTED_ERRORS = 50
 
-	for ln in gen_file_lines(f_n):
-		ln_items = ln.split(' ')
-		if len(ln_items) == 2:
-			# Read link between nodes.
-			n_1, n_2 = ln_items
-			nodes_dict[n_1].links.add(n_2)
-			nodes_dict[n_2].links.add(n_1)
 
-		elif len(ln_items) == 4:
-			# Read node name and location.
-			n, x, y, b = ln_items
-			nodes_dict[n] = NN.NetworkNode(n, (int(x), int(y)), float(b))
+# Raise ValueError listing format errors of a file. errors is a list of (line number, message).
+def raise_format_errors(f_n, errors, what):
+	lines = ['  line {}: {}'.format(ln_num, msg) if ln_num else '  {}'.format(msg) for ln_num, msg in errors[:MAX_REPORTED_ERRORS]]
+	if len(errors) > MAX_REPORTED_ERRORS:
+		lines.append('  ... and [{}] more'.format(len(errors) - MAX_REPORTED_ERRORS))
+	raise ValueError('Check {} input file format! Found [{}] errors in [{}]:\n{}'.format(what, len(errors), f_n, '\n'.join(lines)))
+
+
+# Columnar form of a network: node names, locations and batteries by id and links as pairs of ids in file order.
+class Topology:
+	def __init__(self):
+		self.names = []
+		self.x = array('i')
+		self.y = array('i')
+		self.battery = array('d')
+		self.link_a = array('i')
+		self.link_b = array('i')
+
+	# Create NetworkNode objects indexed by id. All nodes share the names list.
+	def build_nodes(self):
+		names = self.names
+		nodes = [NN.NetworkNode(i, n, (x, y), b, names) for i, (n, x, y, b) in enumerate(zip(names, self.x, self.y, self.battery))]
+		links = [n.links for n in nodes]
+		for a, b in zip(self.link_a, self.link_b):
+			links[a].add(b)
+			links[b].add(a)
+		return nodes
+
+	# Add links between all nodes closer than radio range r that are not linked yet, so networks need not list every
+	# link. Links are added in order of node ids.
+	def add_proximity_links(self, r):
+		linked = {get_link_key(a, b) for a, b in zip(self.link_a, self.link_b)}
+		for a, b in proximity_links(list(zip(self.x, self.y)), r):
+			if get_link_key(a, b) not in linked:
+				self.link_a.append(a)
+				self.link_b.append(b)
+
+	# Create NetworkNode objects for the given ids only. Their links include neighbors that are not built and are
+	# added in the same order as by build_nodes. Returns dictionary mapping id to node.
+	def build_node_subset(self, ids):
+		names = self.names
+		nodes = {i: NN.NetworkNode(i, names[i], (self.x[i], self.y[i]), self.battery[i], names) for i in ids}
+		for a, b in zip(self.link_a, self.link_b):
+			if a in nodes:
+				nodes[a].links.add(b)
+			if b in nodes:
+				nodes[b].links.add(a)
+		return nodes
+
+
+# Parse rows of a nodes file into a Topology. rows are (line number, list of items).
+# Nodes are "Name X Y BatteryLevel" and links "Node1 Node2". Links may refer to nodes defined further down.
+# All errors are collected and reported together.
+def parse_topology(rows, f_n):
+	topo = Topology()
+	ids = {}
+	links = []
+	errors = []
+
+	for ln_num, items in rows:
+		if len(items) == 4:
+			n, x, y, b = items
+			if n in ids:
+				errors.append((ln_num, 'Node [{}] is defined twice!'.format(n)))
+				continue
+			try:
+				x, y, b = int(x), int(y), float(b)
+			except ValueError:
+				errors.append((ln_num, 'Invalid location or battery level in node definition [{}]!'.format(' '.join(items))))
+				continue
+			if not 0.0 <= b <= 1.0:
+				errors.append((ln_num, 'Battery level of node [{}] must be between 0.0 and 1.0!'.format(n)))
+				continue
+			ids[n] = len(topo.names)
+			topo.names.append(n)
+			topo.x.append(x)
+			topo.y.append(y)
+			topo.battery.append(b)
+		elif len(items) == 2:
+			links.append((ln_num, items[0], items[1]))
+		else:
+			errors.append((ln_num, 'Expected node "Name X Y BatteryLevel" or link "Node1 Node2" but got [{}] items!'.format(len(items))))
+
+	for ln_num, n_1, n_2 in links:
+		unknown = [n for n in (n_1, n_2) if n not in ids]
+		if unknown:
+			errors.append((ln_num, 'Link refers to unknown node [{}]!'.format(unknown[0])))
+		elif n_1 == n_2:
+			errors.append((ln_num, 'Node [{}] cannot link to itself!'.format(n_1)))
 		else:
-			assert False, 'Check nodes input file format!'
+			topo.link_a.append(ids[n_1])
+			topo.link_b.append(ids[n_2])
+
+	if errors:
+		raise_format_errors(f_n, sorted(errors), 'nodes')
+	return topo
+
+
+# Generate rows of a space separated nodes file.
+def gen_topology_rows_txt(f_n):
+	for ln_num, ln in gen_file_lines(f_n):
+		yield ln_num, ln.split()
+
+
+# Generate rows of a comma separated nodes file. Same rows as the space separated format.
+def gen_topology_rows_csv(f_n):
+	with open(f_n, 'r', newline='') as f:
+		reader = csv.reader(f)
+		for items in reader:
+			items = [item.strip() for item in items]
+			if not items or not items[0] or items[0].startswith('#'):
+				continue
+			yield reader.line_num, items
+
+
+# Load topology from NumPy .npz file with arrays:
+#   - names: node names (n).
+#   - xy: node locations (n x 2, whole numbers of integer or floating point type).
+#   - battery: node battery levels (n).
+#   - links: pairs of node ids (m x 2, integer). Optional.
+def load_topology_npz(f_n):
+	# Only import numpy when needed.
+	import numpy as np
+
+	errors = []
+	with np.load(f_n) as data:
+		missing = [k for k in ('names', 'xy', 'battery') if k not in data]
+		if missing:
+			raise_format_errors(f_n, [(0, 'Missing array [{}]!'.format(k)) for k in missing], 'nodes')
+		names, xy, battery = [str(n) for n in data['names']], data['xy'], data['battery']
+		links = data['links'] if 'links' in data else np.zeros((0, 2), dtype=np.int64)
+
+	# Integer (kind 'iu') or floating point (kind 'f') arrays are accepted where numbers are expected.
+	n = len(names)
+	if len(set(names)) != n:
+		errors.append((0, 'Node names must be unique!'))
+	if xy.dtype.kind not in 'iuf' or xy.shape != (n, 2):
+		errors.append((0, 'Array xy must be numeric with shape (n, 2) for [{}] names!'.format(n)))
+	elif not np.isfinite(xy).all() or (xy != np.round(xy)).any():
+		errors.append((0, 'Locations in array xy must be whole numbers!'))
+	if battery.dtype.kind not in 'iuf' or battery.shape != (n,):
+		errors.append((0, 'Array battery must be numeric with shape (n,) for [{}] names!'.format(n)))
+	elif not ((battery >= 0.0) & (battery <= 1.0)).all():
+		errors.append((0, 'Battery levels must be between 0.0 and 1.0!'))
+	if links.dtype.kind not in 'iu' or links.ndim != 2 or links.shape[1] != 2:
+		errors.append((0, 'Array links must be integer with shape (m, 2)!'))
+	elif len(links) and (links.min() < 0 or links.max() >= n or (links[:, 0] == links[:, 1]).any()):
+		errors.append((0, 'Array links must hold pairs of different node ids!'))
+	if errors:
+		raise_format_errors(f_n, errors, 'nodes')
+
+	topo = Topology()
+	topo.names = names
+	topo.x.extend(xy[:, 0].astype(np.int64).tolist())
+	topo.y.extend(xy[:, 1].astype(np.int64).tolist())
+	topo.battery.extend(battery.tolist())
+	topo.link_a.extend(links[:, 0].tolist())
+	topo.link_b.extend(links[:, 1].tolist())
+	return topo
+
+
+# Parsed nodes files of at least this size are cached next to the file (as <file>.cache) for faster reloads.
+TOPOLOGY_CACHE_MIN_BYTES = 1 << 20
+TOPOLOGY_CACHE_VERSION = 1
+
+
+# Load topology from file. Format is chosen by extension: .npz, .csv or space separated text otherwise.
+# If cache is None, the parsed topology is cached for files of at least TOPOLOGY_CACHE_MIN_BYTES.
+# The cache is only used while the size and modification time of the file are unchanged.
+def load_topology(f_n, cache=None):
+	if f_n.endswith('.npz'):
+		return load_topology_npz(f_n)
+
+	stat = os.stat(f_n)
+	if cache is None:
+		cache = stat.st_size >= TOPOLOGY_CACHE_MIN_BYTES
+	cache_fn = f_n + '.cache'
+	cache_key = (TOPOLOGY_CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+	if cache:
+		try:
+			with open(cache_fn, 'rb') as f:
+				key, topo = pickle.load(f)
+			if key == cache_key:
+				return topo
+		except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+			pass
+
+	rows = gen_topology_rows_csv(f_n) if f_n.endswith('.csv') else gen_topology_rows_txt(f_n)
+	topo = parse_topology(rows, f_n)
+
+	if cache:
+		try:
+			with open(cache_fn, 'wb') as f:
+				pickle.dump((cache_key, topo), f, protocol=pickle.HIGHEST_PROTOCOL)
+		except OSError:
+			pass
+	return topo
+
 
-	return nodes_dict
+# Load nodes from file. See load_topology for the supported formats.
+# Node ids are assigned in the order nodes are defined. Returns list of NetworkNode objects indexed by id.
+# If radio_range is given, nodes closer than it are linked as well (see Topology.add_proximity_links).
+def load_nodes(f_n, cache=None, radio_range=None):
+	topo = load_topology(f_n, cache)
+	if radio_range is not None:
+		topo.add_proximity_links(radio_range)
+	return topo.build_nodes()
 
 
 # Load packets to send from file.
 # Returns list: [(ts, src, dst, limit)].
 def load_simulation_packets(f_n):
 	pkts = []
+	errors = []
 
-	for ln in gen_file_lines(f_n):
-		ln_items = ln.split(' ')
+	for ln_num, ln in gen_file_lines(f_n):
+		ln_items = ln.split()
 		if len(ln_items) == 3:
 			s, d, t = ln_items
 			c = -1
 		elif len(ln_items) == 4:
 			s, d, t, c = ln_items
 		else:
-			assert False, 'Check packets input file format!'
-		pkts.append((int(t), s, d, int(c)))
+			errors.append((ln_num, 'Expected "Src Dst Time [Limit]" but got [{}] items!'.format(len(ln_items))))
+			continue
+		try:
+			pkts.append((int(t), s, d, int(c)))
+		except ValueError:
+			errors.append((ln_num, 'Invalid time or limit in [{}]!'.format(ln)))
 
+	if errors:
+		raise_format_errors(f_n, errors, 'packets')
 	return pkts
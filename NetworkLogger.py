@@ -1,42 +1,151 @@
+import queue
+import threading
+from collections import deque
+
 import Constants as C
 
+# Log levels. A message is written to a channel if its level is at or below the level of the channel.
+LEVEL_OFF = 0
+LEVEL_INFO = 1
+LEVEL_DEBUG = 2
+
+# Names of the log channels in the order of the log files.
+CHANNELS = ('full', 'packets', 'errors', 'performance', 'energy')
+
+
+# Returns the levels of all channels in the order of CHANNELS. levels maps channel name to its level.
+# Channels not in levels default to LEVEL_DEBUG, apart from the full log which defaults to LEVEL_OFF if
+# C.SPEED_UP_EXECUTION is set.
+def channel_levels(levels=None):
+    levels = levels or {}
+    assert not set(levels) - set(CHANNELS), 'Unknown log channels: {}'.format(sorted(set(levels) - set(CHANNELS)))
+    defaults = {'full': LEVEL_OFF if C.SPEED_UP_EXECUTION else LEVEL_DEBUG}
+    return tuple(levels.get(ch, defaults.get(ch, LEVEL_DEBUG)) for ch in CHANNELS)
+
+
 # Logging class to help make it easier to log data to files and terminal.
+# Messages are formatted lazily: write(fmt, *args) only calls fmt.format(*args) if some channel takes the message.
+# Lines are collected per channel and written in large chunks. If background is set, chunks are written to the files
+# by a separate writer thread.
 class NetworkLogger:
+    # Number of lines collected for a channel before they are written out.
+    CHUNK_LINES = 4096
+
     # Initialize logging files.
-    def __init__(self, log_full_fn, log_packets_fn, log_error_fn, log_performance_fn, log_energy_fn):
-        self.log_full = open(log_full_fn, 'w')
-        self.log_packets = open(log_packets_fn, 'w')
-        self.log_error = open(log_error_fn, 'w')
-        self.log_performance = open(log_performance_fn, 'w')
-        self.log_energy = open(log_energy_fn, 'w')
+    # levels maps channel name to its level (see channel_levels for the defaults).
+    # echo controls if the full log is also printed to the terminal (default unless C.SPEED_UP_EXECUTION).
+    def __init__(self, log_full_fn, log_packets_fn, log_error_fn, log_performance_fn, log_energy_fn, levels=None, echo=None, background=False):
+        levels = channel_levels(levels)
+        self.level_full, self.level_packets, self.level_errors, self.level_performance, self.level_energy = levels
+        self.echo = (not C.SPEED_UP_EXECUTION) if echo is None else echo
+
+        # Channels that are off do not get a file at all.
+        self.files = [open(fn, 'w', buffering=1 << 20) if level > LEVEL_OFF else None for level, fn in zip(levels, (log_full_fn, log_packets_fn, log_error_fn, log_performance_fn, log_energy_fn))]
+        self.log_full, self.log_packets, self.log_error, self.log_performance, self.log_energy = ([] for _ in CHANNELS)
+        self.pending = (self.log_full, self.log_packets, self.log_error, self.log_performance, self.log_energy)
 
         # Hold buffer of packet data to display to screen. Also count number of errors.
-        self.pkt_buffer = []
+        self.pkt_buffer = deque(maxlen=C.PKT_INFO_MAX_LINES)
         self.num_errors = 0
 
+        # Optional writer thread. Receives (file, chunk) pairs. None stops the thread.
+        self.writer_queue = self.writer_thread = None
+        if background:
+            self.writer_queue = queue.Queue()
+            self.writer_thread = threading.Thread(target=self.writer_loop, daemon=True)
+            self.writer_thread.start()
+        self.closed = False
+
     # Log information to various logs.
-    def write(self, log_str, is_full=True, is_packet=False, is_error=False, is_performance=False, is_energy=False):
-        if is_full and not C.SPEED_UP_EXECUTION:
-            print(log_str)
-            self.log_full.write(log_str + '\n')
-        if is_packet:
-            self.log_packets.write(log_str + '\n')
+    # If args are given, log_str is a format string that is only formatted if the message is written.
+    def write(self, log_str, *args, is_full=True, is_packet=False, is_error=False, is_performance=False, is_energy=False, level=LEVEL_INFO):
+        full = is_full and level <= self.level_full
+        packet = is_packet and level <= self.level_packets
+        error = is_error and level <= self.level_errors
+        performance = is_performance and level <= self.level_performance
+        energy = is_energy and level <= self.level_energy
+
+        # Errors are always counted, even if they are not logged.
+        if is_error and not log_str.startswith("ts:"):
+            self.num_errors += 1
+        if not (full or packet or error or performance or energy):
+            return
+        if args:
+            log_str = log_str.format(*args)
+
+        if full:
+            if self.echo:
+                print(log_str)
+            self.add_line(self.log_full, 0, log_str)
+        if packet:
+            self.add_line(self.log_packets, 1, log_str)
             self.pkt_buffer.append(log_str)
-            if len(self.pkt_buffer) > C.PKT_INFO_MAX_LINES:
-                self.pkt_buffer.pop(0)
-        if is_error:
-            self.log_error.write(log_str + '\n')
-            if not log_str.startswith("ts:"):
-                self.num_errors += 1
-        if is_performance:
-            self.log_performance.write(log_str + '\n')
-        if is_energy:
-            self.log_energy.write(log_str + '\n')
+        if error:
+            self.add_line(self.log_error, 2, log_str)
+        if performance:
+            self.add_line(self.log_performance, 3, log_str)
+        if energy:
+            self.add_line(self.log_energy, 4, log_str)
+
+    # Returns true if messages of level would be written to channel. Can be used to skip building expensive messages.
+    def is_enabled(self, level=LEVEL_INFO, channel='full'):
+        return level <= getattr(self, 'level_' + channel)
+
+    # Add line to pending lines of channel i. Writes lines out once there are enough of them.
+    def add_line(self, lines, i, log_str):
+        lines.append(log_str)
+        if len(lines) >= self.CHUNK_LINES:
+            self.write_chunk(i)
+
+    # Write pending lines of channel i.
+    def write_chunk(self, i):
+        lines = self.pending[i]
+        if not lines:
+            return
+        chunk = '\n'.join(lines) + '\n'
+        lines.clear()
+        if self.writer_queue is not None:
+            self.writer_queue.put((self.files[i], chunk))
+        else:
+            self.files[i].write(chunk)
+
+    # Writer thread loop. An Event in the queue is set once every chunk before it has been written.
+    def writer_loop(self):
+        while True:
+            item = self.writer_queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            f, chunk = item
+            f.write(chunk)
+
+    # Write out all pending lines and flush files.
+    def flush(self):
+        for i in range(len(CHANNELS)):
+            self.write_chunk(i)
+        if self.writer_thread is not None:
+            done = threading.Event()
+            self.writer_queue.put(done)
+            done.wait()
+        for f in self.files:
+            if f is not None:
+                f.flush()
+
+    # Write out everything and close files.
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self.writer_thread is not None:
+            self.writer_queue.put(None)
+            self.writer_thread.join()
+        for f in self.files:
+            if f is not None:
+                f.close()
+        self.closed = True
 
     # Destructor for file cleanup.
     def __del__(self):
-        self.log_energy.close()
-        self.log_performance.close()
-        self.log_error.close()
-        self.log_packets.close()
-        self.log_full.close()
+        self.close()
@@ -1,57 +1,86 @@
+import math
 from collections import defaultdict
 
-import Constants as C
+import ECRConfig
 import Helper as H
 import PacketTypes as PT
+from RoutingMultiTable import RoutingMultiTable
 
 
 # A NetworkNode (router) consists of
-#   - name: name as string
+#   - id: integer id of node. Nodes, routes and packets refer to other nodes by id.
+#   - name: name as string. Only used for display and logging.
+#   - names: list mapping every node id in the network to its name (shared between nodes).
 #   - xy: location pair
-#   - links: set of links to neighboring nodes (name of nodes).
+#   - links: set of links to neighboring nodes (ids of nodes).
+#   - live_neighbors: ids of neighbors that are known to be alive. Added on link refresh and removed once the neighbor
+#                     is dead (see cleanup_dead_neighbor). Used as the fan-out of RD messages.
 #   - battery: battery level between 0.0 (dead) and 1.0 (full).
 #   - lat: last-alive-time. Represents the simulation time when node is estimated to go offline.
 #   - rmt: routing multi-table for possible routes. See associated paper for structure.
-#          the rmt is represented by a dictionary mapping each destination node to all its rmt entries
+#          the rmt is represented by a RoutingMultiTable mapping each destination node to all its rmt entries
 #   - p_hat: estimated number of packets to be sent by node over the next time-step.
 #   - p_sample: total number of packets sent over the last time-step.
+#   - cfg: ECRConfig with the ECR algorithm parameters. Set by the simulation the node is part of.
 #   - Various variables to keep track of RD and RU messages that have been recently served/sent.
 #   - Various variables to keep track of RP messages send and received. Needed for performance metrics.
 class NetworkNode:
 	# Create Node
-	def __init__(self, name, xy, battery):
+	def __init__(self, node_id, name, xy, battery, names):
 		assert 0.0 <= battery <= 1.0
 
+		self.id = node_id
 		self.name = name
+		self.names = names
+		self.cfg = ECRConfig.DEFAULT
 		self.xy = xy
 		self.links = set()
+		self.live_neighbors = set()
 		self.battery = battery
 		self.lat = 0
-		self.rmt = defaultdict(list)
+		self.rmt = RoutingMultiTable()
 		self.p_hat = 0
 		self.p_sample = 0
 
 		# Keeps track of route discovery messages in flight.
 		# Used to determine if node has already send route discovery messages for nodes.
-		# Maps destination name to time step when rd messages were sent.
+		# Maps destination id to time step when rd messages were sent. Entries are kept after RD_Timeout, as they then
+		# mark the route discovery as timed out. Bounded by the number of destinations.
 		self.rd_in_flight = {}
 
 		# Keeps track of route update messages in flight.
 		# Used to determine if node has recently sent route update messages for a specific route.
-		# Maps route name to time step when update messages was sent.
-		self.ru_in_flight = defaultdict(int)
+		# Maps route key to time step when update messages was sent. Forgets routes after RU_MinInterval.
+		self.ru_in_flight = H.TimeCache()
 
 		# Keeps track of recently responded rd messages.
 		# This is to prevent repeated responses to the same route discovery message.
-		# Maps route name to latest response time.
-		self.rd_responded = defaultdict(dict)
+		# Maps route key to latest response time. Forgets routes after RD_Timeout.
+		self.rd_responded = H.TimeCache()
 
 		# Keep track of number of RP packets sent and received from each destination node.
-		# Also keep track of where the packets came from by mapping route name to list of (time, next/previous hop).
+		# Also keep track of where the packets came from by mapping route key to bursts of packets through next/previous hop.
 		self.num_rp_sent = defaultdict(int)
-		self.rp_sent = defaultdict(list)
+		self.rp_sent = defaultdict(H.Bursts)
 		self.num_rp_received = defaultdict(int)
-		self.rp_received = defaultdict(list)
+		self.rp_received = defaultdict(H.Bursts)
+
+	# Attributes changed by handle_packet, apart from rd_responded. Lets the result of handling packets in another
+	# process be copied back.
+	PACKET_STATE = ('rmt', 'rd_in_flight', 'ru_in_flight', 'num_rp_sent', 'rp_sent', 'num_rp_received', 'rp_received', 'p_sample')
+
+	# Returns state changed by handling packets at time step ts.
+	# Handling packets only sets rd_responded entries to ts, so only those are included.
+	def get_packet_state(self, ts):
+		return tuple(getattr(self, name) for name in self.PACKET_STATE), ts, self.rd_responded.keys_set_at(ts)
+
+	# Apply state returned by get_packet_state.
+	def set_packet_state(self, state):
+		values, ts, rd_responded = state
+		for name, value in zip(self.PACKET_STATE, values):
+			setattr(self, name, value)
+		for rt_key in rd_responded:
+			self.rd_responded.set(rt_key, ts, self.cfg.RD_Timeout)
 
 	def is_alive(self):
 		return self.battery > 0.0
@@ -64,61 +93,84 @@ class NetworkNode:
 			return
 
 		# Update battery level based on actual number of packets sent over last timestamp.
-		self.battery -= (C.ECR_d_c + self.p_sample * C.ECR_d_p)
+		self.battery -= (self.cfg.d_c + self.p_sample * self.cfg.d_p)
 
 		if update_estimates:
 			# Apply (Eq. 2) from report to compute estimated number of packets to be send over the next second.
-			self.p_hat = C.ECR_alpha * self.p_hat + (1 - C.ECR_alpha) * self.p_sample
+			self.p_hat = self.cfg.alpha * self.p_hat + (1 - self.cfg.alpha) * self.p_sample
 
 			# Apply (Eq. 1) from report to compute estimate of when node will be depleted.
-			self.lat = ts + (self.battery / (C.ECR_d_c + self.p_hat * C.ECR_d_p))
+			self.lat = ts + (self.battery / (self.cfg.d_c + self.p_hat * self.cfg.d_p))
 
 		# Update rmt entries according to (Eq. 4).
-		for _, entries in self.rmt.items():
-			for i, (next_hop, lat_r, d_f) in enumerate(entries):
-				if self.lat < lat_r:
-					entries[i] = (next_hop, self.lat, 0)
+		self.rmt.cap(self.lat)
 
 		# Set number of samples to zero for next iteration.
 		self.p_sample = 0
 
+	# Progress over a number of idle time steps (no packets sent or received) in closed form.
+	# Requires p_sample to be zero and the node to stay alive over all the steps (see idle_steps_until_dead).
+	# lat does not shrink while a node is idle, so the (Eq. 4) cap of each skipped step is no tighter than the one before.
+	# Every rmt entry was already capped to the lat at the start of the gap, so none of these caps change an entry.
+	# The final cap below is a no-op, kept as a safeguard in case the (Eq. 1)/(Eq. 2) updates change.
+	# Returns the battery level after each of the steps.
+	def progress_idle(self, ts, steps):
+		if not self.is_alive():
+			# Node is dead.
+			self.battery = 0.0
+			return [0.0] * steps
+
+		assert self.p_sample == 0, "Idle progress requires no pending packet samples!"
+		batteries = [self.battery - i * self.cfg.d_c for i in range(1, steps + 1)]
+		self.battery = batteries[-1]
+
+		# Closed form of (Eq. 2) with no packets sent followed by (Eq. 1).
+		self.p_hat *= self.cfg.alpha ** steps
+		self.lat = ts + (self.battery / (self.cfg.d_c + self.p_hat * self.cfg.d_p))
+
+		# Update rmt entries according to (Eq. 4). No-op, see above.
+		self.rmt.cap(self.lat)
+
+		return batteries
+
+	# Number of idle time steps until node dies. Dead nodes return infinity.
+	def idle_steps_until_dead(self):
+		return math.ceil(self.battery / self.cfg.d_c) if self.is_alive() else math.inf
+
 	# Sorts rmt so route to a given destination are sorted.
+	# Sort according to criteria defined by ECR paper. Only destinations changed since the last sort are re-sorted.
 	def sort_rmt(self):
-		# Sort according to criteria defined by ECR paper. Pick optimally know route.
-		for dst, entries in self.rmt.items():
-			if len(entries) > 1:
-				entries.sort(key=lambda e, rmt=self.rmt: (e[1], max([0] + [next_hop_entry[1] for next_hop_entry in rmt[e[0]]])), reverse=True)
+		self.rmt.sort_dirty()
 
 	# Update or create rmt entry for specific destination and next_hop pair. See associated paper for details.
 	# Returns: (lat_r, discount factor)
 	def update_or_create_rmt_entry(self, dst, next_hop, lat_r, df, ts):
-		# Find rmt entry.
-		i = next((i for i, (entry_next_hop, _, _) in enumerate(self.rmt[dst]) if entry_next_hop == next_hop), None)
-
 		# Use (Eq. 3) to compute value for rmt table.
-		lat_r = min(self.lat, ts + max(0, C.ECR_gamma * (lat_r - ts)))
+		lat_r = min(self.lat, ts + max(0, self.cfg.gamma * (lat_r - ts)))
 		df = 0 if lat_r == self.lat else (df + 1)
 
-		if i is None:
-			# Create new rmt entry.
-			self.rmt[dst].append((next_hop, lat_r, df))
-		else:
-			# Update existing rmt entry.
-			self.rmt[dst][i] = (next_hop, lat_r, df)
+		self.set_rmt_entry(dst, next_hop, lat_r, df)
 
 		return lat_r, df
 
+	# Set rmt entry for specific destination and next_hop pair to already computed values.
+	def set_rmt_entry(self, dst, next_hop, lat_r, df):
+		# Find rmt entry.
+		i = next((i for i, (entry_next_hop, _, _) in enumerate(self.rmt[dst]) if entry_next_hop == next_hop), None)
+
+		# Create new rmt entry if i is None. Otherwise update existing rmt entry.
+		self.rmt.set_entry(dst, i, (next_hop, lat_r, df))
+
 	# Returns the known route to destination by searching through the rmt.
 	# Returns (next_hop, expected_lat_r, expected discount factor)
 	# Returns (None, None, None) if no route is found.
 	def get_best_route(self, dst):
-		self.sort_rmt()
-		return self.rmt[dst][0] if self.rmt[dst] else (None, None, None)
+		return self.rmt.best(dst)
 
 	# Remove routes to dead neighbors.
-	def cleanup_dead_neighbor(self, neighbor_name):
-		for k in self.rmt:
-			self.rmt[k] = [e for e in self.rmt[k] if e[0] != neighbor_name]
+	def cleanup_dead_neighbor(self, neighbor_id):
+		self.live_neighbors.discard(neighbor_id)
+		self.rmt.remove_next_hop(neighbor_id)
 
 	# Helper function to generate route discover packets (one for each neighbor) to find a route to the destination
 	# Returns pair: (list of discover packets, boolean if there was timeout error).
@@ -130,25 +182,19 @@ class NetworkNode:
 
 		if dst in self.rd_in_flight and neighbors_filter is None:
 			# We have send discover messages already.
-			if self.rd_in_flight[dst] + C.ECR_RD_Timeout <= ts:
+			if self.rd_in_flight[dst] + self.cfg.RD_Timeout <= ts:
 				# No route found! Discover messages timed out!
 				timeout_error = True
 		elif dst not in self.rd_in_flight or neighbors_filter is not None:
-			# Generate RD packets to each neighbor.
-			neighbors_sent = set()
-			for _, entries in self.rmt.items():
-				for next_hop, _, _ in entries:
-					if next_hop not in neighbors_sent and (not neighbors_filter or next_hop in neighbors_filter):
-						discovery_msg = PT.ERC_RD(src=self.name, dst_desired=dst, route=[self.name])
-						pkt = PT.Packet(current_node=self.name, next_hop=next_hop, msg=discovery_msg, sent_ts=ts)
-						rd_pkts.append(pkt)
-						neighbors_sent.add(next_hop)
+			# Generate RD packets to each live neighbor. Sorted by next_hop to ensure deterministic simulation.
+			for next_hop in sorted(self.live_neighbors):
+				if not neighbors_filter or next_hop in neighbors_filter:
+					discovery_msg = PT.ERC_RD(src=self.id, dst_desired=dst, route=PT.RoutePath(self.id))
+					pkt = PT.new_packet(current_node=self.id, next_hop=next_hop, msg=discovery_msg, sent_ts=ts)
+					rd_pkts.append(pkt)
 			if neighbors_filter is None:
 				self.rd_in_flight[dst] = ts
 
-		# Sort packets by next_hop to ensure deterministic simulation.
-		rd_pkts.sort(key=lambda pkt: pkt.next_hop)
-
 		return rd_pkts, timeout_error
 
 	# Tries to send packet to destination.
@@ -157,65 +203,65 @@ class NetworkNode:
 	def attempt_to_send_packet(self, dst, ts, log, msg_num=None):
 		pkts = []
 		msg_sent = error = False
-		rt_name = H.get_route_name(src=self.name, dst=dst)
+		rt_key = H.get_route_key(src=self.id, dst=dst)
 
 		# Get best known route. Could be None if unknown.
 		next_hop, expected_lat_r, expected_df = self.get_best_route(dst)
 
 		if not self.is_alive():
-			log.write('  Node [{}] is dead. It cannot send packets required by packets file!'.format(self.name), is_packet=True, is_error=True)
+			log.write('  Node [{}] is dead. It cannot send packets required by packets file!', self.name, is_packet=True, is_error=True)
 			error = True
-		elif next_hop:
+		elif next_hop is not None:
 			# Route is known. Send packet.
 			if not msg_num:
 				self.num_rp_sent[dst] += 1
 				msg_num = self.num_rp_sent[dst]
-			rp_msg = PT.ERC_RP(src=self.name, dst=dst, expected_discount_factor=expected_df, expected_lat_r=expected_lat_r, payload=msg_num)
-			pkts.append(PT.Packet(current_node=self.name, next_hop=next_hop, msg=rp_msg, sent_ts=ts))
+			rp_msg = PT.ERC_RP(src=self.id, dst=dst, expected_discount_factor=expected_df, expected_lat_r=expected_lat_r, payload=msg_num)
+			pkts.append(PT.new_packet(current_node=self.id, next_hop=next_hop, msg=rp_msg, sent_ts=ts))
 			msg_sent = True
-			log.write("  Node [{}] sending pkt [{}] to destination [{}] through known route with next hop [{}].".format(self.name, rp_msg.payload, dst, next_hop), is_packet=True)
-			self.rp_sent[rt_name].append((ts, next_hop))
+			log.write("  Node [{}] sending pkt [{}] to destination [{}] through known route with next hop [{}].", self.name, rp_msg.payload, self.names[dst], self.names[next_hop], is_packet=True)
+			self.rp_sent[rt_key].add(ts, next_hop)
 
 			# If enough packets have been sent along route, selectively resend RD messages to get updated information along other known routes.
-			if rp_msg.payload % C.ECR_RD_Resend == 0:
+			if rp_msg.payload % self.cfg.RD_Resend == 0:
 				new_pkts_rd, _ = self.generate_route_discover_packets(dst=dst, ts=ts, neighbors_filter={nh for nh, _, _ in self.rmt[dst] if nh != next_hop})
 				if new_pkts_rd:
 					pkts.extend(new_pkts_rd)
 					for new_pkt in new_pkts_rd:
-						log.write("  Node [{}] selectively sending out RD message to [{}] to get updated information on route to [{}]".format(self.name, new_pkt.next_hop, dst))
+						log.write("  Node [{}] selectively sending out RD message to [{}] to get updated information on route to [{}]", self.name, self.names[new_pkt.next_hop], self.names[dst])
 
 		else:
 			# Route is not known. Generate route discover packet if necessary.
 			pkts, timeout_error = self.generate_route_discover_packets(dst, ts)
 			if timeout_error:
 				# No route found! Discover messages timed out!
-				log.write("  Node [{}] could not find route to [{}]. The sent RD messages have timed out!".format(self.name, dst), is_error=True)
+				log.write("  Node [{}] could not find route to [{}]. The sent RD messages have timed out!", self.name, self.names[dst], is_error=True)
 				error = True
 			elif not pkts:
 				# Wait for send discover messages to return route.
-				log.write("  Node [{}] is still waiting to get back RR messages for route to [{}].".format(self.name, dst))
+				log.write("  Node [{}] is still waiting to get back RR messages for route to [{}].", self.name, self.names[dst])
 			else:
-				log.write("  Node [{}] does not have route to [{}]. Sending out [{}] RD messages to neighbors.".format(self.name, dst, len(pkts)))
+				log.write("  Node [{}] does not have route to [{}]. Sending out [{}] RD messages to neighbors.", self.name, self.names[dst], len(pkts))
 
 		return pkts, msg_sent, error
 
 	# Handle message and return pair of (list any new in-flight messages that result, if an error occurred)
 	def handle_packet(self, packet, ts, log):
-		assert packet.next_hop == self.name and packet.sent_ts < ts, "In flight packet is ill-formed!"
+		assert packet.next_hop == self.id and packet.sent_ts < ts, "In flight packet is ill-formed!"
 		new_pkts = []
 		had_err = False
 		if not self.is_alive():
 			return new_pkts, had_err
 		msg = packet.msg
 
-		if packet.type == 'RD':
-			rt_name = H.get_route_name(src=msg.src, dst=msg.dst)
+		if packet.type == PT.TYPE_RD:
+			rt_key = H.get_route_key(src=msg.src, dst=msg.dst)
 
 			# Handle route discovery message.
-			if self.name == msg.dst:
+			if self.id == msg.dst:
 				# This is the destination node. Return route response.
-				response_msg = PT.ERC_RR(route_src=msg.src, route_dst=self.name, discount_factor=0, lat_r=self.lat, route=msg.rt)
-				response_packet = PT.Packet(current_node=self.name, next_hop=msg.rt[-1], msg=response_msg, sent_ts=ts)
+				response_msg = PT.ERC_RR(route_src=msg.src, route_dst=self.id, discount_factor=0, lat_r=self.lat, route=msg.rt)
+				response_packet = PT.new_packet(current_node=self.id, next_hop=msg.rt.node, msg=response_msg, sent_ts=ts)
 
 				new_pkts.append(response_packet)
 
@@ -223,97 +269,95 @@ class NetworkNode:
 				new_pkts_rd, _ = self.generate_route_discover_packets(dst=msg.src, ts=ts, neighbors_filter={packet.current_node})
 				new_pkts.extend(new_pkts_rd)
 
-			elif self.name not in msg.rt and self.rd_responded[msg.src].get(rt_name, -C.ECR_RD_Timeout) < ts - C.ECR_RD_Timeout:
-				# We have not seen similar message. Forward to all neighbors.
-				self.rd_responded[msg.src][rt_name] = ts
-				neighbors_sent = {packet.current_node}
-				for _, entries in self.rmt.items():
-					for next_hop, _, _ in entries:
-						if next_hop not in neighbors_sent:
-							discovery_msg = PT.ERC_RD(src=msg.src, dst_desired=msg.dst, route=msg.rt)
-							discovery_msg.rt.append(self.name)  # Make sure to append self to route.
-							pkt = PT.Packet(current_node=self.name, next_hop=next_hop, msg=discovery_msg, sent_ts=ts)
-							new_pkts.append(pkt)
-							neighbors_sent.add(next_hop)
-
-		elif packet.type == 'RR':
-			assert msg.rt and msg.rt[-1] == self.name, "Ill-formed RR message!"
+			elif self.id not in msg.rt and self.rd_responded.get(rt_key, -self.cfg.RD_Timeout) < ts - self.cfg.RD_Timeout:
+				# We have not seen similar message. Forward to all live neighbors except the one it came from.
+				# Sorted by next_hop to ensure deterministic simulation.
+				self.rd_responded.set(rt_key, ts, self.cfg.RD_Timeout)
+				route = msg.rt.extend(self.id)  # Make sure to append self to route. Shared by all forwarded messages.
+				for next_hop in sorted(self.live_neighbors):
+					if next_hop != packet.current_node:
+						discovery_msg = PT.ERC_RD(src=msg.src, dst_desired=msg.dst, route=route)
+						pkt = PT.new_packet(current_node=self.id, next_hop=next_hop, msg=discovery_msg, sent_ts=ts)
+						new_pkts.append(pkt)
+
+		elif packet.type == PT.TYPE_RR:
+			assert msg.rt is not None and msg.rt.node == self.id, "Ill-formed RR message!"
 			# Handle route response message. We update the values in the message and add/update entry in the RMT.
 			lat_r, df = self.update_or_create_rmt_entry(dst=msg.dst, next_hop=packet.current_node, lat_r=msg.lat, df=msg.discount, ts=ts)
 			msg.lat = lat_r
 			msg.discount = df
-			msg.rt.pop()
+			msg.rt = msg.rt.parent
 
 			# Forward along if needed.
-			if msg.rt:
-				pkt = PT.Packet(current_node=self.name, next_hop=msg.rt[-1], msg=msg, sent_ts=packet.sent_ts)
+			if msg.rt is not None:
+				pkt = PT.new_packet(current_node=self.id, next_hop=msg.rt.node, msg=msg, sent_ts=packet.sent_ts)
 				new_pkts.append(pkt)
 
-		elif packet.type == 'RP':
-			rt_name = H.get_route_name(src=msg.src, dst=msg.dst)
+		elif packet.type == PT.TYPE_RP:
+			rt_key = H.get_route_key(src=msg.src, dst=msg.dst)
 
 			# Handle route packet message.
-			if msg.dst == self.name:
+			if msg.dst == self.id:
 				# Packet reach destination.
 				self.num_rp_received[msg.src] += 1
-				self.rp_received[rt_name].append((ts, packet.current_node))
-				log.write("  Node [{}] got pkt [{}] from source [{}] with previous hop [{}].".format(self.name, msg.payload, msg.src, packet.current_node), is_packet=True)
+				self.rp_received[rt_key].add(ts, packet.current_node)
+				log.write("  Node [{}] got pkt [{}] from source [{}] with previous hop [{}].", self.name, msg.payload, self.names[msg.src], self.names[packet.current_node], is_packet=True)
 
 			else:
 				# Packet has not yet reached destination
 				next_hop, rmt_lat_r, rmt_df = self.get_best_route(msg.dst)
-				if next_hop:
+				if next_hop is not None:
 					# Computed updated the lat_r and discount based on (Eq. 5).
-					lat_r_updated = (ts + ((rmt_lat_r - ts) / C.ECR_gamma)) if rmt_df > 0 else rmt_lat_r
+					lat_r_updated = (ts + ((rmt_lat_r - ts) / self.cfg.gamma)) if rmt_df > 0 else rmt_lat_r
 					df_updated = min(rmt_df - 1, 0)
 
 					# Check if updates match expected values.
 					if df_updated != msg.discount or lat_r_updated < msg.lat:
 						# Detected unexpected information. Send back updated route information.
 						# Only send back information if we have not done so recently.
-						prev_update_ts = self.ru_in_flight[rt_name]
-						if self.rmt[msg.src] and 0 <= prev_update_ts <= ts - C.ECR_RU_MinInterval:
-							log.write("  Node [{}] has updated information on route from [{}] to [{}]. Sending back RU message".format(self.name, msg.src, msg.dst))
-							self.ru_in_flight[rt_name] = ts
+						prev_update_ts = self.ru_in_flight.get(rt_key, 0)
+						if self.rmt[msg.src] and 0 <= prev_update_ts <= ts - self.cfg.RU_MinInterval:
+							log.write("  Node [{}] has updated information on route from [{}] to [{}]. Sending back RU message", self.name, self.names[msg.src], self.names[msg.dst])
+							self.ru_in_flight.set(rt_key, ts, self.cfg.RU_MinInterval)
 
 							# Send update along all possible route back to source.
 							for update_next_hop, _, _ in self.rmt[msg.src]:
-								update_msg = PT.ERC_RU(update_src=self.name, route_src=msg.src, route_dst=msg.dst, updated_discount_factor=rmt_df, updated_lat_r=rmt_lat_r)
-								pkt = PT.Packet(current_node=self.name, next_hop=update_next_hop, msg=update_msg, sent_ts=ts)
+								update_msg = PT.ERC_RU(update_src=self.id, route_src=msg.src, route_dst=msg.dst, updated_discount_factor=rmt_df, updated_lat_r=rmt_lat_r)
+								pkt = PT.new_packet(current_node=self.id, next_hop=update_next_hop, msg=update_msg, sent_ts=ts)
 								new_pkts.append(pkt)
 					# Update values in message and forward packet.
 					msg.lat = lat_r_updated
 					msg.discount = df_updated
-					pkt = PT.Packet(current_node=self.name, next_hop=next_hop, msg=msg, sent_ts=packet.sent_ts)
+					pkt = PT.new_packet(current_node=self.id, next_hop=next_hop, msg=msg, sent_ts=packet.sent_ts)
 					new_pkts.append(pkt)
 
-					log.write("  Node [{}] forwarding pkt [{}] from [{}] to [{}] with next hop [{}].".format(self.name, msg.payload, msg.src, msg.dst, pkt.next_hop), is_packet=True)
+					log.write("  Node [{}] forwarding pkt [{}] from [{}] to [{}] with next hop [{}].", self.name, msg.payload, self.names[msg.src], self.names[msg.dst], self.names[pkt.next_hop], is_packet=True)
 
 				else:
 					# No route to destination. Send back error message.
-					re_msg = PT.ERC_RE(error_src=self.name, route_src=msg.src, route_dst=msg.dst, error_code=msg.payload)
-					pkt = PT.Packet(current_node=self.name, next_hop=packet.current_node, msg=re_msg, sent_ts=ts)
+					re_msg = PT.ERC_RE(error_src=self.id, route_src=msg.src, route_dst=msg.dst, error_code=msg.payload)
+					pkt = PT.new_packet(current_node=self.id, next_hop=packet.current_node, msg=re_msg, sent_ts=ts)
 					new_pkts.append(pkt)
 
-		elif packet.type == 'RU':
+		elif packet.type == PT.TYPE_RU:
 			# Handle route update message. Add updated values to rmt table.
 			lat_r, df = self.update_or_create_rmt_entry(dst=msg.dst_route, next_hop=packet.current_node, lat_r=msg.lat, df=msg.discount, ts=ts)
-			# Update msg and continue onwards if necessary.
-			if msg.src_route != self.name and self.rmt[msg.src_route]:
-				msg.lat = lat_r
-				msg.discount = df
+			# Continue onwards with updated values if necessary.
+			# Every next hop gets its own message, as receivers update the message they get.
+			if msg.src_route != self.id and self.rmt[msg.src_route]:
 				for next_hop, _, _ in self.rmt[msg.src_route]:
-					pkt = PT.Packet(current_node=self.name, next_hop=next_hop, msg=msg, sent_ts=ts)
+					update_msg = PT.ERC_RU(update_src=msg.src, route_src=msg.src_route, route_dst=msg.dst_route, updated_discount_factor=df, updated_lat_r=lat_r)
+					pkt = PT.new_packet(current_node=self.id, next_hop=next_hop, msg=update_msg, sent_ts=ts)
 					new_pkts.append(pkt)
 
-		elif packet.type == 'RE':
+		elif packet.type == PT.TYPE_RE:
 			# Handle route error message.
-			if self.name == msg.src:
-				assert msg.rt, 'Ill-formed RE message!'
+			if self.id == msg.src:
+				assert msg.rt is not None, 'Ill-formed RE message!'
 
 				# This is the source node. Remove route with error from rmt.
-				self.rmt[msg.dst] = [e for e in self.rmt[msg.dst] if e[0] != packet.current_node]
-				log.write("  Node [{}] got route error message for pkt [{}] to [{}]. The error originated from [{}]. Will reattempt to send the packet through another route".format(self.name, msg.code, msg.dst, msg.rt[-1]), is_error=True)
+				self.rmt.remove_next_hop(packet.current_node, dst=msg.dst)
+				log.write("  Node [{}] got route error message for pkt [{}] to [{}]. The error originated from [{}]. Will reattempt to send the packet through another route", self.name, msg.code, self.names[msg.dst], self.names[msg.rt.node], is_error=True)
 
 				# Try and resend package.
 				self.attempt_to_send_packet(msg.dst, ts, log, msg_num=msg.code)
@@ -321,9 +365,9 @@ class NetworkNode:
 			else:
 				# Forward error message back towards source.
 				next_hop, _, _ = self.get_best_route(msg.src)
-				if next_hop:
-					msg.rt.append([self.name])
-					pkt = PT.Packet(current_node=self.name, next_hop=next_hop, msg=msg, sent_ts=packet.sent_ts)
+				if next_hop is not None:
+					msg.rt = msg.rt.extend(self.id)
+					pkt = PT.new_packet(current_node=self.id, next_hop=next_hop, msg=msg, sent_ts=packet.sent_ts)
 					new_pkts.append(pkt)
 
 		else:
@@ -334,17 +378,22 @@ class NetworkNode:
 
 		return new_pkts, had_err
 
-	# Overload of equals that looks at name only.
+	# State for pickling. Instance attributes that shadow methods (such as the wrappers installed by the Profiler) are
+	# left out.
+	def __getstate__(self):
+		return {k: v for k, v in self.__dict__.items() if not hasattr(NetworkNode, k)}
+
+	# Overload of equals that looks at id only.
 	def __eq__(self, other):
-		return self.name == (other if isinstance(other, str) else other.name)
+		return self.id == (other if isinstance(other, int) else other.id)
 
-	# Hash function based on name.
+	# Hash function based on id.
 	def __hash__(self):
-		return hash(self.name)
+		return hash(self.id)
 
 	# String representation.
 	def __str__(self):
-		return '[{}: Loc{} Bat[{}] Links{}]'.format(self.name, self.xy, self.battery, self.links)
+		return '[{}: Loc{} Bat[{}] Links{}]'.format(self.name, self.xy, self.battery, sorted(self.names[n] for n in self.links))
 
 	# String representation.
 	def __repr__(self):
@@ -1,51 +1,99 @@
-from collections import defaultdict
-
 import Constants as C
 import Helper as H
-import NetworkLogger as NL
+from SimulationThread import SimulationThread
 
 import arcade as arc
 
-# Class to hold simulation.
+# arcade.Text keeps laid out text between frames (arcade 2.6+).
+HAS_TEXT_LABELS = tuple(int(v) for v in arc.version.VERSION.split('.')[:2]) >= (2, 6)
+
+
+# Text that is only laid out again when its content changes. Older arcade versions fall back to draw_text, which
+# reuses the rendered text of identical calls.
+class CachedText:
+    def __init__(self, text, font_size, width, align='left', anchor_x='left', multiline=True):
+        self.text = text
+        self.kwargs = dict(color=arc.color.BLACK, font_size=font_size, width=width, bold=True, align=align, anchor_x=anchor_x, anchor_y='center')
+        self.label = arc.Text(text, 0, 0, multiline=multiline, **self.kwargs) if HAS_TEXT_LABELS else None
+
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            if self.label is not None:
+                self.label.text = text
+
+    def draw(self, x, y):
+        if self.label is None:
+            arc.draw_text(self.text, x, y, **self.kwargs)
+            return
+        if self.label.position != (x, y):
+            self.label.position = x, y
+        self.label.draw()
+
+
+# Retained shapes of the nodes in a grid cell and of the links whose midpoint lies in it. Shapes are built when the cell
+# is first drawn. Battery fills and cluster dots are rebuilt once dirty.
+class RenderCell:
+    def __init__(self):
+        self.node_ids = []
+        self.link_points = []
+        self.outlines = self.links = self.fills = self.clusters = None
+        self.labels = None
+        self.fills_dirty = self.clusters_dirty = True
+
+
+# Class to view a simulation. The simulation itself is run by a SimulationCore that is stepped on a SimulationThread
+# based on user input. The window draws the latest snapshot the thread published, so the rate of steps and frames are
+# independent. sim_rate is the target number of auto steps per second (0 for as fast as possible).
+# The network is split into a grid of RenderCells and only the cells in view are drawn. Each cell keeps shape lists of
+# its nodes and links: outlines, links and labels never change and battery fills are only rebuilt when the fill of one
+# of its nodes changes by at least a pixel or changes color. Zoomed out views skip the labels and, further out, draw one
+# dot per cluster of nodes instead of the nodes and links.
 class NetworkSimulation(arc.Window):
-    # Initialize simulation world.
-    def __init__(self, world_size, screen_size, log_files):
+    # Initialize simulation view.
+    def __init__(self, screen_size, sim, sim_rate=C.AUTO_SIM_DEFAULT_SPEED):
         # Initialize world and screen sizes.
-        self.world_width, self.world_height = world_size
+        self.sim = sim
+        self.world_width, self.world_height = sim.world_width, sim.world_height
         self.screen_width, self.screen_height = screen_size
         assert 0 < self.screen_width <= self.world_width and 0 < self.screen_height <= self.world_height
 
         # Move speed.
         self.move_speed = C.MOVE_SPEED_DEFAULT
 
-        # Simulation time and auto step variables.
-        self.ts = -1
-        self.needs_update = False
+        # Auto step variables.
         self.auto_step = False
-        self.auto_step_speed = C.AUTO_SIM_DEFAULT_SPEED
-        self.auto_step_ts = 0
+        self.auto_step_speed = 0 if C.SPEED_UP_EXECUTION else sim_rate
 
-        # Variables to hold network nodes and the rectangles and links that need to be drawn.
-        self.nodes, self.node_rectangles, self.node_links = {}, {}, {}
+        # Thread stepping the simulation and the snapshot that is drawn.
+        self.runner = SimulationThread(sim, self.auto_step_speed)
+        self.snapshot = self.runner.snapshot
 
-        # Variables dealing with simulation of packets.
-        self.pkts_schedule = self.pkts_schedule_original_copy = []
-        self.pkts_inflight = []
+        # Variables to hold the rectangles and links that need to be drawn.
+        self.node_rectangles, self.node_links = {}, {}
 
-        # Holds a map from every node to a list of the node's energy at every simulation time.
-        self.network_energy = defaultdict(list)
+        # Grid of node ids (for culling and hit-testing) and the render cells of its cells, the cell of every node and
+        # the fill drawn for every node. Links reach into neighboring cells by at most link_margin.
+        self.grid = H.SpatialGrid(C.RENDER_CELL_SIZE)
+        self.cells = {}
+        self.node_cells = []
+        self.fill_keys = []
+        self.link_margin = 0.0
 
-        # Create logger.
-        self.log = NL.NetworkLogger(*log_files)
+        # World units per screen pixel. Lower left corner of the view in the world.
+        self.zoom = 1.0
+        self.zoom_max = min(self.world_width / self.screen_width, self.world_height / self.screen_height)
+        self.view_x = self.view_y = 0
 
         # Variables for information text.
         self.text_info = "Sim ts: [{}]\n\n" \
                          "Step Forward: 'N'\nToggle Auto Step: 'A'\nAuto Step Speed: '[' / ']' [{}]\n\n" \
-                         "Move Around: Arrow Keys\nMove Speed: '=' / '-' [{}]\n\n" \
+                         "Move Around: Arrow Keys\nMove Speed: '=' / '-' [{}]\nZoom: Mouse Wheel [{:.2f}]\n\n" \
                          "Show node info: Click on node\nShow simulation packets being sent: 'S' [{}]\n\n" \
                          "Exit: ESC/Q"
         self.text_node_info = ["Click on node to display info here!"]
         self.text_packets = ["Press 'S' to show packet info!"]
+        self.text_packets_ts = None
         self.show_packet_log = False
 
         # Initialize arcade backend.
@@ -53,82 +101,208 @@ class NetworkSimulation(arc.Window):
         self.set_viewport(0, self.screen_width, 0, self.screen_height)
         arc.set_background_color(arc.color.WHITE)
 
+        # Info panel text.
+        self.label_info = CachedText('', C.TEXT_SIZE, C.SIM_INFO_RECT_SIZE_W)
+        self.label_node_info = CachedText('\n'.join(self.text_node_info), C.TEXT_SIZE, C.NODE_INFO_RECT_SIZE_W)
+        self.label_packets_toggle = CachedText('', C.TEXT_SIZE, C.PKT_INFO_RECT_SIZE_W)
+        self.label_packets = CachedText('', C.TEXT_SIZE_DETAILED, C.PKT_INFO_EXPANDED_RECT_SIZE_W)
+
+        # Build shapes for the network.
+        self.setup_network()
+        self.setup_shapes()
+
     # Setup network.
     def setup_network(self):
         # Create dictionary of rectangles that need drawing (to represent each node).
-        for node_name, node in self.nodes.items():
+        for node in self.sim.nodes:
             x, y = node.xy
             s = C.NODE_RECT_SIZE / 2
             # Rectangles for nodes.
-            self.node_rectangles[node_name] = (node.xy, [(x - s, y - s),  # Bottom Left
+            self.node_rectangles[node.id] = (node.xy, [(x - s, y - s),  # Bottom Left
                                                          (x + s, y - s),  # Bottom Right
                                                          (x - s, y + s),  # Top Left
                                                          (x + s, y + s),  # Top Right
                                                          ])
+            self.grid.add(node.id, x, y)
         # Create dictionary of node links that need drawing.
-        for node_name, node in self.nodes.items():
-            for neighbor_name in node.links:
-                link_name = H.get_link_name(node_name, neighbor_name)
-                if link_name not in self.node_links:
-                    node_center, node_corners = self.node_rectangles[node_name]
-                    neighbor_center, neighbor_corners = self.node_rectangles[neighbor_name]
-
-                    # Pick points to draw links to/from.
-                    def node_dist(p): return H.distance(p, neighbor_center)
-                    def neighbor_dist(p): return H.distance(p, node_center)
-                    node_corners_nearest = sorted(node_corners, key=node_dist)
-                    neighbor_corners_nearest = sorted(neighbor_corners, key=neighbor_dist)
-                    n1, n2 = node_corners_nearest[:2]
-                    node_link_corner = n1 if abs(node_dist(n1) - node_dist(n2)) > 1.0 else H.average(n1, n2)
-                    n1, n2 = neighbor_corners_nearest[:2]
-                    neighbor_link_corner = n1 if abs(neighbor_dist(n1) - neighbor_dist(n2)) > 1.0 else H.average(n1, n2)
-                    self.node_links[link_name] = (node_link_corner, neighbor_link_corner)
-
-    # Sets up simulation network.
-    def setup(self, network_nodes, sim_packets):
-        # Nodes.
-        for node_name, node in network_nodes.items():
-            x, y = node.xy
-            assert 0 < x < self.world_width and 0 < y < self.world_height
-            assert '_' not in node_name, 'Name cannot have an underscore!'
-        self.nodes = network_nodes
-
-        # Simulation packet schedule. Sorted so packets to be sent now are at front of list.
-        self.pkts_schedule = sorted(sim_packets, key=lambda p: p[0], reverse=True)
-        self.pkts_schedule_original_copy = self.pkts_schedule.copy()
-
-        # Current packets in flight
-        self.pkts_inflight = []
-
-        # Setup network
-        self.setup_network()
+        for node in self.sim.nodes:
+            for neighbor_id in node.links:
+                link_key = H.get_link_key(node.id, neighbor_id)
+                if link_key not in self.node_links:
+                    node_center, node_corners = self.node_rectangles[node.id]
+                    neighbor_center, neighbor_corners = self.node_rectangles[neighbor_id]
+
+                    # Pick points to draw links to/from. Corners are ordered by squared distance, so square roots are
+                    # only taken for the nearest two.
+                    n1, n2 = sorted(node_corners, key=lambda p: H.distance_sq(p, neighbor_center))[:2]
+                    node_link_corner = n1 if abs(H.distance(n1, neighbor_center) - H.distance(n2, neighbor_center)) > 1.0 else H.average(n1, n2)
+                    n1, n2 = sorted(neighbor_corners, key=lambda p: H.distance_sq(p, node_center))[:2]
+                    neighbor_link_corner = n1 if abs(H.distance(n1, node_center) - H.distance(n2, node_center)) > 1.0 else H.average(n1, n2)
+                    self.node_links[link_key] = (node_link_corner, neighbor_link_corner)
+
+    # Assign nodes and links to render cells. Shapes are built when a cell is first drawn.
+    def setup_shapes(self):
+        for node_id, ((x, y), _) in self.node_rectangles.items():
+            cell = self.grid.get_cell(x, y)
+            self.cells.setdefault(cell, RenderCell()).node_ids.append(node_id)
+        self.node_cells = [self.cells[self.grid.get_cell(*node.xy)] for node in self.sim.nodes]
+
+        for start_xy, end_xy in self.node_links.values():
+            cell = self.grid.get_cell(*H.average(start_xy, end_xy))
+            self.cells.setdefault(cell, RenderCell()).link_points.extend((start_xy, end_xy))
+            self.link_margin = max(self.link_margin, abs(start_xy[0] - end_xy[0]) / 2, abs(start_xy[1] - end_xy[1]) / 2)
+
+        self.fill_keys = [None] * len(self.sim.nodes)
+        self.update_fills(self.snapshot.batteries)
+
+    # Returns how the battery of a node is filled in: its height in pixels times two plus one if it is above the low
+    # battery level. -1 for dead nodes, which are shown as full red.
+    @staticmethod
+    def get_fill_key(battery):
+        if battery == 0.0:
+            return -1
+        return 2 * round(C.NODE_RECT_SIZE * battery) + (battery >= 0.2)
+
+    # Mark cells with nodes whose battery fill changed for rebuilding. batteries are by node id.
+    def update_fills(self, batteries):
+        fill_keys = self.fill_keys
+        for node_id, battery in enumerate(batteries):
+            key = self.get_fill_key(battery)
+            if key != fill_keys[node_id]:
+                fill_keys[node_id] = key
+                cell = self.node_cells[node_id]
+                cell.fills_dirty = cell.clusters_dirty = True
+
+    # Build shapes of a cell that never change: node outlines (four lines each), links and node labels.
+    def build_cell(self, cell):
+        outline_points = []
+        for node_id in cell.node_ids:
+            _, (bl, br, tl, tr) = self.node_rectangles[node_id]
+            outline_points.extend((bl, br, br, tr, tr, tl, tl, bl))
+        cell.outlines = arc.ShapeElementList()
+        if outline_points:
+            cell.outlines.append(arc.create_lines(outline_points, arc.color.BLUE, 1))
+
+        cell.links = arc.ShapeElementList()
+        if cell.link_points:
+            cell.links.append(arc.create_lines(cell.link_points, arc.color.BLACK, 2))
+
+    # Rebuild battery fills of the nodes of a cell as a single shape.
+    def build_cell_fills(self, cell):
+        points, colors = [], []
+        s = C.NODE_RECT_SIZE / 2
+        for node_id in cell.node_ids:
+            key = self.fill_keys[node_id]
+            if key == -1:
+                h, color = C.NODE_RECT_SIZE, arc.color.RED
+            else:
+                h, color = key // 2, arc.color.GREEN if key % 2 else arc.color.YELLOW
+            if h == 0:
+                continue
+            x, y = self.node_rectangles[node_id][0]
+            points.extend(((x - s, y - s), (x + s, y - s), (x + s, y - s + h), (x - s, y - s + h)))
+            colors.extend((color,) * 4)
+
+        cell.fills = arc.ShapeElementList()
+        if points:
+            cell.fills.append(arc.create_rectangles_filled_with_colors(points, colors))
+        cell.fills_dirty = False
+
+    # Rebuild cluster dots of a cell as a single shape. Nodes are clustered by CLUSTER_SIZE squares. Each dot is placed
+    # at the center of its nodes, grows with their number and has the color of the worst battery among them.
+    def build_cell_clusters(self, cell):
+        clusters = {}
+        for node_id in cell.node_ids:
+            (x, y), _ = self.node_rectangles[node_id]
+            key = self.fill_keys[node_id]
+            status = 0 if key == -1 else 2 if key % 2 else 1
+            cluster = clusters.setdefault((x // C.CLUSTER_SIZE, y // C.CLUSTER_SIZE), [0, 0, 0, status])
+            cluster[0] += x
+            cluster[1] += y
+            cluster[2] += 1
+            cluster[3] = min(cluster[3], status)
+
+        points, colors = [], []
+        status_colors = (arc.color.RED, arc.color.YELLOW, arc.color.GREEN)
+        for sum_x, sum_y, count, status in clusters.values():
+            x, y = sum_x / count, sum_y / count
+            s = min(C.NODE_RECT_SIZE / 2 * count ** 0.5, C.CLUSTER_SIZE / 2)
+            points.extend(((x - s, y - s), (x + s, y - s), (x + s, y + s), (x - s, y + s)))
+            colors.extend((status_colors[status],) * 4)
+
+        cell.clusters = arc.ShapeElementList()
+        if points:
+            cell.clusters.append(arc.create_rectangles_filled_with_colors(points, colors))
+        cell.clusters_dirty = False
+
+    # Generate render cells that may have shapes in view. margin is how far shapes reach out of their cell.
+    def gen_visible_cells(self, margin):
+        vp_x_start, vp_x_end, vp_y_start, vp_y_end = self.get_viewport()
+        for key in self.grid.gen_cell_range(vp_x_start - margin, vp_y_start - margin, vp_x_end + margin, vp_y_end + margin):
+            cell = self.cells.get(key)
+            if cell is not None:
+                yield cell
+
+    # Returns ids of the nodes whose rectangle contains the world point, in id order.
+    def get_nodes_at(self, x, y):
+        s = C.NODE_RECT_SIZE / 2
+        hits = []
+        for node_id in self.grid.gen_items(x - s, y - s, x + s, y + s):
+            _, [(bl_x, bl_y), _, _, (tr_x, tr_y)] = self.node_rectangles[node_id]
+            if bl_x <= x <= tr_x and bl_y <= y <= tr_y:
+                hits.append(node_id)
+        return sorted(hits)
+
+    # Set view to show the world from the given lower left corner at the current zoom.
+    def set_view(self, x, y):
+        view_width, view_height = self.screen_width * self.zoom, self.screen_height * self.zoom
+        self.view_x = H.clamp(x, 0, self.world_width - view_width)
+        self.view_y = H.clamp(y, 0, self.world_height - view_height)
+        self.set_viewport(self.view_x, self.view_x + view_width, self.view_y, self.view_y + view_height)
 
     # Run simulation.
     def run(self):
         # Keep the window open until the user hits the 'close' button.
+        self.runner.start()
         arc.run()
+        self.runner.stop()
 
-    # Draws network nodes and links.
+    # Draws network nodes and links in view.
     def draw_network(self):
-        # Draw nodes.
-        for node_name, ((x, y), _) in self.node_rectangles.items():
-            node_battery = self.nodes[node_name].battery
-            arc.draw_rectangle_outline(x, y, C.NODE_RECT_SIZE, C.NODE_RECT_SIZE, arc.color.BLUE, 1)
-
-            # Draw battery level. Show dead nodes as full red.
-            if node_battery == 0.0:
-                arc.draw_rectangle_filled(x, y, C.NODE_RECT_SIZE, C.NODE_RECT_SIZE, arc.color.RED)
-            else:
-                arc.draw_rectangle_filled(x, y - (C.NODE_RECT_SIZE*(1-node_battery) / 2),
-                                          C.NODE_RECT_SIZE, C.NODE_RECT_SIZE*node_battery,
-                                          arc.color.GREEN if node_battery >= 0.2 else arc.color.YELLOW)
+        # Zoomed out far: only cluster dots.
+        if self.zoom > C.ZOOM_DETAIL_MAX:
+            for cell in self.gen_visible_cells(C.CLUSTER_SIZE):
+                if cell.clusters_dirty:
+                    self.build_cell_clusters(cell)
+                cell.clusters.draw()
+            return
 
-            # Label nodes.
-            arc.draw_text('{}'.format(node_name), x, y, arc.color.BLACK, font_size=15, width=50, bold=True, align='center', anchor_x='center', anchor_y='center')
+        cells = list(self.gen_visible_cells(max(self.link_margin, C.NODE_RECT_SIZE)))
+        for cell in cells:
+            if cell.outlines is None:
+                self.build_cell(cell)
+            if cell.fills_dirty:
+                self.build_cell_fills(cell)
+
+        # Draw nodes. Show dead nodes as full red.
+        for cell in cells:
+            cell.outlines.draw()
+            cell.fills.draw()
+
+        # Label nodes in view.
+        if self.zoom <= C.ZOOM_LABELS_MAX:
+            vp_x_start, vp_x_end, vp_y_start, vp_y_end = self.get_viewport()
+            s = C.NODE_RECT_SIZE
+            for cell in cells:
+                if cell.labels is None:
+                    cell.labels = [(*self.node_rectangles[node_id][0], CachedText(self.sim.nodes[node_id].name, 15, 50, align='center', anchor_x='center', multiline=False)) for node_id in cell.node_ids]
+                for x, y, label in cell.labels:
+                    if vp_x_start - s <= x <= vp_x_end + s and vp_y_start - s <= y <= vp_y_end + s:
+                        label.draw(x, y)
 
         # Draw links.
-        for _, (start_xy, end_xy) in self.node_links.items():
-            arc.draw_line(*start_xy, *end_xy, arc.color.BLACK, 2)
+        for cell in cells:
+            cell.links.draw()
 
     # Draws information text.
     def draw_info_text(self):
@@ -138,234 +312,58 @@ class NetworkSimulation(arc.Window):
         x, y = vp_x_end - C.SIM_INFO_RECT_SIZE_W / 2, vp_y_end - C.SIM_INFO_RECT_SIZE_H / 2
         arc.draw_rectangle_filled(x, y, C.SIM_INFO_RECT_SIZE_W, C.SIM_INFO_RECT_SIZE_H, arc.color.WHITE)
         arc.draw_rectangle_outline(x, y, C.SIM_INFO_RECT_SIZE_W, C.SIM_INFO_RECT_SIZE_H, arc.color.BLACK, 1)
-        arc.draw_text(self.text_info.format(self.ts, self.auto_step_speed, self.move_speed, self.show_packet_log),
-                      x + 5 - C.SIM_INFO_RECT_SIZE_W / 2, y,
-                      arc.color.BLACK, font_size=C.TEXT_SIZE, width=C.SIM_INFO_RECT_SIZE_W, bold=True, align='left', anchor_x='left', anchor_y='center')
+        self.label_info.set_text(self.text_info.format(self.snapshot.ts, self.auto_step_speed or 'max', self.move_speed, self.zoom, self.show_packet_log))
+        self.label_info.draw(x + 5 - C.SIM_INFO_RECT_SIZE_W / 2, y)
 
         # Node info.
         x, y = vp_x_end - C.NODE_INFO_RECT_SIZE_W / 2, vp_y_end - C.NODE_INFO_RECT_SIZE_H / 2 - C.SIM_INFO_RECT_SIZE_H
         arc.draw_rectangle_filled(x, y, C.NODE_INFO_RECT_SIZE_W, C.NODE_INFO_RECT_SIZE_H, arc.color.WHITE)
         arc.draw_rectangle_outline(x, y, C.NODE_INFO_RECT_SIZE_W, C.NODE_INFO_RECT_SIZE_H, arc.color.BLACK, 1)
-        arc.draw_text('\n'.join(self.text_node_info[-C.NODE_INFO_MAX_LINES:]),
-                      x + 5 - C.NODE_INFO_RECT_SIZE_W / 2, y,
-                      arc.color.BLACK, font_size=C.TEXT_SIZE, width=C.NODE_INFO_RECT_SIZE_W, bold=True, align='left', anchor_x='left', anchor_y='center')
+        self.label_node_info.draw(x + 5 - C.NODE_INFO_RECT_SIZE_W / 2, y)
 
         # Packet info.
         x, y = vp_x_end - C.PKT_INFO_RECT_SIZE_W / 2, vp_y_end - C.PKT_INFO_RECT_SIZE_H / 2 - C.SIM_INFO_RECT_SIZE_H - C.NODE_INFO_RECT_SIZE_H
         arc.draw_rectangle_filled(x, y, C.PKT_INFO_RECT_SIZE_W, C.PKT_INFO_RECT_SIZE_H, arc.color.WHITE)
         arc.draw_rectangle_outline(x, y, C.PKT_INFO_RECT_SIZE_W, C.PKT_INFO_RECT_SIZE_H, arc.color.BLACK, 1)
-        arc.draw_text("Press 'S' to {} packet info!".format("hide" if self.show_packet_log else "show"),
-                      x + 5 - C.PKT_INFO_RECT_SIZE_W / 2, y,
-                      arc.color.BLACK, font_size=C.TEXT_SIZE, width=C.PKT_INFO_RECT_SIZE_W, bold=True, align='left',
-                      anchor_x='left', anchor_y='center')
+        self.label_packets_toggle.set_text("Press 'S' to {} packet info!".format("hide" if self.show_packet_log else "show"))
+        self.label_packets_toggle.draw(x + 5 - C.PKT_INFO_RECT_SIZE_W / 2, y)
         if self.show_packet_log:
             x, y = vp_x_start + C.PKT_INFO_EXPANDED_RECT_SIZE_W / 2, vp_y_start + C.PKT_INFO_EXPANDED_RECT_SIZE_H / 2
             arc.draw_rectangle_filled(x, y, C.PKT_INFO_EXPANDED_RECT_SIZE_W, C.PKT_INFO_EXPANDED_RECT_SIZE_H, arc.color.WHITE)
             arc.draw_rectangle_outline(x, y, C.PKT_INFO_EXPANDED_RECT_SIZE_W, C.PKT_INFO_EXPANDED_RECT_SIZE_H, arc.color.BLACK, 1)
-            self.text_packets = self.log.pkt_buffer
-            arc.draw_text('\n'.join(self.text_packets[-C.PKT_INFO_MAX_LINES:]),
-                          x + 5 - C.PKT_INFO_EXPANDED_RECT_SIZE_W / 2, y,
-                          arc.color.BLACK, font_size=C.TEXT_SIZE_DETAILED, width=C.PKT_INFO_EXPANDED_RECT_SIZE_W, bold=True, align='left', anchor_x='left', anchor_y='center')
+            # Packet text only changes with the simulation time step.
+            if self.text_packets_ts != self.snapshot.ts:
+                self.text_packets, self.text_packets_ts = self.snapshot.pkt_log, self.snapshot.ts
+                self.label_packets.set_text('\n'.join(self.text_packets))
+            self.label_packets.draw(x + 5 - C.PKT_INFO_EXPANDED_RECT_SIZE_W / 2, y)
 
     # Draw updated callback.
     def on_draw(self):
         arc.start_render()
 
         self.draw_network()
+
+        # Info text is drawn in screen coordinates so it keeps its size at any zoom.
+        self.set_viewport(0, self.screen_width, 0, self.screen_height)
         self.draw_info_text()
+        self.set_view(self.view_x, self.view_y)
 
-    # Maintains nodes and links.
-    # Each node updates its lat estimate and sends to neighbors if enough time has passed.
-    def maintain_nodes_and_links(self):
-        # We update estimates every time-step. We update links to neighbors every other time-step as per ECR protocol.
-        update_estimates = True
-        update_links = (self.ts % 2 == 0)
-
-        for n_name, n in self.nodes.items():
-            # Progress node.
-            n.progress(self.ts, update_estimates)
-
-            # Have each node send lat to neighbors if link maintenance is to be performed.
-            if update_links:
-                if not n.is_alive():
-                    for neighbor_name in n.links:
-                        self.nodes[neighbor_name].cleanup_dead_neighbor(n_name)
-                else:
-                    for neighbor_name in n.links:
-                        neighbor = self.nodes[neighbor_name]
-                        if neighbor.is_alive():
-                            # Have each node update its neighbor and vise versa.
-                            n.update_or_create_rmt_entry(dst=neighbor_name, next_hop=neighbor_name, lat_r=neighbor.lat, df=0, ts=self.ts)
-                            neighbor.update_or_create_rmt_entry(dst=n_name, next_hop=n_name, lat_r=n.lat, df=0, ts=self.ts)
-
-    # Update in-flight packets.
-    def update_packets(self):
-        # Handle all in-flight packets. Add any newly generated packets as well.
-        new_inflight = []
-        for pkt in self.pkts_inflight:
-            new_inflight_tmp, had_err = self.nodes[pkt.next_hop].handle_packet(pkt, self.ts, self.log)
-            new_inflight.extend(new_inflight_tmp)
-            if had_err:
-                self.log.write("   ERROR: Could not handle in-flight [{}] message at node [{}]!".format(pkt, pkt.next_hop), is_error=True)
-        self.pkts_inflight = new_inflight
-
-    # Attempt to send scheduled packets
-    def attempt_scheduled_send(self):
-        if not self.pkts_schedule:
-            self.log.write("  No packets left to send! All required packets are in in-flight.")
+    # Update callback. Picks up the latest snapshot of the simulation.
+    def update(self, delta_time):
+        snapshot = self.runner.snapshot
+        if snapshot is self.snapshot:
             return
+        self.snapshot = snapshot
+        self.update_fills(snapshot.batteries)
 
-        # Try and send each packet that needs to be sent.
-        schedule_updated = []
-        while self.pkts_schedule and self.pkts_schedule[-1][0] == self.ts:
-            ts, src, dst, num = self.pkts_schedule[-1]
-
-            # Try and send packet.
-            new_inflight, packet_sent, error = self.nodes[src].attempt_to_send_packet(dst, ts, self.log)
-            if error:
-                self.log.write("  ERROR: Node [{}] cannot route packets to [{}]! The node may be offline or unreachable! Any future packets to this destination will not be sent!".format(src, dst), is_error=True)
-                num = 0
-            else:
-                self.pkts_inflight.extend(new_inflight)
-                if packet_sent:
-                    # Packet was sent.
-                    num -= 1
-
-            # Add new number to updated schedule for the next time-step.
-            if num != 0:
-                schedule_updated.append((ts + 1, src, dst, num))
-            self.pkts_schedule.pop()
-
-        self.pkts_schedule.extend(schedule_updated)
-
-    # Update callback.
-    def update(self, delta_time):
-        # Handle auto stepping.
-        if self.auto_step:
-            self.auto_step_ts -= delta_time
-            if self.auto_step_ts <= 0 or C.SPEED_UP_EXECUTION:
-                self.needs_update = True
-                self.auto_step_ts = 1 / self.auto_step_speed
-
-        # Update network.
-        if self.needs_update:
-            self.ts += 1
-            self.log.write("ts: [{:05d}]  In-Flight at start [{}]".format(self.ts, len(self.pkts_inflight)), is_full=True, is_packet=True, is_error=True)
-
-            # print('Schedule: ', self.pkts_schedule)
-            # print('Flight: ', self.pkts_inflight)
-
-            # Update and maintain links.
-            # Each node updates its lat estimate and passes it to neighbors.
-            self.log.write("\nUpdating nodes and maintaining links if needed".format(self.ts))
-            self.maintain_nodes_and_links()
-
-            # Update inflight packets.
-            # Nodes on the receiving end of packets sent at previous ts handle them and create new packets in response.
-            self.log.write("\nUpdating the [{}] in-flight packets".format(len(self.pkts_inflight)))
-            self.update_packets()
-
-            # Send simulation packets.
-            # We try and send the packets that simulate application layer requests.
-            self.log.write("\nAttempting to send the required simulation packets")
-            self.attempt_scheduled_send()
-
-            # Store energy history.
-            for n_name, n in self.nodes.items():
-                self.network_energy[n_name].append(n.battery)
-
-            # print('\nSchedule: ', self.pkts_schedule)
-            # print('Flight: ', self.pkts_inflight)
-
-            # Update is done. Wait until next ts.
-            self.needs_update = False
-            self.log.write("\nDone updating: there are now [{}] in-flight packets.".format(len(self.pkts_inflight)))
-            self.log.write("||||||||||||||||||||||||||||||||||")
-
-            # Close simulation if we are done.
-            if not(self.pkts_schedule or self.pkts_inflight) or all(not n.is_alive() for _, n in self.nodes.items()):
-                self.cleanup_and_close()
+        # Close the window once the simulation is finished.
+        if snapshot.done:
+            arc.close_window()
 
     # Cleanup and close simulation. Print performance stats to logs.
     def cleanup_and_close(self, is_forced=False):
-        # Print details of why simulation ended.
-        if is_forced:
-            self.log.write("Closing simulation based on user request!", is_performance=True)
-        elif not(self.pkts_schedule or self.pkts_inflight):
-            self.log.write("Simulation done! All simulated packets have been delivered.", is_performance=True)
-        else:
-            self.log.write("Simulation done! Enough network nodes are dead that packets can no longer be routed as required.", is_performance=True)
-
-        # Log simulation packet stats.
-        for t, src, dst, cnt in self.pkts_schedule_original_copy:
-            rt_name = H.get_route_name(src=src, dst=dst)
-
-            # Display link information
-            if cnt < 0:
-                log_str = "\nAt [{:05d}] Node [{}] was requested to send as many packets as possible to Node [{}]".format(t, src, dst)
-            else:
-                log_str = "\nAt [{:05d}] Node [{}] was requested to send [{}] packets to Node [{}]".format(t, src, cnt, dst)
-            self.log.write(log_str, is_full=False, is_performance=True)
-
-            # Display sent information.
-            self.log.write("  Node [{}] sent [{}] packets (including any necessary retries)".format(src, self.nodes[src].num_rp_sent[dst]), is_full=False, is_performance=True)
-            rp_sent = self.nodes[src].rp_sent[rt_name]
-            rp_sent_end_times = defaultdict(int)
-            log_strs = []
-            for i, (t_start, next_hop) in enumerate(rp_sent):
-                if rp_sent_end_times[next_hop] > t_start:
-                    continue
-
-                t_end = t_start + 1
-                rp_cnt = 1
-                j = i + 1
-                while j < len(rp_sent):
-                    sent_ts, sent_node = rp_sent[j]
-                    if sent_ts > t_end + 1:
-                        break
-                    elif sent_node == next_hop:
-                        t_end = sent_ts + 1
-                        rp_cnt += 1
-                    j += 1
-
-                rp_sent_end_times[next_hop] = t_end
-                log_strs.append("    ts: [{:05d}]-[{:05d}]: [{}] sent [{}] packets through [{}]".format(t_start, t_end, src, rp_cnt, next_hop))
-            for s in sorted(log_strs):
-                self.log.write(s, is_full=False, is_performance=True)
-
-            # Display received information.
-            self.log.write("  Node [{}] received [{}] packets".format(dst, self.nodes[dst].num_rp_received[src]), is_full=False, is_performance=True)
-            rp_received = self.nodes[dst].rp_received[rt_name]
-            rp_received_end_times = defaultdict(int)
-            log_strs = []
-            for i, (t_start, prev_hop) in enumerate(rp_received):
-                if rp_received_end_times[prev_hop] > t_start:
-                    continue
-
-                t_end = t_start + 1
-                rp_cnt = 1
-                j = i + 1
-                while j < len(rp_received):
-                    received_ts, received_node = rp_received[j]
-                    if received_ts > t_end + 1:
-                        break
-                    elif received_node == prev_hop:
-                        t_end += received_ts + 1
-                        rp_cnt += 1
-                    j += 1
-
-                rp_received_end_times[prev_hop] = t_end
-                log_strs.append("    ts: [{:05d}]-[{:05d}]: [{}] received [{}] packets via [{}]".format(t_start, t_end, dst, rp_cnt, prev_hop))
-            for s in sorted(log_strs):
-                self.log.write(s, is_full=False, is_performance=True)
-
-        # Log energy history.
-        self.log.write("Energy History:", is_full=False, is_energy=True)
-        if self.ts >= 1:
-            n_nodes = len(self.network_energy)
-            for i in range(len(self.network_energy[next(iter(self.network_energy))])):
-                avg_energy = sum(energies[i] for _, energies in self.network_energy.items()) / n_nodes
-                self.log.write("{:.5f}".format(avg_energy), is_full=False, is_energy=True)
+        self.runner.stop()
+        self.sim.finish(is_forced)
 
         # Close the window and cleanup.
         arc.close_window()
@@ -393,19 +391,18 @@ class NetworkSimulation(arc.Window):
                 else:
                     assert False
 
-                # Update viewport.
-                vp = self.get_viewport()
-                vp_new_x = H.clamp(vp[0] + x * self.move_speed, 0, self.world_width - self.screen_width)
-                vp_new_y = H.clamp(vp[2] + y * self.move_speed, 0, self.world_height - self.screen_height)
-                self.set_viewport(vp_new_x, vp_new_x + self.screen_width, vp_new_y, vp_new_y + self.screen_height)
+                # Update viewport. Moves cover the same part of the screen at any zoom.
+                self.set_view(self.view_x + x * self.move_speed * self.zoom, self.view_y + y * self.move_speed * self.zoom)
 
             elif symbol == arc.key.N:
                 # Manually step forward in simulation.
                 self.auto_step = False
-                self.needs_update = True
+                self.runner.set_running(False)
+                self.runner.request_step()
             elif symbol == arc.key.A:
                 # Automatically step forward in simulation.
                 self.auto_step = not self.auto_step
+                self.runner.set_running(self.auto_step)
 
             elif symbol == arc.key.EQUAL:
                 # Increase move speed.
@@ -417,16 +414,19 @@ class NetworkSimulation(arc.Window):
             elif symbol == arc.key.BRACKETRIGHT:
                 # Increase auto-simulation speed.
                 self.auto_step_speed *= 2
+                self.runner.set_rate(self.auto_step_speed)
             elif symbol == arc.key.BRACKETLEFT:
                 # Decrease auto-simulation speed.
                 self.auto_step_speed /= 2
+                self.runner.set_rate(self.auto_step_speed)
 
             elif symbol == arc.key.S:
                 # Show packets text.
                 self.show_packet_log = not self.show_packet_log
 
             else:
-                self.log.write("INFO: Unused key released: [{}]".format(symbol))
+                with self.runner.lock:
+                    self.sim.log.write("INFO: Unused key released: [{}]".format(symbol))
 
     def on_mouse_drag(self, x, y, dx, dy, _buttons, _modifiers):
         pass
@@ -442,13 +442,13 @@ class NetworkSimulation(arc.Window):
         if modifiers == C.MODIFIER_NO:
             # Check if we clicked on node.
             if button == arc.MOUSE_BUTTON_LEFT:
-                x_offset, _, y_offset, _ = self.get_viewport()
-                x_world, y_world = x + x_offset, y + y_offset
-                for node_name, (_, [(bl_x, bl_y), _, _, (tr_x, tr_y)]) in self.node_rectangles.items():
-                    if bl_x <= x_world <= tr_x and bl_y <= y_world <= tr_y:
+                x_world, y_world = self.view_x + x * self.zoom, self.view_y + y * self.zoom
+                # Node state is read and logged while the simulation thread is not stepping.
+                with self.runner.lock:
+                    for node_id in self.get_nodes_at(x_world, y_world):
                         # Node was clicked on print information.
-                        self.log.write("\nPrinting stats for node [{}]".format(node_name))
-                        node = self.nodes[node_name]
+                        node = self.sim.nodes[node_id]
+                        self.sim.log.write("\nPrinting stats for node [{}]".format(node.name))
                         info_txt = ["\n  Battery Level: [{:.7f}]".format(node.battery),
                                     "  LAT_n: [{:.7f}]".format(node.lat),
                                     "\n  P_Sample: [{:.7f}]".format(node.p_sample),
@@ -459,15 +459,20 @@ class NetworkSimulation(arc.Window):
                             info_txt.append("    RMT is empty!")
                         else:
                             node.sort_rmt()
-                            for dst, entries in sorted(node.rmt.items()):
+                            for dst, entries in sorted(node.rmt.items(), key=lambda item: node.names[item[0]]):
                                 for next_hop, lat_r, d_f in entries:
-                                    info_txt.append("    [{}] [{}] [{:.5f}] [{:02d}]".format(dst, next_hop, lat_r, d_f))
+                                    info_txt.append("    [{}] [{}] [{:.5f}] [{:02d}]".format(node.names[dst], node.names[next_hop], lat_r, d_f))
 
                         # Log and display text.
                         for t in info_txt:
-                            self.log.write(t)
-                        self.text_node_info = ["Node [{}] info at ts [{}]".format(node_name, self.ts)]
+                            self.sim.log.write(t)
+                        self.text_node_info = ["Node [{}] info at ts [{}]".format(node.name, self.sim.ts)]
                         self.text_node_info.extend(info_txt)
+                        self.label_node_info.set_text('\n'.join(self.text_node_info[-C.NODE_INFO_MAX_LINES:]))
 
+    # Zoom in and out around the mouse position.
     def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
-        pass
+        zoom = H.clamp(self.zoom / C.ZOOM_CHANGE_RATE ** scroll_y, C.ZOOM_MIN, self.zoom_max)
+        x_world, y_world = self.view_x + x * self.zoom, self.view_y + y * self.zoom
+        self.zoom = zoom
+        self.set_view(x_world - x * zoom, y_world - y * zoom)
@@ -0,0 +1,158 @@
+import argparse
+import mmap
+import struct
+from array import array
+from collections import namedtuple
+
+import PacketTypes as PT
+
+# Binary trace of a simulation run. Holds one row per packet event and the battery of every node at every time step.
+# Layout (little endian):
+#   header: magic, version, number of nodes, length of names block, names block (utf-8 node names joined by newlines)
+#   then for every time step:
+#     step header: ts, number of packet events
+#     battery row: one float64 per node (by id)
+#     packet events: one EVENT record each
+TRACE_MAGIC = b'ECRTRACE'
+TRACE_VERSION = 1
+HEADER = struct.Struct('<8sIII')
+STEP = struct.Struct('<iI')
+# ts, event, packet type, node, next hop, message src, message dst, payload (RP payload, RE code, -1 otherwise).
+EVENT = struct.Struct('<iBBiiiiq')
+
+# Packet events. Sent packets are recorded in the step they are sent and handled in the step after.
+EVENT_SENT, EVENT_DROPPED = range(2)
+EVENT_NAMES = ('sent', 'dropped')
+
+TraceEvent = namedtuple('TraceEvent', ('ts', 'event', 'type', 'node', 'next_hop', 'src', 'dst', 'payload'))
+
+
+# Packs packet event into EVENT record.
+def pack_event(ts, event, pkt):
+    msg = pkt.msg
+    if pkt.type == PT.TYPE_RU:
+        src, dst, payload = msg.src_route, msg.dst_route, -1
+    else:
+        src, dst = msg.src, msg.dst
+        payload = msg.payload if pkt.type == PT.TYPE_RP else msg.code if pkt.type == PT.TYPE_RE else -1
+    return EVENT.pack(ts, event, pkt.type, pkt.current_node, pkt.next_hop, src, dst, payload)
+
+
+# Writes trace of a simulation run. Events of the current step are collected until write_step is called.
+class TraceWriter:
+    def __init__(self, fn, names):
+        self.num_nodes = len(names)
+        self.f = open(fn, 'wb', buffering=1 << 20)
+        names_block = '\n'.join(names).encode('utf-8')
+        self.f.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, self.num_nodes, len(names_block)))
+        self.f.write(names_block)
+        self.events = []
+
+    # Record event of packet during the current step.
+    def add_packet(self, ts, event, pkt):
+        self.events.append(pack_event(ts, event, pkt))
+
+    # Write time step. pkts are the packets sent during the step and batteries the battery of every node.
+    def write_step(self, ts, pkts, batteries):
+        assert len(batteries) == self.num_nodes
+        self.events.extend(pack_event(ts, EVENT_SENT, pkt) for pkt in pkts)
+        self.f.write(STEP.pack(ts, len(self.events)))
+        self.f.write(array('d', batteries).tobytes())
+        self.f.write(b''.join(self.events))
+        self.events.clear()
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+
+
+# Reads trace written by TraceWriter. The file is memory-mapped and only the step headers are read up front, so
+# events and battery rows are decoded only for the steps that are asked for.
+class TraceReader:
+    def __init__(self, fn):
+        self.f = open(fn, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.num_nodes, names_len = HEADER.unpack_from(self.mm, 0)
+        assert magic == TRACE_MAGIC, 'File [{}] is not a network trace!'.format(fn)
+        assert version == TRACE_VERSION, 'Unsupported trace version [{}]!'.format(version)
+        self.names = self.mm[HEADER.size:HEADER.size + names_len].decode('utf-8').split('\n') if names_len else []
+
+        # Index of steps as (ts, offset of battery row, number of events).
+        self.index = []
+        offset, row_size = HEADER.size + names_len, 8 * self.num_nodes
+        while offset < len(self.mm):
+            ts, num_events = STEP.unpack_from(self.mm, offset)
+            self.index.append((ts, offset + STEP.size, num_events))
+            offset += STEP.size + row_size + num_events * EVENT.size
+
+    # Returns battery of every node at a step in the index.
+    def battery_row(self, i):
+        _, offset, _ = self.index[i]
+        row = array('d')
+        row.frombytes(self.mm[offset:offset + 8 * self.num_nodes])
+        return row
+
+    # Returns packet events at a step in the index.
+    def step_events(self, i):
+        _, offset, num_events = self.index[i]
+        offset += 8 * self.num_nodes
+        return [TraceEvent._make(e) for e in EVENT.iter_unpack(self.mm[offset:offset + num_events * EVENT.size])]
+
+    # Replay run step by step. Yields (ts, battery row, events) for every step in [ts_start, ts_end].
+    def replay(self, ts_start=None, ts_end=None):
+        for i, (ts, _, _) in enumerate(self.index):
+            if (ts_start is None or ts >= ts_start) and (ts_end is None or ts <= ts_end):
+                yield ts, self.battery_row(i), self.step_events(i)
+
+    # Yields packet events matching all the given filters. types and events are collections of type and event tags.
+    # node matches events at or going to the node. src and dst match the message source and destination.
+    def events(self, ts_start=None, ts_end=None, types=None, events=None, node=None, src=None, dst=None):
+        for i, (ts, _, num_events) in enumerate(self.index):
+            if not num_events or (ts_start is not None and ts < ts_start) or (ts_end is not None and ts > ts_end):
+                continue
+            for e in self.step_events(i):
+                if types is not None and e.type not in types:
+                    continue
+                if events is not None and e.event not in events:
+                    continue
+                if node is not None and node != e.node and node != e.next_hop:
+                    continue
+                if (src is not None and e.src != src) or (dst is not None and e.dst != dst):
+                    continue
+                yield e
+
+    # Returns string representation of event using node names.
+    def format_event(self, e):
+        return 'ts: [{:05d}] {} [{}] at [{}] with next hop [{}] from [{}] to [{}] payload [{}]'.format(
+            e.ts, EVENT_NAMES[e.event], PT.TYPE_NAMES[e.type], self.names[e.node], self.names[e.next_hop], self.names[e.src], self.names[e.dst], e.payload)
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Print filtered packet events of a trace.
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Prints packet events of a network trace.')
+    arg_parser.add_argument('trace_file', help='Trace file written with --trace_file.', type=str)
+    arg_parser.add_argument('--ts_start', help='First time step to print.', type=int, default=None)
+    arg_parser.add_argument('--ts_end', help='Last time step to print.', type=int, default=None)
+    arg_parser.add_argument('--types', help='Packet types to print.', type=str, nargs='+', choices=PT.TYPE_NAMES, default=None)
+    arg_parser.add_argument('--node', help='Only print events at or going to node.', type=str, default=None)
+    arg_parser.add_argument('--src', help='Only print events of messages from node.', type=str, default=None)
+    arg_parser.add_argument('--dst', help='Only print events of messages to node.', type=str, default=None)
+    args = arg_parser.parse_args()
+
+    with TraceReader(args.trace_file) as reader:
+        ids = {name: i for i, name in enumerate(reader.names)}
+        types = None if args.types is None else {PT.TYPE_NAMES.index(t) for t in args.types}
+        node, src, dst = (None if name is None else ids[name] for name in (args.node, args.src, args.dst))
+        for e in reader.events(args.ts_start, args.ts_end, types=types, node=node, src=src, dst=dst):
+            print(reader.format_event(e))
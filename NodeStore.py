@@ -0,0 +1,150 @@
+import operator
+from types import SimpleNamespace
+
+import numpy as np
+
+from NetworkNode import NetworkNode
+
+# Per node state kept in the arrays of a NodeStore.
+FIELDS = ('battery', 'p_sample', 'p_hat', 'lat')
+
+
+# Property reading and writing a field of a node from the arrays of the NodeStore the node is bound to.
+# Goes through a memoryview of the array, which is much faster than indexing the array for single values.
+def store_field(name):
+    get_view = operator.attrgetter('store.views.' + name)
+
+    def get(node):
+        return get_view(node)[node.id]
+
+    def set(node, value):
+        get_view(node)[node.id] = value
+
+    return property(get, set)
+
+
+# NetworkNode whose FIELDS live in the arrays of a NodeStore (see NodeStore.bind).
+# Pickles as a plain NetworkNode holding the current values, so checkpoints do not depend on the backend.
+class StoredNode(NetworkNode):
+    battery = store_field('battery')
+    p_sample = store_field('p_sample')
+    p_hat = store_field('p_hat')
+    lat = store_field('lat')
+
+    # Called for every packet handled, so it skips the property.
+    def is_alive(self):
+        return self.store.views.battery[self.id] > 0.0
+
+    def __reduce__(self):
+        state = self.__getstate__()
+        del state['store']
+        state.update((name, getattr(self, name)) for name in FIELDS)
+        return object.__new__, (NetworkNode,), state
+
+
+# Array backed store of the per node state used by NetworkNode.progress: battery, p_sample, p_hat and lat.
+# Arrays are indexed by node id and are the source of truth: the nodes read and write their fields from them.
+# maintain() performs the same work as the scalar loop in SimulationCore.maintain_nodes_and_links, but computes
+# (Eq. 1), (Eq. 2) and the (Eq. 3) values of every link exchange in batched array operations.
+# The scalar loop progresses nodes one at a time, so a neighbor that comes later in the loop still has its previous
+# battery and lat when a link is refreshed, and the node caps the entry with its new lat afterwards (Eq. 4). The
+# batched version reproduces this to give identical results.
+class NodeStore:
+    # Build store for nodes. Links are flattened into arrays of (node id, neighbor id) in loop order.
+    def __init__(self, nodes, cfg):
+        self.nodes = nodes
+        self.cfg = cfg
+        self.bind()
+
+        link_src, link_dst = [], []
+        for i, node in enumerate(self.nodes):
+            for neighbor_id in node.links:
+                link_src.append(i)
+                link_dst.append(neighbor_id)
+        self.link_src = np.array(link_src, dtype=np.int64)
+        self.link_dst = np.array(link_dst, dtype=np.int64)
+
+        # Neighbors that come before a node in the loop have already progressed when the link is refreshed.
+        self.link_dst_earlier = self.link_dst < self.link_src
+
+        # Every link refresh writes the entry of the node to the neighbor and of the neighbor to the node.
+        # Writes are ordered by (node, neighbor, loop position) so the last write to each entry ends a run.
+        n = len(self.nodes)
+        write_node = np.concatenate((self.link_src, self.link_dst))
+        write_neighbor = np.concatenate((self.link_dst, self.link_src))
+        write_pos = np.concatenate((2 * self.link_src, 2 * self.link_src + 1))
+        self.write_order = np.lexsort((write_pos, write_neighbor, write_node))
+        self.write_key = (write_node * n + write_neighbor)[self.write_order]
+
+    # Move FIELDS of the nodes into arrays and turn the nodes into StoredNodes reading them from here.
+    def bind(self):
+        for name in FIELDS:
+            setattr(self, name, np.array([getattr(node, name) for node in self.nodes], dtype=np.float64))
+        self.views = SimpleNamespace(**{name: memoryview(getattr(self, name)) for name in FIELDS})
+        for node in self.nodes:
+            for name in FIELDS:
+                vars(node).pop(name, None)
+            node.store = self
+            node.__class__ = StoredNode
+
+    # Progress all nodes and perform link maintenance if update_links is set.
+    def maintain(self, ts, update_links):
+        cfg = self.cfg
+        lat_old = self.lat.copy()
+        alive_old = self.battery > 0.0
+
+        # Progress nodes. See NetworkNode.progress.
+        drained = self.battery - (cfg.d_c + self.p_sample * cfg.d_p)
+        p_hat = cfg.alpha * self.p_hat + (1 - cfg.alpha) * self.p_sample
+        self.battery[:] = np.where(alive_old, drained, 0.0)
+        self.p_hat[:] = np.where(alive_old, p_hat, self.p_hat)
+        self.lat[:] = np.where(alive_old, ts + (drained / (cfg.d_c + p_hat * cfg.d_p)), lat_old)
+        self.p_sample[:] = np.where(alive_old, 0.0, self.p_sample)
+        alive = self.battery > 0.0
+
+        # Update rmt entries according to (Eq. 4). Entries written by the link refreshes below are capped where needed.
+        lat = self.lat.tolist()
+        for i in np.flatnonzero(alive_old).tolist():
+            self.nodes[i].rmt.cap(lat[i])
+
+        if not update_links or not len(self.link_src):
+            return
+
+        # Compute (Eq. 3) values for both directions of every link.
+        src, dst, earlier = self.link_src, self.link_dst, self.link_dst_earlier
+        lat_src = self.lat[src]
+        lat_dst = np.where(earlier, self.lat[dst], lat_old[dst])
+        link_valid = alive[src] & np.where(earlier, alive[dst], alive_old[dst])
+        lat_r_src = np.minimum(lat_src, ts + np.maximum(0, cfg.gamma * (lat_dst - ts)))
+        lat_r_dst = np.minimum(lat_dst, ts + np.maximum(0, cfg.gamma * (lat_src - ts)))
+        df_src = (lat_r_src != lat_src).astype(np.int64)
+        df_dst = (lat_r_dst != lat_dst).astype(np.int64)
+
+        # A neighbor later in the loop caps the entry it gets after the refresh.
+        capped = ~earlier & (self.lat[dst] < lat_r_dst)
+        lat_r_dst = np.where(capped, self.lat[dst], lat_r_dst)
+        df_dst = np.where(capped, 0, df_dst)
+
+        # Keep the last valid write to each entry.
+        valid = np.concatenate((link_valid, link_valid))[self.write_order]
+        order, key = self.write_order[valid], self.write_key[valid]
+        last = np.ones(len(key), dtype=bool)
+        last[:-1] = key[1:] != key[:-1]
+        order = order[last]
+        write_node = np.concatenate((src, dst))[order]
+        starts = np.flatnonzero(np.diff(write_node, prepend=-1)).tolist()
+        write_node = write_node.tolist()
+        write_neighbor = np.concatenate((dst, src))[order].tolist()
+        write_lat_r = np.concatenate((lat_r_src, lat_r_dst))[order].tolist()
+        write_df = np.concatenate((df_src, df_dst))[order].tolist()
+
+        # Apply the writes of each node in one go. Writes are grouped by node.
+        for start, end in zip(starts, starts[1:] + [len(order)]):
+            node = self.nodes[write_node[start]]
+            node.live_neighbors.update(write_neighbor[start:end])
+            node.rmt.set_link_entries(write_neighbor[start:end], write_lat_r[start:end], write_df[start:end])
+
+        # Remove routes through dead nodes. Comes after the refreshes, as in the scalar loop.
+        for i in np.flatnonzero(~alive).tolist():
+            for neighbor_id in self.nodes[i].links:
+                self.nodes[neighbor_id].cleanup_dead_neighbor(i)
@@ -1,26 +1,79 @@
 # Defines the various packet types. See the associated paper for packet structure and purposes.
+# All classes use __slots__ since many thousands of packets can be in flight at once.
+
+# Integer type tags of packets and their display names.
+TYPE_RD, TYPE_RR, TYPE_RP, TYPE_RU, TYPE_RE = range(5)
+TYPE_NAMES = ('RD', 'RR', 'RP', 'RU', 'RE')
+
+
+# Route recorded by RD, RR and RE messages. Stored as a linked list from the last node in the route back to the first.
+# Paths are never modified. Extending a path creates a new node that points to it, so RD messages forwarded along
+# the same route share their common prefix and RR messages walk back along the parent pointers.
+class RoutePath:
+	__slots__ = ('node', 'parent', 'length')
+
+	def __init__(self, node, parent=None):
+		self.node = node
+		self.parent = parent
+		self.length = 1 if parent is None else parent.length + 1
+
+	# Returns new path with node appended.
+	def extend(self, node):
+		return RoutePath(node, self)
+
+	# Check if node is anywhere in path.
+	def __contains__(self, node):
+		path = self
+		while path is not None:
+			if path.node == node:
+				return True
+			path = path.parent
+		return False
+
+	def __len__(self):
+		return self.length
+
+	# Iterate from first to last node in path.
+	def __iter__(self):
+		nodes = []
+		path = self
+		while path is not None:
+			nodes.append(path.node)
+			path = path.parent
+		return reversed(nodes)
 
 
 # Route Discovery.
+# Route is a RoutePath. It may be shared with other messages.
 class ERC_RD:
+	__slots__ = ('src', 'dst', 'rt')
+	TYPE = TYPE_RD
+
 	def __init__(self, src, dst_desired, route):
 		self.src = src
 		self.dst = dst_desired
-		self.rt = route.copy()
+		self.rt = route
 
 
 # Route Response.
+# Route is a RoutePath. It is popped by setting it to its parent as the response travels back.
 class ERC_RR:
+	__slots__ = ('src', 'dst', 'discount', 'lat', 'rt')
+	TYPE = TYPE_RR
+
 	def __init__(self, route_src, route_dst, discount_factor, lat_r, route):
 		self.src = route_src
 		self.dst = route_dst
 		self.discount = discount_factor
 		self.lat = lat_r
-		self.rt = route.copy()
+		self.rt = route
 
 
 # Route Packet.
 class ERC_RP:
+	__slots__ = ('src', 'dst', 'discount', 'lat', 'payload')
+	TYPE = TYPE_RP
+
 	def __init__(self, src, dst, expected_discount_factor, expected_lat_r, payload):
 		self.src = src
 		self.dst = dst
@@ -31,6 +84,9 @@ class ERC_RP:
 
 # Route Update.
 class ERC_RU:
+	__slots__ = ('src', 'src_route', 'dst_route', 'discount', 'lat')
+	TYPE = TYPE_RU
+
 	def __init__(self, update_src, route_src, route_dst, updated_discount_factor, updated_lat_r):
 		self.src = update_src
 		self.src_route = route_src
@@ -41,38 +97,68 @@ class ERC_RU:
 
 # Route Error.
 class ERC_RE:
+	__slots__ = ('src', 'dst', 'code', 'rt')
+	TYPE = TYPE_RE
+
 	def __init__(self, error_src, route_src, route_dst, error_code):
 		self.src = route_src
 		self.dst = route_dst
 		self.code = error_code
-		self.rt = [error_src]
+		self.rt = RoutePath(error_src)
 
 
 # Packet wrapper. Holds current node, next hop, message, and sent time.
+# The type tag is taken from the message class when the packet is created.
 class Packet:
+	__slots__ = ('current_node', 'next_hop', 'msg', 'sent_ts', 'type')
+
 	def __init__(self, current_node, next_hop, msg, sent_ts):
 		self.current_node = current_node
 		self.next_hop = next_hop
 		self.msg = msg
 		self.sent_ts = sent_ts
-
-		self.type = None
-		if isinstance(msg, ERC_RD):
-			self.type = 'RD'
-		elif isinstance(msg, ERC_RR):
-			self.type = 'RR'
-		elif isinstance(msg, ERC_RP):
-			self.type = 'RP'
-		elif isinstance(msg, ERC_RU):
-			self.type = 'RU'
-		elif isinstance(msg, ERC_RE):
-			self.type = 'RE'
-		assert self.type, "Msg type is wrong!"
+		self.type = msg.TYPE
 
 	# String representation
 	def __str__(self):
-		return '[{} Packet at {} with next hop {}]'.format(self.type, self.current_node, self.next_hop)
+		return '[{} Packet at {} with next hop {}]'.format(TYPE_NAMES[self.type], self.current_node, self.next_hop)
 
 	# String representation
 	def __repr__(self):
 		return str(self)
+
+
+# Pool of Packet objects that have been handled and can be reused for new packets.
+# Packets must not be used after they are released.
+class PacketPool:
+	def __init__(self, max_size=1 << 16):
+		self.max_size = max_size
+		self.free = []
+
+	# Get packet from pool, or create new packet if pool is empty.
+	def acquire(self, current_node, next_hop, msg, sent_ts):
+		if not self.free:
+			return Packet(current_node, next_hop, msg, sent_ts)
+		pkt = self.free.pop()
+		pkt.current_node = current_node
+		pkt.next_hop = next_hop
+		pkt.msg = msg
+		pkt.sent_ts = sent_ts
+		pkt.type = msg.TYPE
+		return pkt
+
+	# Return handled packets to pool. Drops references to their messages.
+	def release(self, pkts):
+		n = min(len(pkts), self.max_size - len(self.free))
+		for pkt in pkts[:n]:
+			pkt.msg = None
+		self.free.extend(pkts[:n])
+
+
+# Default pool used by network nodes.
+pool = PacketPool()
+
+
+# Create new packet using the default pool.
+def new_packet(current_node, next_hop, msg, sent_ts):
+	return pool.acquire(current_node, next_hop, msg, sent_ts)
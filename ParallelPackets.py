@@ -0,0 +1,148 @@
+import gc
+import os
+import pickle
+from collections import defaultdict
+
+import NetworkLogger as NL
+import PacketTypes as PT
+
+
+# Stand-in for the NetworkLogger while handling packets in a worker. Records write calls so they can be replayed on
+# the real logger in the order of the sequential simulation. levels are the channel levels of the real logger. Calls it
+# would not write anywhere are dropped, apart from errors which it always counts.
+class RecordingLogger:
+    def __init__(self, levels=None):
+        self.level_full, self.level_packets, self.level_errors, self.level_performance, self.level_energy = NL.channel_levels(levels)
+        self.records = []
+
+    def write(self, log_str, *args, is_full=True, is_packet=False, is_error=False, is_performance=False, is_energy=False, level=NL.LEVEL_INFO):
+        if is_error or (is_full and level <= self.level_full) or (is_packet and level <= self.level_packets) or (is_performance and level <= self.level_performance) or (is_energy and level <= self.level_energy):
+            self.records.append(((log_str,) + args, {'is_full': is_full, 'is_packet': is_packet, 'is_error': is_error, 'is_performance': is_performance, 'is_energy': is_energy, 'level': level}))
+
+    # Returns records since the last call.
+    def take(self):
+        records = self.records
+        self.records = []
+        return records
+
+
+# Handle inboxes of nodes. inboxes is a list of (node id, packets in order). Returns results of all packets in the
+# same order as (new packets, had error, log records).
+def handle_inboxes(nodes, inboxes, ts, log_levels):
+    log = RecordingLogger(log_levels)
+    results = []
+    for node_id, pkts in inboxes:
+        node = nodes[node_id]
+        for pkt in pkts:
+            new_pkts, had_err = node.handle_packet(pkt, ts, log)
+            results.append((new_pkts, had_err, log.take()))
+    return results
+
+
+# Handles the in-flight packets of a time step in parallel.
+# All packets handled in a step were sent in the previous step and handling a packet only changes the state of the
+# receiving node, so the inboxes of different nodes are independent. Inboxes are split into partitions balanced by
+# number of packets. Each partition but the first is handled in a forked child process, which sends back its results
+# and the changed state of its nodes (see NetworkNode.PACKET_STATE). The first partition is handled in this process
+# meanwhile. Results are then put back into the order of the packets, so the simulation (including the logs) matches
+# the sequential simulation exactly. Requires os.fork.
+class ParallelPacketHandler:
+    # log_levels are the channel levels of the logger the records are replayed on.
+    def __init__(self, workers, log_levels=None):
+        assert hasattr(os, 'fork'), 'Parallel packet handling requires os.fork!'
+        assert workers >= 2, 'Parallel packet handling needs at least two workers!'
+        self.workers = workers
+        self.log_levels = log_levels
+
+    # Split inboxes into partitions with about the same number of packets. Largest inboxes are placed first.
+    def partition(self, inboxes):
+        parts = [[] for _ in range(self.workers)]
+        loads = [0] * self.workers
+        for node_id in sorted(inboxes, key=lambda n: (-len(inboxes[n]), n)):
+            k = loads.index(min(loads))
+            parts[k].append((node_id, [pkt for _, pkt in inboxes[node_id]]))
+            loads[k] += len(inboxes[node_id])
+        return [part for part in parts if part]
+
+    # Handle packets at nodes. Returns (new packets, had error, log records) for every packet in order.
+    def handle(self, nodes, pkts, ts):
+        inboxes = defaultdict(list)
+        for i, pkt in enumerate(pkts):
+            inboxes[pkt.next_hop].append((i, pkt))
+        parts = self.partition(inboxes)
+
+        # Fork children for all partitions but the first. Objects that exist now are moved out of the reach of the garbage
+        # collector, so collections do not touch (and copy) the memory pages shared with the children. Collection is
+        # paused until the results are merged, as loading them creates many objects at once.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        gc.freeze()
+        children = []
+        error = None
+        try:
+            for part in parts[1:]:
+                r, w = os.pipe()
+                try:
+                    pid = os.fork()
+                except BaseException:
+                    os.close(r)
+                    os.close(w)
+                    raise
+                if pid == 0:
+                    # Child process. Never returns.
+                    os.close(r)
+                    status = 0
+                    try:
+                        free = len(PT.pool.free)
+                        results = handle_inboxes(nodes, part, ts, self.log_levels)
+                        out = (results, [nodes[node_id].get_packet_state(ts) for node_id, _ in part], free - len(PT.pool.free))
+                    except BaseException as e:
+                        out, status = e, 1
+                    try:
+                        with os.fdopen(w, 'wb') as f:
+                            pickle.dump(out, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    finally:
+                        os._exit(status)
+                os.close(w)
+                children.append((pid, r, part))
+
+            part_results = [handle_inboxes(nodes, parts[0], ts, self.log_levels)]
+
+            # Collect results of children and copy back the state of their nodes.
+            # Packets a child took from its copy of the pool are replaced by the loaded ones, so drop as many from the pool.
+            while children:
+                pid, r, part = children.pop(0)
+                try:
+                    with os.fdopen(r, 'rb') as f:
+                        out = pickle.load(f)
+                finally:
+                    os.waitpid(pid, 0)
+                if isinstance(out, BaseException):
+                    error = error or out
+                    continue
+                results, states, taken = out
+                part_results.append(results)
+                for (node_id, _), state in zip(part, states):
+                    nodes[node_id].set_packet_state(state)
+                del PT.pool.free[max(len(PT.pool.free) - taken, 0):]
+        finally:
+            # Reap children whose results were not collected because of an error. Closing their end of the pipe first
+            # ends a child that is still writing.
+            for pid, r, _ in children:
+                os.close(r)
+                os.waitpid(pid, 0)
+            gc.unfreeze()
+            if gc_enabled:
+                gc.enable()
+        if error is not None:
+            raise error
+
+        # Put results back into the order of the packets.
+        ordered = [None] * len(pkts)
+        for part, results in zip(parts, part_results):
+            i = 0
+            for node_id, _ in part:
+                for pkt_i, _ in inboxes[node_id]:
+                    ordered[pkt_i] = results[i]
+                    i += 1
+        return ordered
@@ -0,0 +1,188 @@
+import json
+import time
+
+import PacketTypes as PT
+
+# Phases of the simulation that are timed. step_once includes the three phases after it and the observers (such as
+# the view). fast_forward may include steps as well.
+PHASES = ('step_once', 'maintain_nodes_and_links', 'update_packets', 'attempt_scheduled_send', 'fast_forward', 'finish')
+
+
+# Optional instrumentation of a simulation. Records wall time per phase, time spent handling each packet type,
+# time spent logging and sorting rmts, and counts generated packets (by type), Packet allocations and pool reuses.
+# Methods are wrapped on the instances of the simulation, its logger, nodes and rmts and the packet pool only while
+# the profiler is installed, so nothing is added to any code path when profiling is off.
+# If interval is set, a snapshot is taken every interval time steps. Snapshots are appended as JSON lines to
+# snapshot_file (flushed right away so the file can be watched live) and printed to the terminal if echo is set.
+class Profiler:
+    def __init__(self, sim, interval=0, snapshot_file=None, echo=False):
+        self.sim = sim
+        self.interval = interval
+        self.echo = echo
+        self.snapshot_f = open(snapshot_file, 'w') if snapshot_file else None
+
+        self.phase_time = dict.fromkeys(PHASES, 0.0)
+        self.phase_calls = dict.fromkeys(PHASES, 0)
+        self.handle_time = [0.0] * len(PT.TYPE_NAMES)
+        self.handle_count = [0] * len(PT.TYPE_NAMES)
+        self.generated = [0] * len(PT.TYPE_NAMES)
+        self.allocated = self.reused = 0
+        self.rmt_sorts = self.rmt_sorted_dsts = 0
+        self.rmt_sort_time = 0.0
+        self.log_calls = 0
+        self.log_time = 0.0
+
+        self.wall_start = self.last_wall = time.perf_counter()
+        self.last_ts = self.sim.ts
+        self.wrapped = []
+
+    # Replace method name of obj with wrapper(f) where f is the original method. Undone by uninstall.
+    def wrap(self, obj, name, wrapper):
+        setattr(obj, name, wrapper(getattr(obj, name)))
+        self.wrapped.append((obj, name))
+
+    # Wrap phase of the simulation to record its wall time.
+    def wrap_phase(self, name):
+        def wrapper(f):
+            def timed(*args, **kwargs):
+                t = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.phase_time[name] += time.perf_counter() - t
+                    self.phase_calls[name] += 1
+            return timed
+        self.wrap(self.sim, name, wrapper)
+
+    # Install instrumentation. Must be called after the simulation has been set up.
+    # Packets handled in forked processes would not be counted, so simulations with parallel handling are rejected.
+    def install(self):
+        assert self.sim.parallel_handler is None, 'Profiling does not support parallel packet handling!'
+        for name in PHASES:
+            self.wrap_phase(name)
+
+        def wrap_handle(f):
+            def handle_packet(packet, ts, log):
+                pkt_type = packet.type
+                t = time.perf_counter()
+                result = f(packet, ts, log)
+                self.handle_time[pkt_type] += time.perf_counter() - t
+                self.handle_count[pkt_type] += 1
+                return result
+            return handle_packet
+
+        def wrap_sort(rmt):
+            def wrapper(f):
+                def sort_dirty():
+                    if not rmt.dirty:
+                        return f()
+                    self.rmt_sorts += 1
+                    self.rmt_sorted_dsts += len(rmt.dirty)
+                    t = time.perf_counter()
+                    f()
+                    self.rmt_sort_time += time.perf_counter() - t
+                return sort_dirty
+            return wrapper
+
+        for node in self.sim.nodes:
+            self.wrap(node, 'handle_packet', wrap_handle)
+            self.wrap(node.rmt, 'sort_dirty', wrap_sort(node.rmt))
+
+        def wrap_acquire(f):
+            pool = PT.pool
+
+            def acquire(current_node, next_hop, msg, sent_ts):
+                if pool.free:
+                    self.reused += 1
+                else:
+                    self.allocated += 1
+                self.generated[msg.TYPE] += 1
+                return f(current_node, next_hop, msg, sent_ts)
+            return acquire
+        self.wrap(PT.pool, 'acquire', wrap_acquire)
+
+        def wrap_log(f):
+            def write(*args, **kwargs):
+                t = time.perf_counter()
+                f(*args, **kwargs)
+                self.log_time += time.perf_counter() - t
+                self.log_calls += 1
+            return write
+        self.wrap(self.sim.log, 'write', wrap_log)
+
+        if self.interval:
+            self.sim.add_observer(self.on_sim_step)
+
+    # Remove instrumentation.
+    def uninstall(self):
+        for obj, name in reversed(self.wrapped):
+            delattr(obj, name)
+        self.wrapped.clear()
+        if self.on_sim_step in self.sim.observers:
+            self.sim.observers.remove(self.on_sim_step)
+        if self.snapshot_f is not None:
+            self.snapshot_f.close()
+            self.snapshot_f = None
+
+    # Observer called after each simulation step. Takes snapshot every interval time steps.
+    def on_sim_step(self, sim):
+        if sim.ts - self.last_ts >= self.interval or sim.done:
+            self.take_snapshot()
+
+    # Returns total and largest number of rmt entries of a node.
+    def rmt_sizes(self):
+        sizes = [sum(len(entries) for entries in n.rmt.values()) for n in self.sim.nodes]
+        return sum(sizes), max(sizes, default=0)
+
+    # Returns dictionary of all measurements so far.
+    def summary(self):
+        wall = time.perf_counter() - self.wall_start
+        rmt_total, rmt_max = self.rmt_sizes()
+        return {
+            'ts': self.sim.ts,
+            'wall_sec': wall,
+            'in_flight': len(self.sim.pkts_inflight),
+            'phase_sec': dict(self.phase_time),
+            'phase_calls': dict(self.phase_calls),
+            'handle_sec': dict(zip(PT.TYPE_NAMES, self.handle_time)),
+            'handled': dict(zip(PT.TYPE_NAMES, self.handle_count)),
+            'generated': dict(zip(PT.TYPE_NAMES, self.generated)),
+            'packets_allocated': self.allocated,
+            'packets_reused': self.reused,
+            'rmt_sorts': self.rmt_sorts,
+            'rmt_sorted_dsts': self.rmt_sorted_dsts,
+            'rmt_sort_sec': self.rmt_sort_time,
+            'rmt_entries': rmt_total,
+            'rmt_entries_max': rmt_max,
+            'log_calls': self.log_calls,
+            'log_sec': self.log_time,
+        }
+
+    # Take snapshot of the measurements. Also records the simulation speed since the last snapshot.
+    def take_snapshot(self):
+        now = time.perf_counter()
+        snapshot = self.summary()
+        snapshot['steps_per_sec'] = (self.sim.ts - self.last_ts) / (now - self.last_wall) if now > self.last_wall else None
+        self.last_ts, self.last_wall = self.sim.ts, now
+
+        if self.snapshot_f is not None:
+            self.snapshot_f.write(json.dumps(snapshot) + '\n')
+            self.snapshot_f.flush()
+        if self.echo:
+            print('PROFILE ts: [{:05d}] [{:.1f}] steps/sec in-flight [{}] rmt entries [{}] generated [{}]'.format(
+                snapshot['ts'], snapshot['steps_per_sec'] or 0, snapshot['in_flight'], snapshot['rmt_entries'], sum(self.generated)))
+        return snapshot
+
+    # Returns summary as text.
+    def format_summary(self):
+        s = self.summary()
+        lines = ['Profile after [{}] time steps and [{:.2f}] secs:'.format(s['ts'] + 1, s['wall_sec'])]
+        lines.append('  Phases:')
+        lines.extend('    {:<26} [{:9.3f}] secs over [{}] calls'.format(p, s['phase_sec'][p], s['phase_calls'][p]) for p in PHASES if s['phase_calls'][p])
+        lines.append('  Packet handling by type:')
+        lines.extend('    {} handled [{}] in [{:.3f}] secs, generated [{}]'.format(t, s['handled'][t], s['handle_sec'][t], s['generated'][t]) for t in PT.TYPE_NAMES)
+        lines.append('  Packets allocated [{}] reused from pool [{}]'.format(s['packets_allocated'], s['packets_reused']))
+        lines.append('  Rmt sorts [{}] ([{}] destinations) in [{:.3f}] secs. Rmt entries [{}] (max [{}] at a node)'.format(
+            s['rmt_sorts'], s['rmt_sorted_dsts'], s['rmt_sort_sec'], s['rmt_entries'], s['rmt_entries_max']))
+        lines.append('  Logging [{}] calls in [{:.3f}] secs'.format(s['log_calls'], s['log_sec']))
+        return '\n'.join(lines)
@@ -0,0 +1,386 @@
+import itertools
+import multiprocessing
+from collections import defaultdict
+from operator import itemgetter
+
+from EnergyStats import EnergyStats
+import NetworkLogger as NL
+from ParallelPackets import RecordingLogger
+import PacketTypes as PT
+from SimulationCore import SimulationCore
+
+
+# Split nodes into regions by recursive coordinate bisection. Each set of nodes is split along the longer side of its
+# bounding box so that the two halves hold nodes in proportion to the number of regions they are split into further.
+# xs and ys are the node coordinates indexed by id. Returns the region of every node.
+def partition_regions(xs, ys, regions):
+    assert 1 <= regions <= len(xs), 'Need between one region and one region per node!'
+    region_of = [0] * len(xs)
+
+    def split(ids, first, count):
+        if count == 1:
+            for i in ids:
+                region_of[i] = first
+            return
+        span_x = max(xs[i] for i in ids) - min(xs[i] for i in ids)
+        span_y = max(ys[i] for i in ids) - min(ys[i] for i in ids)
+        coord = xs if span_x >= span_y else ys
+        ids = sorted(ids, key=lambda i: (coord[i], i))
+        left = count // 2
+        k = len(ids) * left // count
+        split(ids[:k], first, left)
+        split(ids[k:], first + left, count - left)
+
+    split(list(range(len(xs))), 0, regions)
+    return region_of
+
+
+# Stand-in for a NetworkNode that lives in a worker process. Holds what the summary and end-of-run report need.
+# The packet counters are only filled in for the sources and destinations of the packets file.
+class NodeReport:
+    __slots__ = ('id', 'name', 'battery', 'num_rp_sent', 'rp_sent', 'num_rp_received', 'rp_received')
+
+    def __init__(self, node_id, name, battery):
+        self.id = node_id
+        self.name = name
+        self.battery = battery
+        self.num_rp_sent = self.rp_sent = self.num_rp_received = self.rp_received = None
+
+    def is_alive(self):
+        return self.battery > 0.0
+
+
+# Simulates the nodes of one region in a worker process.
+# Besides its own nodes, a worker holds ghost copies of the nodes of other regions that are linked to them. A node's
+# progress only depends on the number of packets it sent in the last step (p_sample), so ghosts replay the progress of
+# their owners exactly from that number alone. Link maintenance then visits own and ghost nodes in id order like the
+# single process simulation, but only updates own nodes.
+# Every packet has a rank: its position in the in-flight list of the single process simulation. Packets are handled in
+# rank order, so nodes see their packets in the same order. New packets are numbered by their parent (the handled
+# packet or scheduled send that created them) and their position among its packets. The coordinator turns these
+# numbers into ranks once it knows how many packets every parent created.
+class RegionWorker:
+    # imports maps each other region to the ids of its nodes that are ghosts here. exports maps each other region to
+    # the ids of own nodes that are ghosts there. batteries is the shared array of the battery levels of all nodes.
+    def __init__(self, topo, own_ids, imports, exports, cfg, log_levels, batteries):
+        self.own = set(own_ids)
+        self.own_ids = sorted(own_ids)
+        self.imports = imports
+        self.exports = exports
+        self.owner = {node_id: region for region, ids in imports.items() for node_id in ids}
+        self.nodes = topo.build_node_subset(self.own_ids + sorted(self.owner))
+        for n in self.nodes.values():
+            n.cfg = cfg
+        self.order = [(self.nodes[i], i in self.own) for i in sorted(self.nodes)]
+        self.log = RecordingLogger(log_levels)
+        self.batteries = batteries
+
+        # New packets to own nodes as (parent slot, position, packet) until their ranks are known. Packets sent to
+        # other regions (released once they have been sent).
+        self.kept = []
+        self.sent = []
+
+        # Parents of the new packets of the current step (global parent numbers), number of packets each one created,
+        # log records by parent and new packets to other regions.
+        self.parents, self.counts, self.records, self.outbound = [], [], [], defaultdict(list)
+
+    # Maintains own nodes and their links. See SimulationCore.maintain_nodes_and_links.
+    def maintain_nodes_and_links(self, ts):
+        update_links = (ts % 2 == 0)
+        nodes = self.nodes
+        for n, own in self.order:
+            n.progress(ts, True)
+            if not update_links:
+                continue
+
+            if not n.is_alive():
+                for neighbor_id in n.links:
+                    if neighbor_id in self.own:
+                        nodes[neighbor_id].cleanup_dead_neighbor(n.id)
+            else:
+                for neighbor_id in n.links:
+                    neighbor_own = neighbor_id in self.own
+                    if not (own or neighbor_own):
+                        continue
+                    neighbor = nodes[neighbor_id]
+                    if neighbor.is_alive():
+                        if own:
+                            n.live_neighbors.add(neighbor_id)
+                            n.update_or_create_rmt_entry(dst=neighbor_id, next_hop=neighbor_id, lat_r=neighbor.lat, df=0, ts=ts)
+                        if neighbor_own:
+                            neighbor.live_neighbors.add(n.id)
+                            neighbor.update_or_create_rmt_entry(dst=n.id, next_hop=n.id, lat_r=n.lat, df=0, ts=ts)
+
+    # Record new packets of parent (a global parent number). Packets to own nodes are kept, others are collected by
+    # the region of their next hop.
+    def add_parent(self, parent, pkts):
+        slot = len(self.parents)
+        self.parents.append(parent)
+        self.counts.append(len(pkts))
+        if self.log.records:
+            self.records.append((parent, self.log.take()))
+        for i, pkt in enumerate(pkts):
+            if pkt.next_hop in self.own:
+                self.kept.append((slot, i, pkt))
+            else:
+                self.outbound[self.owner[pkt.next_hop]].append((parent, i, pkt))
+
+    # Simulate time step ts.
+    #   - starts: rank of the first packet of each parent of the previous step, in the order the parents were reported.
+    #   - inbound: (rank, packet) for packets from other regions.
+    #   - p_samples: maps other regions to the p_sample of the nodes they export here.
+    #   - schedule: (parent, src, dst, number left) of own scheduled sends in the order they are sent.
+    # Returns (parents, packets created per parent, number left per scheduled send, log records by parent, packets to
+    # other regions, p_sample of exported nodes).
+    def step(self, ts, starts, inbound, p_samples, schedule):
+        inflight = [(starts[slot] + i, pkt) for slot, i, pkt in self.kept]
+        inflight.extend(inbound)
+        inflight.sort(key=itemgetter(0))
+
+        for region, values in p_samples.items():
+            for node_id, p_sample in zip(self.imports[region], values):
+                self.nodes[node_id].p_sample = p_sample
+        self.maintain_nodes_and_links(ts)
+        for node_id in self.own_ids:
+            self.batteries[node_id] = self.nodes[node_id].battery
+
+        self.kept, self.parents, self.counts, self.records, self.outbound = [], [], [], [], defaultdict(list)
+        for rank, pkt in inflight:
+            node = self.nodes[pkt.next_hop]
+            new_pkts, had_err = node.handle_packet(pkt, ts, self.log)
+            if had_err:
+                self.log.write("   ERROR: Could not handle in-flight [{}] message at node [{}]!", PT.TYPE_NAMES[pkt.type], node.name, is_error=True)
+            self.add_parent(rank, new_pkts)
+        PT.pool.release([pkt for _, pkt in inflight])
+
+        left = []
+        for parent, src, dst, num in schedule:
+            node = self.nodes[src]
+            new_pkts, packet_sent, error = node.attempt_to_send_packet(dst, ts, self.log)
+            if error:
+                self.log.write("  ERROR: Node [{}] cannot route packets to [{}]! The node may be offline or unreachable! Any future packets to this destination will not be sent!", node.name, node.names[dst], is_error=True)
+                new_pkts, num = [], 0
+            elif packet_sent:
+                num -= 1
+            self.add_parent(parent, new_pkts)
+            left.append(num)
+
+        self.sent = [pkt for pkts in self.outbound.values() for _, _, pkt in pkts]
+        exports = {region: [self.nodes[i].p_sample for i in ids] for region, ids in self.exports.items()}
+        return self.parents, self.counts, left, self.records, dict(self.outbound), exports
+
+    # Returns packet counters of the own nodes among ids.
+    def report(self, ids):
+        return {i: (n.num_rp_sent, n.rp_sent, n.num_rp_received, n.rp_received) for i, n in ((i, self.nodes[i]) for i in ids if i in self.own)}
+
+    # Serve requests of the coordinator until told to stop. Exceptions are sent back instead of a result.
+    def serve(self, conn):
+        while True:
+            cmd, args = conn.recv()
+            if cmd == 'stop':
+                break
+            try:
+                result = self.step(*args) if cmd == 'step' else self.report(*args)
+            except BaseException as e:
+                result = e
+            conn.send(result)
+            if cmd == 'step':
+                PT.pool.release(self.sent)
+                self.sent = []
+        conn.close()
+
+
+# Entry point of worker processes.
+def run_worker(conn, *args):
+    RegionWorker(*args).serve(conn)
+
+
+# Simulation split into regions by node coordinates, each simulated by a RegionWorker in its own process.
+# This process only keeps the packet schedule, the battery levels of all nodes (in memory shared with the workers) and
+# the logs. Between steps, workers exchange the packets that cross into another region and the p_sample of nodes on
+# region boundaries, passed on by this process. Log records are sent here with the packets they belong to and written
+# in order. Results and logs match the single process simulation exactly.
+# Headless only: the view, skip_idle, vectorized, parallel and trace_file are not supported. Neither are checkpoints, as
+# the state of the nodes lives in the workers.
+class RegionSimulation(SimulationCore):
+    def __init__(self, world_size, log_files, regions, cfg=None, log_levels=None, log_background=False, energy_history=None):
+        assert regions >= 2, 'Need at least two regions!'
+        super().__init__(world_size, log_files, cfg=cfg, log_levels=log_levels, log_background=log_background, energy_history=energy_history)
+        self.regions = regions
+        self.log_levels = log_levels
+        self.region_of = []
+        self.workers = []
+        self.conns = []
+        self.batteries = None
+        self.num_inflight = 0
+
+        # Per region: ranks of the first packets of its parents of the last step, packets from other regions and
+        # p_sample of its ghosts by region.
+        self.starts, self.inbound, self.p_samples = [], [], []
+
+    # Sets up simulation network from a Helper.Topology and starts the workers. Only the workers build nodes.
+    # sim_packets is a list of (ts, src name, dst name, limit).
+    def setup(self, topo, sim_packets):
+        for x, y in zip(topo.x, topo.y):
+            assert 0 < x < self.world_width and 0 < y < self.world_height
+        self.nodes = [NodeReport(i, name, battery) for i, (name, battery) in enumerate(zip(topo.names, topo.battery))]
+        self.energy = EnergyStats(len(self.nodes), self.log, history=self.energy_history)
+        self.setup_schedule(sim_packets)
+        self.pkts_inflight = []
+
+        # Nodes of each region that are linked to another region.
+        self.region_of = partition_regions(topo.x, topo.y, self.regions)
+        boundary = defaultdict(set)
+        for a, b in zip(topo.link_a, topo.link_b):
+            region_a, region_b = self.region_of[a], self.region_of[b]
+            if region_a != region_b:
+                boundary[region_a, region_b].add(a)
+                boundary[region_b, region_a].add(b)
+        own_ids = [[] for _ in range(self.regions)]
+        for node_id, region in enumerate(self.region_of):
+            own_ids[region].append(node_id)
+
+        # Fork where possible so the topology does not need to be copied to the workers.
+        ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        self.batteries = ctx.RawArray('d', topo.battery)
+        for region in range(self.regions):
+            imports = {s: sorted(ids) for (s, r), ids in boundary.items() if r == region}
+            exports = {r: sorted(ids) for (s, r), ids in boundary.items() if s == region}
+            conn, worker_conn = ctx.Pipe()
+            worker = ctx.Process(target=run_worker, args=(worker_conn, topo, own_ids[region], imports, exports, self.cfg, self.log_levels, self.batteries), daemon=True)
+            worker.start()
+            worker_conn.close()
+            self.workers.append(worker)
+            self.conns.append(conn)
+
+        self.starts = [[] for _ in range(self.regions)]
+        self.inbound = [[] for _ in range(self.regions)]
+        self.p_samples = [{} for _ in range(self.regions)]
+
+    # Returns result of the last request to a worker. Raises exceptions of the worker.
+    @staticmethod
+    def receive(conn):
+        result = conn.recv()
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    # Returns true if no packets are left to send or in flight.
+    def all_packets_done(self):
+        return not(self.pkts_schedule or self.num_inflight)
+
+    # Returns true if all simulated packets have been delivered or all nodes are dead.
+    def is_finished(self):
+        return self.all_packets_done() or all(not b > 0.0 for b in self.batteries)
+
+    # Advance the simulation by a single time step. See SimulationCore.step_once.
+    def step_once(self):
+        assert not self.done, "Simulation has already finished!"
+        self.ts += 1
+        num_inflight = self.num_inflight
+        self.log.write("ts: [{:05d}]  In-Flight at start [{}]", self.ts, num_inflight, is_full=True, is_packet=True, is_error=True)
+
+        # Scheduled sends of this step in the order of SimulationCore.attempt_scheduled_send. Parents are numbered after
+        # the in-flight packets.
+        schedule_empty = not self.pkts_schedule
+        sends = []
+        while self.pkts_schedule and self.pkts_schedule[-1][0] == self.ts:
+            sends.append(self.pkts_schedule.pop())
+        region_sends = [[] for _ in range(self.regions)]
+        for pos, (_, src, dst, num) in enumerate(sends):
+            region_sends[self.region_of[src]].append((num_inflight + pos, src, dst, num))
+
+        for region, conn in enumerate(self.conns):
+            conn.send(('step', (self.ts, self.starts[region], self.inbound[region], self.p_samples[region], region_sends[region])))
+        results = [self.receive(conn) for conn in self.conns]
+
+        # Rank of the first packet created by every parent.
+        counts = [0] * (num_inflight + len(sends))
+        for parents, parent_counts, _, _, _, _ in results:
+            for parent, count in zip(parents, parent_counts):
+                counts[parent] = count
+        starts = list(itertools.accumulate(counts, initial=0))
+        self.num_inflight = starts[-1]
+
+        # Rank new packets and pass on packets and p_sample values between regions.
+        self.inbound = [[] for _ in range(self.regions)]
+        self.p_samples = [{} for _ in range(self.regions)]
+        for region, (parents, _, _, _, outbound, exports) in enumerate(results):
+            self.starts[region] = [starts[parent] for parent in parents]
+            for other, pkts in outbound.items():
+                self.inbound[other].extend((starts[parent] + i, pkt) for parent, i, pkt in pkts)
+            for other, values in exports.items():
+                self.p_samples[other][region] = values
+
+        # Write log records in the order of the parents.
+        self.log.write("\nUpdating nodes and maintaining links if needed", level=NL.LEVEL_DEBUG)
+        self.log.write("\nUpdating the [{}] in-flight packets", num_inflight, level=NL.LEVEL_DEBUG)
+        records = sorted((r for result in results for r in result[3]), key=itemgetter(0))
+        i = 0
+        while i < len(records) and records[i][0] < num_inflight:
+            self.replay(records[i][1])
+            i += 1
+        self.log.write("\nAttempting to send the required simulation packets", level=NL.LEVEL_DEBUG)
+        if schedule_empty:
+            self.log.write("  No packets left to send! All required packets are in in-flight.")
+        for _, parent_records in records[i:]:
+            self.replay(parent_records)
+
+        # Scheduled sends that are left continue in the next step.
+        left = {}
+        for region, result in enumerate(results):
+            for (parent, _, _, _), num in zip(region_sends[region], result[2]):
+                left[parent - num_inflight] = num
+        self.pkts_schedule.extend((self.ts + 1, src, dst, left[pos]) for pos, (_, src, dst, _) in enumerate(sends) if left[pos] != 0)
+
+        # Update energy statistics.
+        self.energy.add(self.ts, self.batteries[:])
+
+        self.log.write("\nDone updating: there are now [{}] in-flight packets.", self.num_inflight, level=NL.LEVEL_DEBUG)
+        self.log.write("||||||||||||||||||||||||||||||||||", level=NL.LEVEL_DEBUG)
+
+        if self.is_finished():
+            self.finish()
+
+        for callback in self.observers:
+            callback(self)
+
+    # Write log records of a worker.
+    def replay(self, records):
+        for args, kwargs in records:
+            self.log.write(*args, **kwargs)
+
+    # Fetch packet counters of the sources and destinations of the packets file and battery levels of all nodes.
+    def collect_reports(self):
+        ids = sorted({node_id for _, src, dst, _ in self.pkts_schedule_original_copy for node_id in (src, dst)})
+        for conn in self.conns:
+            conn.send(('report', (ids,)))
+        for conn in self.conns:
+            for node_id, (num_rp_sent, rp_sent, num_rp_received, rp_received) in self.receive(conn).items():
+                n = self.nodes[node_id]
+                n.num_rp_sent, n.rp_sent, n.num_rp_received, n.rp_received = num_rp_sent, rp_sent, num_rp_received, rp_received
+        for n, battery in zip(self.nodes, self.batteries):
+            n.battery = battery
+
+    # Stop worker processes.
+    def stop_workers(self):
+        for conn in self.conns:
+            conn.send(('stop', None))
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.conns, self.workers = [], []
+
+    # Returns dictionary of metrics summarizing the run so far. See SimulationCore.summary.
+    def summary(self):
+        if self.workers:
+            self.collect_reports()
+        return super().summary()
+
+    # Finish simulation. Collects the final state of the nodes and stops the workers before writing the report.
+    def finish(self, is_forced=False):
+        if self.done:
+            return
+        self.collect_reports()
+        self.stop_workers()
+        super().finish(is_forced)
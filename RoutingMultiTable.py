@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+
+# Routing multi-table (rmt) of a node. Maps each destination node to a list of entries (next_hop, lat_r, d_f).
+# Reading works like a defaultdict(list). All changes to entries must go through the methods below so the table
+# can track which destinations need re-sorting. Entries for a destination are ordered by the ECR criteria:
+# (lat_r of entry, best lat_r known through the next hop), largest first.
+class RoutingMultiTable(dict):
+	def __init__(self):
+		super().__init__()
+
+		# Destinations whose entry order may be stale.
+		self.dirty = set()
+
+		# Maps next hop to the set of destinations that have an entry through it.
+		# The sort key of an entry depends on the entries of its next hop, so a change to the entries of a
+		# destination invalidates every destination routed through it.
+		self.via = defaultdict(set)
+
+	# Missing destinations get an empty entry list (same behaviour as a defaultdict).
+	def __missing__(self, dst):
+		entries = []
+		super().__setitem__(dst, entries)
+		return entries
+
+	# Replace all entries of destination.
+	def __setitem__(self, dst, entries):
+		for next_hop, _, _ in self.get(dst, ()):
+			self.via[next_hop].discard(dst)
+		for next_hop, _, _ in entries:
+			self.via[next_hop].add(dst)
+		super().__setitem__(dst, entries)
+		self.touch(dst)
+
+	# Needed so extra state is restored after the entries when pickling.
+	# Instance attributes that shadow methods (such as the wrappers installed by the Profiler) are left out.
+	def __reduce__(self):
+		state = {k: v for k, v in self.__dict__.items() if not hasattr(RoutingMultiTable, k)}
+		return self.__class__, (), state, None, iter(self.items())
+
+	# Mark destination and every destination routed through it as needing a re-sort.
+	def touch(self, dst):
+		self.dirty.add(dst)
+		via_dst = self.via.get(dst)
+		if via_dst:
+			self.dirty.update(via_dst)
+
+	# Set entry i of destination. Appends entry if i is None.
+	def set_entry(self, dst, i, entry):
+		entries = self[dst]
+		if i is None:
+			entries.append(entry)
+			self.via[entry[0]].add(dst)
+		else:
+			entries[i] = entry
+		self.touch(dst)
+
+	# Set the entries of direct links: for every neighbor in next_hops the entry to the neighbor through itself.
+	# Same as a set_entry for each neighbor, without the per entry calls.
+	def set_link_entries(self, next_hops, lat_rs, dfs):
+		via = self.via
+		for next_hop, lat_r, df in zip(next_hops, lat_rs, dfs):
+			entries = self[next_hop]
+			for i, (entry_next_hop, _, _) in enumerate(entries):
+				if entry_next_hop == next_hop:
+					entries[i] = (next_hop, lat_r, df)
+					break
+			else:
+				entries.append((next_hop, lat_r, df))
+				via[next_hop].add(next_hop)
+		self.dirty.update(next_hops)
+		self.dirty.update(*[via[next_hop] for next_hop in next_hops if next_hop in via])
+
+	# Remove entries through next hop. Only looks at destination dst if given, otherwise at all destinations.
+	def remove_next_hop(self, next_hop, dst=None):
+		dsts = [dst] if dst is not None else list(self.via.get(next_hop, ()))
+		for d in dsts:
+			self[d] = [e for e in self[d] if e[0] != next_hop]
+
+	# Cap lat_r of all entries to lat according to (Eq. 4).
+	def cap(self, lat):
+		for dst, entries in self.items():
+			capped = False
+			for i, (next_hop, lat_r, _) in enumerate(entries):
+				if lat < lat_r:
+					entries[i] = (next_hop, lat, 0)
+					capped = True
+			if capped:
+				self.touch(dst)
+
+	# Sort entries of destinations whose order may be stale.
+	def sort_dirty(self):
+		for dst in self.dirty:
+			entries = self.get(dst)
+			if entries and len(entries) > 1:
+				entries.sort(key=lambda e: (e[1], max([0] + [next_hop_entry[1] for next_hop_entry in self.get(e[0], ())])), reverse=True)
+		self.dirty.clear()
+
+	# Returns best entry for destination, or (None, None, None) if there is no known route.
+	def best(self, dst):
+		self.sort_dirty()
+		entries = self[dst]
+		return entries[0] if entries else (None, None, None)
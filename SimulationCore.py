@@ -0,0 +1,394 @@
+import math
+
+import ECRConfig
+from EnergyStats import EnergyStats
+import Helper as H
+import NetworkLogger as NL
+import NetworkTrace as NT
+import PacketTypes as PT
+
+
+# Class holding the simulation state and step loop. Has no dependency on any display so it can run headless.
+# Observers (such as the arcade view) can register a callback that is invoked after every time step.
+# cfg is the ECRConfig used by all nodes of the simulation (defaults to the values in Constants).
+# If vectorized is set, the battery, lat and packet estimates of the nodes are kept in the NumPy backed NodeStore, which
+# also performs node progress and link maintenance (requires numpy).
+# If skip_idle is set, run_until_done jumps over time steps in which no packets are in flight or scheduled by advancing
+# the nodes in closed form. Results then match the step-by-step simulation up to floating point rounding.
+# If trace_file is given, every packet event and the battery of every node at every time step are written to a binary
+# trace (see NetworkTrace).
+# energy_history is passed on to EnergyStats to keep the battery of every node at every time step ('memory' or a file).
+# If parallel is at least 2, steps with at least PARALLEL_MIN_PACKETS packets in flight handle the inboxes of the nodes
+# in that many processes (see ParallelPackets). Results are identical to the sequential simulation.
+class SimulationCore:
+    # Minimum number of idle time steps before they are fast-forwarded.
+    MIN_IDLE_GAP = 3
+
+    # Minimum number of in-flight packets for a step to be handled in parallel.
+    PARALLEL_MIN_PACKETS = 512
+
+    # Initialize simulation world.
+    # log_levels and log_background are passed on to the NetworkLogger.
+    def __init__(self, world_size, log_files, skip_idle=False, vectorized=False, cfg=None, log_levels=None, log_background=False, trace_file=None, energy_history=None, parallel=0):
+        self.world_width, self.world_height = world_size
+        self.cfg = cfg if cfg is not None else ECRConfig.ECRConfig()
+        self.skip_idle = skip_idle
+        self.vectorized = vectorized
+        self.parallel_handler = None
+        if parallel >= 2:
+            # Only import parallel handler when needed.
+            from ParallelPackets import ParallelPacketHandler
+            self.parallel_handler = ParallelPacketHandler(parallel, log_levels)
+
+        # Simulation time. Set to true once the simulation has finished and the logs are written.
+        self.ts = -1
+        self.done = False
+
+        # Network nodes indexed by id. Also the array backed node state if vectorized.
+        self.nodes = []
+        self.node_store = None
+
+        # Variables dealing with simulation of packets.
+        self.pkts_schedule = self.pkts_schedule_original_copy = []
+        self.pkts_inflight = []
+
+        # Network energy statistics. Created once the nodes are known.
+        self.energy_history = energy_history
+        self.energy = None
+
+        # Create logger. The trace writer is created once the nodes are known.
+        self.log = NL.NetworkLogger(*log_files, levels=log_levels, background=log_background)
+        self.trace_file = trace_file
+        self.trace = None
+
+        # Callbacks of the form f(core) called after every step.
+        self.observers = []
+
+    # Sets up simulation network.
+    # network_nodes is a list of nodes indexed by id. sim_packets is a list of (ts, src name, dst name, limit).
+    def setup(self, network_nodes, sim_packets):
+        # Nodes.
+        for node_id, node in enumerate(network_nodes):
+            x, y = node.xy
+            assert 0 < x < self.world_width and 0 < y < self.world_height
+            assert node.id == node_id, 'Nodes must be indexed by id!'
+            node.cfg = self.cfg
+        self.nodes = network_nodes
+        self.energy = EnergyStats(len(self.nodes), self.log, history=self.energy_history)
+        self.setup_schedule(sim_packets)
+
+        # Current packets in flight
+        self.pkts_inflight = []
+
+        if self.vectorized:
+            # Only import numpy backend when needed.
+            from NodeStore import NodeStore
+            self.node_store = NodeStore(self.nodes, self.cfg)
+
+        if self.trace_file is not None:
+            self.trace = NT.TraceWriter(self.trace_file, [n.name for n in self.nodes])
+
+    # Set simulation packet schedule using node ids. Sorted so packets to be sent now are at front of list.
+    def setup_schedule(self, sim_packets):
+        ids = {n.name: n.id for n in self.nodes}
+        for _, src, dst, _ in sim_packets:
+            assert src in ids and dst in ids, 'Unknown node in packet [{} -> {}]!'.format(src, dst)
+        sim_packets = [(t, ids[src], ids[dst], c) for t, src, dst, c in sim_packets]
+        self.pkts_schedule = sorted(sim_packets, key=lambda p: p[0], reverse=True)
+        self.pkts_schedule_original_copy = self.pkts_schedule.copy()
+
+    # Returns the state of the simulation for a checkpoint (see Checkpoint). The logs, trace, observers and the way the
+    # simulation is run (backends, parallel handling) are not part of it.
+    def get_state(self):
+        assert not self.done, 'Cannot save the state of a finished simulation!'
+        return {
+            'ts': self.ts,
+            'cfg': self.cfg.as_dict(),
+            'nodes': self.nodes,
+            'pkts_schedule': self.pkts_schedule,
+            'pkts_schedule_original_copy': self.pkts_schedule_original_copy,
+            'pkts_inflight': self.pkts_inflight,
+            'energy': self.energy.get_state(),
+            'num_errors': self.log.num_errors,
+            'pkt_buffer': list(self.log.pkt_buffer),
+        }
+
+    # Sets up simulation from a state returned by get_state instead of setup. The simulation continues after the time
+    # step of the state. Nodes use the cfg of this simulation, so runs resumed from the same state can try out
+    # different parameters.
+    def set_state(self, state):
+        self.setup(state['nodes'], [])
+        self.ts = state['ts']
+        self.pkts_schedule = state['pkts_schedule']
+        self.pkts_schedule_original_copy = state['pkts_schedule_original_copy']
+        self.pkts_inflight = state['pkts_inflight']
+        self.energy.set_state(state['energy'])
+        self.log.num_errors = state['num_errors']
+        self.log.pkt_buffer.extend(state['pkt_buffer'])
+
+    # Register callback to be invoked after each step.
+    def add_observer(self, callback):
+        self.observers.append(callback)
+
+    # Maintains nodes and links.
+    # Each node updates its lat estimate and sends to neighbors if enough time has passed.
+    def maintain_nodes_and_links(self):
+        # We update estimates every time-step. We update links to neighbors every other time-step as per ECR protocol.
+        update_estimates = True
+        update_links = (self.ts % 2 == 0)
+
+        if self.node_store is not None:
+            self.node_store.maintain(self.ts, update_links)
+            return
+
+        for n in self.nodes:
+            # Progress node.
+            n.progress(self.ts, update_estimates)
+
+            # Have each node send lat to neighbors if link maintenance is to be performed.
+            if update_links:
+                if not n.is_alive():
+                    for neighbor_id in n.links:
+                        self.nodes[neighbor_id].cleanup_dead_neighbor(n.id)
+                else:
+                    for neighbor_id in n.links:
+                        neighbor = self.nodes[neighbor_id]
+                        if neighbor.is_alive():
+                            # Have each node update its neighbor and vise versa.
+                            n.live_neighbors.add(neighbor_id)
+                            neighbor.live_neighbors.add(n.id)
+                            n.update_or_create_rmt_entry(dst=neighbor_id, next_hop=neighbor_id, lat_r=neighbor.lat, df=0, ts=self.ts)
+                            neighbor.update_or_create_rmt_entry(dst=n.id, next_hop=n.id, lat_r=n.lat, df=0, ts=self.ts)
+
+    # Update in-flight packets.
+    def update_packets(self):
+        # Handle all in-flight packets. Add any newly generated packets as well.
+        # In parallel mode the log records of each packet are replayed in order.
+        results = None
+        if self.parallel_handler is not None and len(self.pkts_inflight) >= self.PARALLEL_MIN_PACKETS:
+            results = self.parallel_handler.handle(self.nodes, self.pkts_inflight, self.ts)
+
+        new_inflight = []
+        for i, pkt in enumerate(self.pkts_inflight):
+            if results is None:
+                new_inflight_tmp, had_err = self.nodes[pkt.next_hop].handle_packet(pkt, self.ts, self.log)
+            else:
+                new_inflight_tmp, had_err, records = results[i]
+                for args, kwargs in records:
+                    self.log.write(*args, **kwargs)
+            new_inflight.extend(new_inflight_tmp)
+            if had_err:
+                self.log.write("   ERROR: Could not handle in-flight [{}] message at node [{}]!", PT.TYPE_NAMES[pkt.type], self.nodes[pkt.next_hop].name, is_error=True)
+                if self.trace is not None:
+                    self.trace.add_packet(self.ts, NT.EVENT_DROPPED, pkt)
+
+        # Handled packets can be reused for packets created in later steps.
+        PT.pool.release(self.pkts_inflight)
+        self.pkts_inflight = new_inflight
+
+    # Attempt to send scheduled packets
+    def attempt_scheduled_send(self):
+        if not self.pkts_schedule:
+            self.log.write("  No packets left to send! All required packets are in in-flight.")
+            return
+
+        # Try and send each packet that needs to be sent.
+        schedule_updated = []
+        while self.pkts_schedule and self.pkts_schedule[-1][0] == self.ts:
+            ts, src, dst, num = self.pkts_schedule[-1]
+
+            # Try and send packet.
+            new_inflight, packet_sent, error = self.nodes[src].attempt_to_send_packet(dst, ts, self.log)
+            if error:
+                self.log.write("  ERROR: Node [{}] cannot route packets to [{}]! The node may be offline or unreachable! Any future packets to this destination will not be sent!", self.nodes[src].name, self.nodes[dst].name, is_error=True)
+                num = 0
+            else:
+                self.pkts_inflight.extend(new_inflight)
+                if packet_sent:
+                    # Packet was sent.
+                    num -= 1
+
+            # Add new number to updated schedule for the next time-step.
+            if num != 0:
+                schedule_updated.append((ts + 1, src, dst, num))
+            self.pkts_schedule.pop()
+
+        self.pkts_schedule.extend(schedule_updated)
+
+    # Returns true if no packets are left to send or in flight.
+    def all_packets_done(self):
+        return not(self.pkts_schedule or self.pkts_inflight)
+
+    # Returns true if all simulated packets have been delivered or all nodes are dead.
+    def is_finished(self):
+        return self.all_packets_done() or all(not n.is_alive() for n in self.nodes)
+
+    # Advance the simulation by n time steps. Stops early if the simulation finishes.
+    # Returns the number of steps taken.
+    def step(self, n=1):
+        steps = 0
+        while steps < n and not self.done:
+            self.step_once()
+            steps += 1
+        return steps
+
+    # Advance the simulation by a single time step.
+    def step_once(self):
+        assert not self.done, "Simulation has already finished!"
+        self.ts += 1
+        self.log.write("ts: [{:05d}]  In-Flight at start [{}]", self.ts, len(self.pkts_inflight), is_full=True, is_packet=True, is_error=True)
+
+        # Update and maintain links.
+        # Each node updates its lat estimate and passes it to neighbors.
+        self.log.write("\nUpdating nodes and maintaining links if needed", level=NL.LEVEL_DEBUG)
+        self.maintain_nodes_and_links()
+
+        # Update inflight packets.
+        # Nodes on the receiving end of packets sent at previous ts handle them and create new packets in response.
+        self.log.write("\nUpdating the [{}] in-flight packets", len(self.pkts_inflight), level=NL.LEVEL_DEBUG)
+        self.update_packets()
+
+        # Send simulation packets.
+        # We try and send the packets that simulate application layer requests.
+        self.log.write("\nAttempting to send the required simulation packets", level=NL.LEVEL_DEBUG)
+        self.attempt_scheduled_send()
+
+        # Update energy statistics.
+        batteries = self.node_store.battery.tolist() if self.node_store is not None else [n.battery for n in self.nodes]
+        self.energy.add(self.ts, batteries)
+        if self.trace is not None:
+            self.trace.write_step(self.ts, self.pkts_inflight, batteries)
+
+        self.log.write("\nDone updating: there are now [{}] in-flight packets.", len(self.pkts_inflight), level=NL.LEVEL_DEBUG)
+        self.log.write("||||||||||||||||||||||||||||||||||", level=NL.LEVEL_DEBUG)
+
+        # Finish simulation if we are done.
+        if self.is_finished():
+            self.finish()
+
+        for callback in self.observers:
+            callback(self)
+
+    # Returns the next time step at which a packet needs to be handled or sent. None if there are no more packets.
+    # The schedule is kept ordered by time step (earliest at the end) so it doubles as the event queue.
+    def next_event_ts(self):
+        if self.pkts_inflight:
+            return self.ts + 1
+        return self.pkts_schedule[-1][0] if self.pkts_schedule else None
+
+    # Advance all nodes over idle time steps up to (at most) ts_target in closed form.
+    # The last two steps before ts_target are left to the regular step so the final link maintenance is exact.
+    # Stops short of any node dying so deaths are still handled step by step.
+    # Returns the number of time steps advanced.
+    def fast_forward(self, ts_target):
+        assert not self.pkts_inflight, "Cannot fast-forward with packets in flight!"
+        ts_start = self.ts
+
+        # Packets sent during the last step still need to be accounted for by a regular step.
+        if any(n.p_sample for n in self.nodes if n.is_alive()):
+            self.step_once()
+            if self.done:
+                return self.ts - ts_start
+
+        steps = min(ts_target - self.ts - 2, min([n.idle_steps_until_dead() for n in self.nodes] + [math.inf]) - 2)
+        if steps < 1:
+            return self.ts - ts_start
+
+        self.log.write("ts: [{:05d}]-[{:05d}]  Fast-forwarded [{}] idle time steps", self.ts + 1, self.ts + steps, steps, is_full=True, is_packet=True, is_error=True)
+        self.ts += steps
+        energies = [n.progress_idle(self.ts, steps) for n in self.nodes]
+        for i, batteries in enumerate(zip(*energies)):
+            self.energy.add(self.ts - steps + 1 + i, batteries)
+            if self.trace is not None:
+                self.trace.write_step(self.ts - steps + 1 + i, [], batteries)
+
+        return self.ts - ts_start
+
+    # Run simulation until every packet is delivered or the network is dead.
+    # max_steps can be used to bound the run. Returns the number of time steps taken.
+    def run_until_done(self, max_steps=None):
+        ts_start = self.ts
+        ts_limit = math.inf if max_steps is None else ts_start + max_steps
+        while not self.done and self.ts < ts_limit:
+            if self.skip_idle:
+                ts_next = self.next_event_ts()
+                if ts_next is not None and ts_next - self.ts > self.MIN_IDLE_GAP and self.fast_forward(min(ts_next - 1, ts_limit)):
+                    continue
+            self.step_once()
+        return self.ts - ts_start
+
+    # Returns dictionary of metrics summarizing the run so far:
+    #   - ts: last simulated time step.
+    #   - sent / received: number of RP packets sent and received along the routes requested by the packets file.
+    #   - delivery_ratio: received / sent (0 if nothing was sent).
+    #   - lifetime: time step at which the first node died. Last simulated time step if no node has died.
+    #   - dead_nodes: number of dead nodes.
+    #   - errors: number of handled routing errors.
+    def summary(self):
+        routes = {(src, dst) for _, src, dst, _ in self.pkts_schedule_original_copy}
+        sent = sum(self.nodes[src].num_rp_sent[dst] for src, dst in routes)
+        received = sum(self.nodes[dst].num_rp_received[src] for src, dst in routes)
+
+        # Nodes that start out dead do not count towards the network lifetime.
+        lifetime = self.energy.lifetime()
+        if lifetime is None or lifetime > self.ts:
+            lifetime = self.ts
+
+        return {
+            'ts': self.ts,
+            'sent': sent,
+            'received': received,
+            'delivery_ratio': received / sent if sent else 0.0,
+            'lifetime': lifetime,
+            'dead_nodes': sum(1 for n in self.nodes if not n.is_alive()),
+            'errors': self.log.num_errors,
+        }
+
+    # Finish simulation. Print performance stats to logs.
+    def finish(self, is_forced=False):
+        if self.done:
+            return
+        self.done = True
+
+        # Print details of why simulation ended.
+        if is_forced:
+            self.log.write("Closing simulation based on user request!", is_performance=True)
+        elif self.all_packets_done():
+            self.log.write("Simulation done! All simulated packets have been delivered.", is_performance=True)
+        else:
+            self.log.write("Simulation done! Enough network nodes are dead that packets can no longer be routed as required.", is_performance=True)
+
+        # Log simulation packet stats.
+        for t, src, dst, cnt in self.pkts_schedule_original_copy:
+            rt_key = H.get_route_key(src=src, dst=dst)
+            src_name, dst_name = self.nodes[src].name, self.nodes[dst].name
+
+            # Display link information
+            if cnt < 0:
+                log_str = "\nAt [{:05d}] Node [{}] was requested to send as many packets as possible to Node [{}]".format(t, src_name, dst_name)
+            else:
+                log_str = "\nAt [{:05d}] Node [{}] was requested to send [{}] packets to Node [{}]".format(t, src_name, cnt, dst_name)
+            self.log.write(log_str, is_full=False, is_performance=True)
+
+            # Display sent information.
+            self.log.write("  Node [{}] sent [{}] packets (including any necessary retries)", src_name, self.nodes[src].num_rp_sent[dst], is_full=False, is_performance=True)
+            # Bursts are kept up to date as packets are sent and received, so they only need to be formatted.
+            log_strs = ["    ts: [{:05d}]-[{:05d}]: [{}] sent [{}] packets through [{}]".format(t_start, t_end, src_name, rp_cnt, self.nodes[next_hop].name)
+                        for t_start, t_end, rp_cnt, next_hop in self.nodes[src].rp_sent[rt_key]]
+            for s in sorted(log_strs):
+                self.log.write(s, is_full=False, is_performance=True)
+
+            # Display received information.
+            self.log.write("  Node [{}] received [{}] packets", dst_name, self.nodes[dst].num_rp_received[src], is_full=False, is_performance=True)
+            log_strs = ["    ts: [{:05d}]-[{:05d}]: [{}] received [{}] packets via [{}]".format(t_start, t_end, dst_name, rp_cnt, self.nodes[prev_hop].name)
+                        for t_start, t_end, rp_cnt, prev_hop in self.nodes[dst].rp_received[rt_key]]
+            for s in sorted(log_strs):
+                self.log.write(s, is_full=False, is_performance=True)
+
+        # Energy statistics are logged as the simulation runs.
+        self.energy.close()
+
+        # Make sure all logs are written out.
+        self.log.flush()
+        if self.trace is not None:
+            self.trace.close()
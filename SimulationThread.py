@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import namedtuple
+
+# Immutable state of a simulation after a time step, published for a view to draw.
+#   ts: time step, batteries: battery of every node (by id), num_inflight: number of packets in flight,
+#   pkt_log: latest lines of the packets log, done: true once the simulation has finished.
+SimSnapshot = namedtuple('SimSnapshot', ('ts', 'batteries', 'num_inflight', 'pkt_log', 'done'))
+
+
+# Take snapshot of the current state of a simulation.
+def take_snapshot(sim):
+    return SimSnapshot(sim.ts, tuple(n.battery for n in sim.nodes), len(sim.pkts_inflight), tuple(sim.log.pkt_buffer), sim.done)
+
+
+# Steps a simulation on a background thread, so stepping does not depend on the frame rate of a view and a slow step
+# does not block it. While running, steps are taken continuously at up to rate steps per second (as fast as possible if
+# rate is 0). Single steps can be requested at any time. A new snapshot is published after every step; readers pick up
+# the latest one. Anything else that touches the simulation while the thread is alive must hold lock.
+class SimulationThread:
+    def __init__(self, sim, rate):
+        self.sim = sim
+        self.rate = rate
+        self.snapshot = take_snapshot(sim)
+        self.lock = threading.Lock()
+
+        # Stepping requests. Guarded by wake, which is notified when they change.
+        self.wake = threading.Condition()
+        self.running = False
+        self.pending_steps = 0
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.run, name='simulation', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Run or pause continuous stepping.
+    def set_running(self, running):
+        with self.wake:
+            self.running = running
+            self.wake.notify()
+
+    # Set target number of steps per second while running. 0 for as fast as possible.
+    def set_rate(self, rate):
+        with self.wake:
+            self.rate = rate
+            self.wake.notify()
+
+    # Take a single step.
+    def request_step(self):
+        with self.wake:
+            self.pending_steps += 1
+            self.wake.notify()
+
+    # Stop stepping. Waits for the current step to finish.
+    def stop(self):
+        with self.wake:
+            self.stopped = True
+            self.wake.notify()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    # Thread loop. Ends once the simulation has finished or the thread is stopped.
+    def run(self):
+        next_step_time = 0.0
+        while not self.sim.done:
+            # Wait until a step is due.
+            with self.wake:
+                while not self.stopped:
+                    if self.pending_steps:
+                        self.pending_steps -= 1
+                        break
+                    if self.running:
+                        delay = next_step_time - time.monotonic() if self.rate > 0 else 0
+                        if delay <= 0:
+                            break
+                        self.wake.wait(delay)
+                    else:
+                        self.wake.wait()
+                if self.stopped:
+                    return
+
+            start = time.monotonic()
+            with self.lock:
+                self.sim.step()
+                self.snapshot = take_snapshot(self.sim)
+            if self.rate > 0:
+                next_step_time = max(next_step_time, start) + 1 / self.rate
+            else:
+                # Let waiting threads take the lock between steps.
+                time.sleep(0)
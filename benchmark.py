@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import Constants as C
+import generate_network as GN
+import Helper as H
+import NetworkLogger as NL
+from SimulationCore import SimulationCore
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Program arguments.
+arg_parser = argparse.ArgumentParser(description='Benchmarks the simulation step on generated networks of increasing size and traffic load.')
+arg_parser.add_argument('--sizes', help='Number of nodes of the generated networks.', type=int, nargs='+', default=[50, 100, 200, 400])
+arg_parser.add_argument('--loads', help='Number of packets per flow.', type=int, nargs='+', default=[20, 100])
+arg_parser.add_argument('--topology', help='Topology of the generated networks.', type=str, choices=('geometric', 'grid', 'scale_free', 'clustered'), default='geometric')
+arg_parser.add_argument('--traffic', help='Traffic pattern of the generated networks.', type=str, choices=('sink', 'all_pairs', 'bursty'), default='sink')
+arg_parser.add_argument('--flows', help='Number of flows. Defaults to the generator default for the traffic pattern.', type=int, default=None)
+arg_parser.add_argument('--seed', help='Seed of the generated networks.', type=int, default=0)
+arg_parser.add_argument('--max_steps', help='Maximum number of time steps per run.', type=int, default=1000)
+arg_parser.add_argument('--skip_idle', help='Run with --skip_idle.', action='store_true')
+arg_parser.add_argument('--vectorized', help='Run with --vectorized (requires numpy).', action='store_true')
+arg_parser.add_argument('--with_logs', help='Write all log channels (to a temporary directory). By default logging is turned off.', action='store_true')
+arg_parser.add_argument('--tracemalloc', help='Also measure peak Python heap with tracemalloc (slows the run down considerably).', action='store_true')
+arg_parser.add_argument('--output', help='Output JSON file for the results.', type=str, default='logs/benchmark.json')
+arg_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.', type=str, default=None)
+arg_parser.add_argument('--tolerance', help='Relative slowdown of steps per second over the baseline reported as a regression.', type=float, default=0.10)
+
+# Timed phases of a step and of the run.
+STEP_PHASES = ('maintain_nodes_and_links', 'update_packets', 'attempt_scheduled_send')
+PHASES = ('load',) + STEP_PHASES + ('report',)
+
+
+# Wrap function to add its run time to phases[name].
+def timed(f, phases, name):
+    def wrapper(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            phases[name] += time.perf_counter() - t
+    return wrapper
+
+
+# Generate network, run the simulation and return measurements. Run in a fresh process so peak memory is per case.
+def run_case(case):
+    n, load, args = case
+    phases = dict.fromkeys(PHASES, 0.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        gen_argv = ['--output', os.path.join(tmp, 'bench'), '--nodes', str(n), '--topology', args.topology, '--traffic', args.traffic, '--limit', str(load), '--seed', str(args.seed)]
+        if args.flows is not None:
+            gen_argv += ['--flows', str(args.flows)]
+        gen_args = GN.arg_parser.parse_args(gen_argv)
+        names, locations, batteries, links, pkts = GN.generate(gen_args)
+        nodes_fn, packets_fn = GN.write_files(gen_args, names, locations, batteries, links, pkts)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        t = time.perf_counter()
+        nodes = H.load_nodes(nodes_fn, cache=False)
+        sim_packets = H.load_simulation_packets(packets_fn)
+        phases['load'] = time.perf_counter() - t
+
+        log_files = [os.path.join(tmp, 'log_{}.txt'.format(ch)) for ch in NL.CHANNELS]
+        log_levels = None if args.with_logs else {ch: NL.LEVEL_OFF for ch in NL.CHANNELS}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            sim = SimulationCore(C.WORLD_SIZE, log_files, skip_idle=args.skip_idle, vectorized=args.vectorized, log_levels=log_levels)
+            sim.setup(nodes, sim_packets)
+
+            # Instance attributes take precedence over the methods, so the step loop calls the timed versions.
+            for name in STEP_PHASES:
+                setattr(sim, name, timed(getattr(sim, name), phases, name))
+            sim.finish = timed(sim.finish, phases, 'report')
+
+            t = time.perf_counter()
+            sim.run_until_done(args.max_steps)
+            sim.finish(is_forced=not sim.done)
+            wall = time.perf_counter() - t
+            sim.log.close()
+
+        peak_traced = None
+        if args.tracemalloc:
+            peak_traced = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+    steps = sim.ts + 1
+    step_wall = wall - phases['report']
+    return {
+        'nodes': n,
+        'links': len(links),
+        'flows': len(pkts),
+        'load': load,
+        'steps': steps,
+        'wall_sec': wall,
+        'steps_per_sec': steps / step_wall if step_wall > 0 else None,
+        'phases_sec': phases,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None,
+        'peak_traced_kb': peak_traced,
+        'summary': sim.summary(),
+    }
+
+
+# Returns current git commit or None.
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Compare results to baseline results. Cases are matched by number of nodes and load.
+# Returns list of (case, baseline steps per second, steps per second) for cases slower than tolerance.
+def compare(results, baseline, tolerance):
+    base = {(r['nodes'], r['load']): r for r in baseline['results']}
+    regressions = []
+    print('\nComparison to baseline [{}]:'.format(baseline['meta'].get('commit')))
+    for r in results:
+        b = base.get((r['nodes'], r['load']))
+        if b is None or not b['steps_per_sec'] or not r['steps_per_sec']:
+            continue
+        ratio = r['steps_per_sec'] / b['steps_per_sec']
+        phase_ratios = ' '.join('{}={:.2f}x'.format(p, r['phases_sec'][p] / b['phases_sec'][p]) for p in PHASES if b['phases_sec'].get(p))
+        print('  nodes [{}] load [{}]: [{:.1f}] -> [{:.1f}] steps/sec ({:.2f}x) phase time {}'.format(r['nodes'], r['load'], b['steps_per_sec'], r['steps_per_sec'], ratio, phase_ratios))
+        if ratio < 1 - tolerance:
+            regressions.append(((r['nodes'], r['load']), b['steps_per_sec'], r['steps_per_sec']))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    cases = [(n, load, args) for n in args.sizes for load in args.loads]
+
+    results = []
+    for case in cases:
+        # A new worker process for every case so the peak memory of a case is not hidden by earlier ones.
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            r = executor.submit(run_case, case).result()
+        results.append(r)
+        print('nodes [{}] links [{}] flows [{}] load [{}]: [{}] steps in [{:.2f}] secs -> [{:.1f}] steps/sec, peak rss [{}] KB'.format(
+            r['nodes'], r['links'], r['flows'], r['load'], r['steps'], r['wall_sec'], r['steps_per_sec'] or 0, r['peak_rss_kb']))
+        print('  ' + ' '.join('{}={:.3f}s'.format(p, r['phases_sec'][p]) for p in PHASES))
+
+    meta = {
+        'commit': get_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'tolerance')},
+    }
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print('Results written to:', args.output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for (n, load), old, new in regressions:
+            print('REGRESSION: nodes [{}] load [{}] dropped from [{:.1f}] to [{:.1f}] steps/sec'.format(n, load, old, new))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,182 @@
+import argparse
+import math
+import os
+import random
+
+import Constants as C
+import Helper as H
+
+# Program arguments.
+arg_parser = argparse.ArgumentParser(description='Generates network and packets files for the simulation. Output is deterministic for a given seed.')
+arg_parser.add_argument('--output', help='Output prefix. Writes <prefix>_nodes.txt and <prefix>_packets.txt.', type=str, required=True)
+arg_parser.add_argument('--seed', help='Seed for random generation.', type=int, default=0)
+arg_parser.add_argument('--nodes', help='Number of nodes.', type=int, default=100)
+arg_parser.add_argument('--topology', help='Network topology.', type=str, choices=('geometric', 'grid', 'scale_free', 'clustered'), default='geometric')
+arg_parser.add_argument('--avg_degree', help='Target average number of neighbors for geometric and clustered topologies. Sets the radio range.', type=float, default=6)
+arg_parser.add_argument('--attach', help='Number of links added for each new node in scale-free topologies.', type=int, default=2)
+arg_parser.add_argument('--clusters', help='Number of clusters in clustered topologies.', type=int, default=5)
+arg_parser.add_argument('--cluster_spread', help='Standard deviation of node locations around their cluster center.', type=float, default=300)
+arg_parser.add_argument('--battery', help='Distribution of initial battery levels.', type=str, choices=('full', 'uniform', 'normal'), default='full')
+arg_parser.add_argument('--battery_min', help='Lowest battery level for uniform and normal distributions.', type=float, default=0.5)
+arg_parser.add_argument('--battery_max', help='Highest battery level for uniform and normal distributions.', type=float, default=1.0)
+arg_parser.add_argument('--battery_mean', help='Mean battery level for normal distribution.', type=float, default=0.8)
+arg_parser.add_argument('--battery_std', help='Standard deviation of battery level for normal distribution.', type=float, default=0.1)
+arg_parser.add_argument('--traffic', help='Traffic pattern: every source sends to one of the sinks, all (or --flows sampled) pairs, or repeated bursts between random pairs.', type=str, choices=('sink', 'all_pairs', 'bursty'), default='sink')
+arg_parser.add_argument('--sinks', help='Number of sinks for sink traffic.', type=int, default=1)
+arg_parser.add_argument('--flows', help='Number of source/destination pairs. Defaults to every non-sink node for sink traffic, all pairs for all_pairs traffic and the number of nodes for bursty traffic.', type=int, default=None)
+arg_parser.add_argument('--limit', help='Number of packets per flow (or per burst). -1 sends as many packets as possible.', type=int, default=50)
+arg_parser.add_argument('--start_spread', help='Flows (and bursts) start at a random time step in [0, start_spread].', type=int, default=100)
+arg_parser.add_argument('--bursts', help='Number of bursts per flow for bursty traffic.', type=int, default=3)
+
+
+# Random location inside the world (coordinates must lie strictly inside it).
+def random_location(rng):
+    return rng.randint(1, C.WORLD_SIZE[0] - 1), rng.randint(1, C.WORLD_SIZE[1] - 1)
+
+
+# Clamp location to inside of the world.
+def clamp_location(x, y):
+    return min(max(int(x), 1), C.WORLD_SIZE[0] - 1), min(max(int(y), 1), C.WORLD_SIZE[1] - 1)
+
+
+# Radio range at which n uniformly placed nodes have on average avg_degree neighbors.
+def radio_range(n, avg_degree):
+    return math.sqrt(avg_degree * C.WORLD_SIZE[0] * C.WORLD_SIZE[1] / (math.pi * max(n - 1, 1)))
+
+
+# Random geometric graph over the world.
+def gen_geometric(rng, args):
+    locations = [random_location(rng) for _ in range(args.nodes)]
+    return locations, H.proximity_links(locations, radio_range(args.nodes, args.avg_degree))
+
+
+# Grid with links between horizontal and vertical neighbors. The grid is as square as possible.
+def gen_grid(rng, args):
+    cols = math.ceil(math.sqrt(args.nodes))
+    rows = math.ceil(args.nodes / cols)
+    step_x, step_y = C.WORLD_SIZE[0] / (cols + 1), C.WORLD_SIZE[1] / (rows + 1)
+    locations = [clamp_location((i % cols + 1) * step_x, (i // cols + 1) * step_y) for i in range(args.nodes)]
+    links = []
+    for i in range(args.nodes):
+        if i % cols + 1 < cols and i + 1 < args.nodes:
+            links.append((i, i + 1))
+        if i + cols < args.nodes:
+            links.append((i, i + cols))
+    return locations, links
+
+
+# Scale-free graph by preferential attachment (Barabasi-Albert). Each new node links to attach existing nodes.
+def gen_scale_free(rng, args):
+    locations = [random_location(rng) for _ in range(args.nodes)]
+    m = max(1, min(args.attach, args.nodes - 1))
+    links = [(i, j) for i in range(m) for j in range(i + 1, m)]
+
+    # Every node appears once per link it has, so sampling from it picks nodes proportional to degree.
+    targets = [i for link in links for i in link] or list(range(m))
+    for i in range(m, args.nodes):
+        chosen = set()
+        while len(chosen) < m:
+            chosen.add(rng.choice(targets))
+        for j in sorted(chosen):
+            links.append((j, i))
+            targets.extend((i, j))
+    return locations, links
+
+
+# Clustered sensor field. Nodes are normally distributed around cluster centers and linked within radio range.
+# The first node of every cluster is its head. Each head is also linked to the nearest head of an earlier cluster so the
+# clusters are connected.
+def gen_clustered(rng, args):
+    k = max(1, min(args.clusters, args.nodes))
+    centers = [random_location(rng) for _ in range(k)]
+    locations = []
+    for i in range(args.nodes):
+        cx, cy = centers[i % k]
+        locations.append(centers[i] if i < k else clamp_location(rng.gauss(cx, args.cluster_spread), rng.gauss(cy, args.cluster_spread)))
+
+    # Range based on the area covered by the clusters (a disc of radius 2 * cluster_spread each) rather than the world.
+    r = math.sqrt(args.avg_degree * k * (2 * args.cluster_spread) ** 2 / max(args.nodes - 1, 1))
+    links = set(H.proximity_links(locations, r))
+    for i in range(1, k):
+        j = min(range(i), key=lambda h: (centers[h][0] - centers[i][0]) ** 2 + (centers[h][1] - centers[i][1]) ** 2)
+        links.add((j, i))
+    return locations, sorted(links)
+
+
+# Initial battery levels.
+def gen_batteries(rng, args):
+    if args.battery == 'full':
+        return [1.0] * args.nodes
+    if args.battery == 'uniform':
+        return [round(rng.uniform(args.battery_min, args.battery_max), 3) for _ in range(args.nodes)]
+    return [round(min(max(rng.gauss(args.battery_mean, args.battery_std), args.battery_min), args.battery_max), 3) for _ in range(args.nodes)]
+
+
+# Traffic as list of (ts, src, dst, limit).
+def gen_traffic(rng, args):
+    n = args.nodes
+    if args.traffic == 'sink':
+        sinks = rng.sample(range(n), min(args.sinks, n))
+        sink_set = set(sinks)
+        sources = [i for i in range(n) if i not in sink_set]
+        if args.flows is not None:
+            sources = rng.sample(sources, min(args.flows, len(sources)))
+        return [(rng.randint(0, args.start_spread), src, rng.choice(sinks), args.limit) for src in sources]
+
+    if args.traffic == 'all_pairs':
+        if args.flows is None:
+            pairs = [(src, dst) for src in range(n) for dst in range(n) if src != dst]
+        else:
+            # Sample indices into the list of all pairs (ordered by src, then dst) without building it.
+            pairs = [divmod(i, n - 1) for i in rng.sample(range(n * (n - 1)), min(args.flows, n * (n - 1)))]
+            pairs = [(src, dst + (dst >= src)) for src, dst in pairs]
+        return [(rng.randint(0, args.start_spread), src, dst, args.limit) for src, dst in pairs]
+
+    pkts = []
+    for _ in range(args.flows if args.flows is not None else n):
+        src, dst = rng.sample(range(n), 2)
+        for ts in sorted(rng.randint(0, args.start_spread) for _ in range(args.bursts)):
+            pkts.append((ts, src, dst, args.limit))
+    return pkts
+
+
+# Generate network and traffic for parsed arguments. Returns names, locations, batteries, links and packets.
+# links are pairs of node indices. Packets are sorted (ts, src, dst, limit) tuples of node indices.
+def generate(args):
+    assert args.nodes >= 2, 'Need at least two nodes!'
+    rng = random.Random(args.seed)
+
+    gen_topology = {'geometric': gen_geometric, 'grid': gen_grid, 'scale_free': gen_scale_free, 'clustered': gen_clustered}[args.topology]
+    locations, links = gen_topology(rng, args)
+    batteries = gen_batteries(rng, args)
+    pkts = sorted(gen_traffic(rng, args))
+    names = ['N{}'.format(i) for i in range(args.nodes)]
+    return names, locations, batteries, links, pkts
+
+
+# Write generated network to <prefix>_nodes.txt and <prefix>_packets.txt. Returns the two file names.
+def write_files(args, names, locations, batteries, links, pkts):
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    nodes_fn, packets_fn = args.output + '_nodes.txt', args.output + '_packets.txt'
+    with open(nodes_fn, 'w') as f:
+        f.write('# Generated by generate_network.py with seed [{}] topology [{}] battery [{}]\n'.format(args.seed, args.topology, args.battery))
+        f.write('# <NODE DEF>: Name X Y BatteryLevel\n# <LINK>: Node1 Node2\n\n')
+        f.writelines('{} {} {} {}\n'.format(name, x, y, b) for name, (x, y), b in zip(names, locations, batteries))
+        f.write('\n')
+        f.writelines('{} {}\n'.format(names[i], names[j]) for i, j in links)
+    with open(packets_fn, 'w') as f:
+        f.write('# Generated by generate_network.py with seed [{}] traffic [{}]\n'.format(args.seed, args.traffic))
+        f.write('# <SEND PACKETS UNLIMITED>: Src Dest StartTs\n# <SEND PACKETS LIMIT>: Src Dest StartTs Limit\n\n')
+        f.writelines('{} {} {}\n'.format(names[src], names[dst], ts) if limit < 0 else '{} {} {} {}\n'.format(names[src], names[dst], ts, limit) for ts, src, dst, limit in pkts)
+    return nodes_fn, packets_fn
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    names, locations, batteries, links, pkts = generate(args)
+    nodes_fn, packets_fn = write_files(args, names, locations, batteries, links, pkts)
+    print('Wrote [{}] nodes and [{}] links to [{}]'.format(len(names), len(links), nodes_fn))
+    print('Wrote [{}] packet flows to [{}]'.format(len(pkts), packets_fn))
@@ -1,18 +1,38 @@
 import argparse
 
+import Checkpoint
 import Constants as C
+from ECRConfig import ECRConfig
 import Helper as H
-from NetworkSimulation import NetworkSimulation as NS
+from SimulationCore import SimulationCore
 
 # Program arguments.
 arg_parser = argparse.ArgumentParser(description='Simulates the ECR routing protocol.')
-arg_parser.add_argument('--network_file', help='Path to network file defining nodes and links.', type=str, required=True)
-arg_parser.add_argument('--packets_file', help='Path to packets file defining what packets should be simulated at what times.', type=str, required=True)
+arg_parser.add_argument('--network_file', help='Path to network file defining nodes and links.', type=str, default=None)
+arg_parser.add_argument('--packets_file', help='Path to packets file defining what packets should be simulated at what times.', type=str, default=None)
+arg_parser.add_argument('--radio_range', help='Also link all nodes closer than this distance, so the network file need not list every link.', type=float, default=None)
 arg_parser.add_argument('--log_file_full', help='Output Log file', type=str, default='logs/log_full.txt')
 arg_parser.add_argument('--log_file_packets', help='Output Log file for simulation packets sent.', type=str, default='logs/log_packets.txt')
 arg_parser.add_argument('--log_file_errors', help='Output log file for errors.', type=str, default='logs/log_errors.txt')
 arg_parser.add_argument('--log_file_performance', help='Output Log file for performance.', type=str, default='logs/log_performance.txt')
 arg_parser.add_argument('--log_file_energy', help='Output Log file for energies.', type=str, default='logs/log_energy.txt')
+arg_parser.add_argument('--headless', help='Run the simulation to completion without opening a window.', action='store_true')
+arg_parser.add_argument('--skip_idle', help='Fast-forward over time steps with no packets in flight or scheduled (headless only).', action='store_true')
+arg_parser.add_argument('--vectorized', help='Use the NumPy backend for node and link updates (requires numpy).', action='store_true')
+arg_parser.add_argument('--sim_rate', help='Target number of time steps per second when auto stepping in the window (0 for as fast as possible). Steps run on their own thread, independent of the frame rate.', type=int, default=C.AUTO_SIM_DEFAULT_SPEED)
+arg_parser.add_argument('--max_steps', help='Maximum number of time steps to run in headless mode.', type=int, default=None)
+arg_parser.add_argument('--log_level', help='Level of a log channel as CHANNEL=LEVEL. Channels are full, packets, errors, performance and energy. Levels are 0 (off), 1 (info) and 2 (debug, default). Can be repeated.', type=str, action='append', default=[])
+arg_parser.add_argument('--log_background', help='Write log files from a separate writer thread.', action='store_true')
+arg_parser.add_argument('--parallel', help='Handle in-flight packets of busy time steps in this many processes (requires os.fork). Results are unchanged.', type=int, default=0)
+arg_parser.add_argument('--regions', help='Split the network into this many regions by node coordinates, each simulated in its own process (headless only). Results are unchanged.', type=int, default=0)
+arg_parser.add_argument('--profile', help='Profile the simulation and print a summary at the end.', action='store_true')
+arg_parser.add_argument('--profile_interval', help='With --profile, take a snapshot every this many time steps (0 for none).', type=int, default=0)
+arg_parser.add_argument('--profile_file', help='With --profile, append snapshots as JSON lines to this file.', type=str, default=None)
+arg_parser.add_argument('--energy_history', help="Keep the battery of every node at every time step: 'memory' for an in-memory NumPy array or a path for a memory-mapped file (requires numpy).", type=str, default=None)
+arg_parser.add_argument('--trace_file', help='Optional binary trace of all packet events and node batteries. Read with NetworkTrace.py.', type=str, default=None)
+arg_parser.add_argument('--checkpoint_interval', help='Save a checkpoint of the simulation every this many time steps (0 for none).', type=int, default=0)
+arg_parser.add_argument('--checkpoint_file', help='Checkpoint file. May contain {ts} to keep every checkpoint.', type=str, default='logs/checkpoint.ckpt')
+arg_parser.add_argument('--resume', help='Resume the simulation from a checkpoint instead of the network and packets files. Logs start at the checkpoint.', type=str, default=None)
 args = arg_parser.parse_args()
 
 if __name__ == '__main__':
@@ -20,24 +40,69 @@ if __name__ == '__main__':
 
     # Create simulation environment.
     log_files = (args.log_file_full, args.log_file_packets, args.log_file_errors, args.log_file_performance, args.log_file_energy)
-    ns = NS(C.WORLD_SIZE, C.SCREEN_SIZE, log_files)
+    log_levels = {channel: int(level) for channel, level in (arg.split('=') for arg in args.log_level)}
+    if args.resume is None and (args.network_file is None or args.packets_file is None):
+        arg_parser.error('--network_file and --packets_file are required unless resuming from a checkpoint.')
+    if args.profile and args.parallel:
+        arg_parser.error('--profile does not support --parallel, as work done in the forked processes would not be counted.')
+    if args.regions:
+        if not args.headless or args.skip_idle or args.vectorized or args.parallel or args.trace_file or args.profile or args.checkpoint_interval or args.resume:
+            arg_parser.error('--regions requires --headless and does not support --skip_idle, --vectorized, --parallel, --trace_file, --profile or checkpoints.')
+        # Only import region simulation when it is needed. Nodes are built by the region workers.
+        from RegionSimulation import RegionSimulation
+        sim = RegionSimulation(C.WORLD_SIZE, log_files, args.regions, log_levels=log_levels, log_background=args.log_background, energy_history=args.energy_history)
+        topo = H.load_topology(args.network_file)
+        if args.radio_range is not None:
+            topo.add_proximity_links(args.radio_range)
+        sim.setup(topo, H.load_simulation_packets(args.packets_file))
+    elif args.resume is not None:
+        # Continue with the parameters of the checkpoint.
+        state = Checkpoint.load(args.resume)
+        sim = SimulationCore(C.WORLD_SIZE, log_files, skip_idle=args.skip_idle, vectorized=args.vectorized, cfg=ECRConfig(**state['cfg']), log_levels=log_levels, log_background=args.log_background, trace_file=args.trace_file, energy_history=args.energy_history, parallel=args.parallel)
+        sim.set_state(state)
+        print('Resumed from checkpoint [{}] at time step [{}]'.format(args.resume, sim.ts))
+    else:
+        sim = SimulationCore(C.WORLD_SIZE, log_files, skip_idle=args.skip_idle, vectorized=args.vectorized, log_levels=log_levels, log_background=args.log_background, trace_file=args.trace_file, energy_history=args.energy_history, parallel=args.parallel)
 
-    # Setup network and get packets that need to be simulated.
-    nodes_dict = H.load_nodes(args.network_file)
-    sim_packets = H.load_simulation_packets(args.packets_file)
-    ns.setup(nodes_dict, sim_packets)
+        # Setup network and get packets that need to be simulated.
+        nodes_dict = H.load_nodes(args.network_file, radio_range=args.radio_range)
+        sim_packets = H.load_simulation_packets(args.packets_file)
+        sim.setup(nodes_dict, sim_packets)
+
+    if args.checkpoint_interval:
+        Checkpoint.Checkpointer(sim, args.checkpoint_interval, args.checkpoint_file).install()
+
+    # Only import profiler when it is needed.
+    profiler = None
+    if args.profile:
+        from Profiler import Profiler
+        profiler = Profiler(sim, interval=args.profile_interval, snapshot_file=args.profile_file, echo=args.headless)
+        profiler.install()
 
     # Run simulation.
-    ns.run()
+    if args.headless:
+        sim.run_until_done(args.max_steps)
+        sim.finish(is_forced=not sim.done)
+    else:
+        # Only import the arcade view when it is needed so headless runs do not require a display.
+        from NetworkSimulation import NetworkSimulation as NS
+        ns = NS(C.SCREEN_SIZE, sim, sim_rate=args.sim_rate)
+        ns.run()
+
+    sim.log.close()
+    if profiler is not None:
+        profiler.uninstall()
 
     # Print results.
     print('|||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||')
     print('Simulation Done!')
-    print("Simulation lasted [{}] simulation time steps or [{}] secs in real time".format(ns.ts, ns.ts / 1000))
-    print("There were [{}] instances of a handled error in routing packets.".format(ns.log.num_errors))
+    print("Simulation lasted [{}] simulation time steps or [{}] secs in real time".format(sim.ts, sim.ts / 1000))
+    print("There were [{}] instances of a handled error in routing packets.".format(sim.log.num_errors))
+    if profiler is not None:
+        print(profiler.format_summary())
     print("\nFor details see the various log files:")
     print("  Full log file (contains terminal output):", log_files[0])
     print("  Packets log file (contains log of how individual simulation packets were sent, forwarded, and received):", log_files[1])
     print("  Error log file (contains log of any errors handled by the protocol. Includes necessary resending of packets):", log_files[2])
     print("  Performance log file (contains log of how packets were routed):", log_files[3])
-    print("  Energy log file (contains log of average network energy at each simulation time-step):", log_files[4])
+    print("  Energy log file (contains log of mean, min and percentiles of network energy and number of dead nodes at each simulation time-step):", log_files[4])
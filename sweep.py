@@ -0,0 +1,119 @@
+import argparse
+import csv
+import glob
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import Checkpoint
+import Constants as C
+import Helper as H
+import NetworkLogger as NL
+from ECRConfig import ECRConfig
+from SimulationCore import SimulationCore
+
+# Program arguments.
+arg_parser = argparse.ArgumentParser(description='Runs the ECR simulation over a grid or random sample of ECR parameters.')
+arg_parser.add_argument('--scenarios', help='Network files to simulate. Each must have a matching *_packets.txt file next to its *_nodes.txt file.', type=str, nargs='+', default=sorted(glob.glob('config_files/*_nodes.txt')))
+arg_parser.add_argument('--resume', help='Checkpoints to start the runs from instead of the scenarios. Parameters that are not swept keep the values of the checkpoint.', type=str, nargs='+', default=None)
+arg_parser.add_argument('--grid', help='Grid values for a parameter as NAME=V1,V2,... (ex: d_c=0.001,0.002). Can be repeated.', type=str, action='append', default=[])
+arg_parser.add_argument('--random', help='Range to sample a parameter from as NAME=LOW:HIGH (ex: alpha=0.5:0.9). Can be repeated.', type=str, action='append', default=[])
+arg_parser.add_argument('--samples', help='Number of random samples to draw for the --random parameters.', type=int, default=1)
+arg_parser.add_argument('--seed', help='Seed for random sampling.', type=int, default=0)
+arg_parser.add_argument('--workers', help='Number of worker processes.', type=int, default=os.cpu_count())
+arg_parser.add_argument('--max_steps', help='Maximum number of time steps per run.', type=int, default=None)
+arg_parser.add_argument('--output', help='Output CSV file for the results table.', type=str, default='logs/sweep_results.csv')
+
+# Integer parameters. All others are floats.
+INT_PARAMS = ('RD_Timeout', 'RD_Resend', 'RU_MinInterval')
+
+# Metrics reported for each run. See SimulationCore.summary.
+METRICS = ('ts', 'sent', 'received', 'delivery_ratio', 'lifetime', 'dead_nodes', 'errors')
+
+
+# Parse parameter value.
+def parse_value(name, value):
+    assert name in ECRConfig.PARAMS, 'Unknown ECR parameter [{}]! Must be one of {}'.format(name, ECRConfig.PARAMS)
+    return int(value) if name in INT_PARAMS else float(value)
+
+
+# Build list of parameter dictionaries from the grid and random arguments.
+# Every grid combination is run with every random sample.
+def build_param_sets(grid_args, random_args, samples, seed):
+    grid = []
+    for arg in grid_args:
+        name, values = arg.split('=')
+        grid.append([(name, parse_value(name, v)) for v in values.split(',')])
+
+    ranges = []
+    for arg in random_args:
+        name, bounds = arg.split('=')
+        low, high = (parse_value(name, b) for b in bounds.split(':'))
+        ranges.append((name, low, high))
+
+    rng = random.Random(seed)
+    sampled = []
+    for _ in range(samples if ranges else 1):
+        sampled.append([(name, rng.randint(low, high) if name in INT_PARAMS else rng.uniform(low, high)) for name, low, high in ranges])
+
+    return [dict(combo + tuple(sample)) for combo in itertools.product(*grid) for sample in sampled]
+
+
+# Find packets file for a network file.
+def get_packets_file(nodes_file):
+    assert nodes_file.endswith('_nodes.txt'), 'Network file [{}] must end with _nodes.txt!'.format(nodes_file)
+    return nodes_file[:-len('_nodes.txt')] + '_packets.txt'
+
+
+# Run a single simulation headless. All log channels are turned off. Returns row of the results table.
+# Runs either start from a network file or resume from a checkpoint file (the other is None). max_steps counts from the
+# time step the run starts at.
+def run_simulation(job):
+    nodes_file, checkpoint_file, params, max_steps = job
+    log_levels = {channel: NL.LEVEL_OFF for channel in NL.CHANNELS}
+    if checkpoint_file is not None:
+        state = Checkpoint.load(checkpoint_file)
+        sim = SimulationCore(C.WORLD_SIZE, [os.devnull] * 5, cfg=ECRConfig(**dict(state['cfg'], **params)), log_levels=log_levels)
+        sim.set_state(state)
+        scenario = os.path.basename(checkpoint_file)
+    else:
+        sim = SimulationCore(C.WORLD_SIZE, [os.devnull] * 5, cfg=ECRConfig(**params), log_levels=log_levels)
+        sim.setup(H.load_nodes(nodes_file), H.load_simulation_packets(get_packets_file(nodes_file)))
+        scenario = os.path.basename(nodes_file)[:-len('_nodes.txt')]
+    sim.run_until_done(max_steps)
+    sim.finish(is_forced=not sim.done)
+    summary = sim.summary()
+
+    row = {'scenario': scenario}
+    row.update(sim.cfg.as_dict())
+    row.update(summary)
+    return row
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    param_sets = build_param_sets(args.grid, args.random, args.samples, args.seed)
+    if args.resume:
+        jobs = [(None, checkpoint_file, params, args.max_steps) for checkpoint_file in args.resume for params in param_sets]
+    else:
+        jobs = [(nodes_file, None, params, args.max_steps) for nodes_file in args.scenarios for params in param_sets]
+    print('Running [{}] simulations over [{}] worker processes'.format(len(jobs), args.workers))
+
+    # Runs are independent, so they are spread over worker processes. Results keep the order of the jobs.
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        rows = []
+        for row in executor.map(run_simulation, jobs):
+            rows.append(row)
+            print('  [{}/{}] {} {}'.format(len(rows), len(jobs), row['scenario'], ' '.join('{}={}'.format(m, row[m]) for m in METRICS)))
+
+    # Write results table.
+    columns = ('scenario',) + ECRConfig.PARAMS + METRICS
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Results written to:', args.output)
@@ -0,0 +1,62 @@
+import unittest
+
+import Helper as H
+
+
+class TimeCacheTest(unittest.TestCase):
+    # Count calls to set_width of cache.
+    def count_set_width(self, cache):
+        calls = []
+        set_width = cache.set_width
+        cache.set_width = lambda width: (calls.append(width), set_width(width))
+        return calls
+
+    def test_keys_within_horizon_are_kept(self):
+        cache = H.TimeCache()
+        for ts in range(100):
+            cache.set(ts, ts, 10)
+            for key in range(max(ts - 10, 0), ts + 1):
+                self.assertEqual(cache.get(key), key)
+        self.assertLessEqual(len(cache), 20)
+
+    def test_old_keys_are_forgotten(self):
+        cache = H.TimeCache()
+        cache.set('a', 0, 5)
+        cache.set('b', 20, 5)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', -1), -1)
+        self.assertEqual(cache.get('b'), 20)
+
+    def test_keys_set_at(self):
+        cache = H.TimeCache()
+        cache.set('a', 3, 4)
+        cache.set('b', 4, 4)
+        cache.set('c', 4, 4)
+        self.assertEqual(sorted(cache.keys_set_at(4)), ['b', 'c'])
+
+    def test_new_horizon_rebuilds_once(self):
+        cache = H.TimeCache()
+        calls = self.count_set_width(cache)
+        for ts in range(50):
+            cache.set(ts, ts, 8)
+        self.assertEqual(calls, [8])
+        for key in range(42, 50):
+            self.assertEqual(cache.get(key), key)
+
+    def test_horizon_zero(self):
+        cache = H.TimeCache()
+        calls = self.count_set_width(cache)
+        for ts in range(20):
+            for key in range(5):
+                cache.set((ts, key), ts, 0)
+            # Keys set in the current time step are all found.
+            for key in range(5):
+                self.assertEqual(cache.get((ts, key)), ts)
+            self.assertEqual(sorted(cache.keys_set_at(ts)), [(ts, key) for key in range(5)])
+        # The buckets are not rebuilt on every set and the size stays bounded.
+        self.assertEqual(calls, [])
+        self.assertLessEqual(len(cache), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()